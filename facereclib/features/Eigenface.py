@@ -13,19 +13,25 @@ from .. import utils
 class Eigenface (Extractor):
   """Extracts grid graphs from the images"""
 
-  def __init__(self, subspace_dimension):
+  def __init__(self, subspace_dimension, training_chunk_size = None, randomized_training = False):
     # We have to register that this function will need a training step
-    Extractor.__init__(self, requires_training = True, subspace_dimension = subspace_dimension)
+    Extractor.__init__(self, requires_training = True, subspace_dimension = subspace_dimension, training_chunk_size = training_chunk_size, randomized_training = randomized_training)
     self.m_subspace_dimension = subspace_dimension
+    self.m_training_chunk_size = training_chunk_size
+    self.m_randomized_training = randomized_training
 
   def train(self, image_list, extractor_file):
     """Trains the eigenface extractor using the given list of training images"""
-    # Initializes an array for the data
-    data = numpy.vstack([image.flatten() for image in image_list])
-
-    utils.info("  -> Training LinearMachine using PCA (SVD)")
-    t = bob.learn.linear.PCATrainer()
-    self.m_machine, __eig_vals = t.train(data)
+    if self.m_training_chunk_size:
+      # train PCA without stacking the training images
+      self.m_machine, __eig_vals = utils.pca.train(image_list, self.m_subspace_dimension, self.m_training_chunk_size, randomized = self.m_randomized_training)
+    else:
+      # Initializes an array for the data
+      data = utils.vstack_features(image_list, flatten = True)
+
+      utils.info("  -> Training LinearMachine using PCA (SVD)")
+      t = bob.learn.linear.PCATrainer()
+      self.m_machine, __eig_vals = t.train(data)
     # Machine: get shape, then resize
     self.m_machine.resize(self.m_machine.shape[0], self.m_subspace_dimension)
     self.m_machine.save(bob.io.base.HDF5File(extractor_file, "w"))
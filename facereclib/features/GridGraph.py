@@ -8,6 +8,7 @@ import bob.io.base
 import numpy
 import math
 from .Extractor import Extractor
+from .. import utils
 
 class GridGraph (Extractor):
   """Extracts grid graphs from the images"""
@@ -37,6 +38,9 @@ class GridGraph (Extractor):
       node_distance = None,    # one or two integral values
       image_resolution = None, # always two integral values
       first_node = None,       # one or two integral values, or None -> automatically determined
+
+      # how to store the graphs
+      save_graph_as_array = False # if enabled, the graph is written as one (node, 2*wavelet) array instead of a list of jets
   ):
 
     # call base class constructor
@@ -58,7 +62,8 @@ class GridGraph (Extractor):
         nodes_below_eyes = nodes_below_eyes,
         node_distance = node_distance,
         image_resolution = image_resolution,
-        first_node = first_node
+        first_node = first_node,
+        save_graph_as_array = save_graph_as_array
     )
 
     # create Gabor wavelet transform class
@@ -104,6 +109,7 @@ class GridGraph (Extractor):
       )
 
     self.m_normalize_jets = normalize_gabor_jets
+    self.m_save_graph_as_array = save_graph_as_array
     self.m_trafo_image = None
 
   def __call__(self, image):
@@ -126,7 +132,14 @@ class GridGraph (Extractor):
 
   def save_feature(self, feature, feature_file):
     feature_file = feature_file if isinstance(feature_file, bob.io.base.HDF5File) else bob.io.base.HDF5File(feature_file, 'w')
-    bob.ip.gabor.save_jets(feature, feature_file)
+    if self.m_save_graph_as_array:
+      utils.gabor.save(utils.gabor.graph_to_array(feature), feature_file)
+    else:
+      bob.ip.gabor.save_jets(feature, feature_file)
 
   def read_feature(self, feature_file):
-    return bob.ip.gabor.load_jets(bob.io.base.HDF5File(feature_file))
+    """Reads the graph from file; graphs that were written as arrays are returned as a (node, 2*wavelet) array."""
+    feature_file = bob.io.base.HDF5File(feature_file)
+    if utils.gabor.is_array_file(feature_file):
+      return utils.gabor.load(feature_file)
+    return bob.ip.gabor.load_jets(feature_file)
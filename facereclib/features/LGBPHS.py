@@ -5,8 +5,11 @@
 import bob.ip.gabor
 import bob.ip.base
 
+import os
 import numpy
 import math
+import functools
+import multiprocessing.pool
 
 from .Extractor import Extractor
 from .. import utils
@@ -38,7 +41,9 @@ class LGBPHS (Extractor):
       lbp_add_average = False,
       # histogram options
       sparse_histogram = False,
-      split_histogram = None
+      split_histogram = None,
+      # the number of threads used to compute the histograms of the Gabor wavelet responses
+      number_of_threads = 1
   ):
     """Initializes the local Gabor binary pattern histogram sequence tool chain with the given file selector object"""
 
@@ -64,7 +69,8 @@ class LGBPHS (Extractor):
         lbp_compare_to_average = lbp_compare_to_average,
         lbp_add_average = lbp_add_average,
         sparse_histogram = sparse_histogram,
-        split_histogram = split_histogram
+        split_histogram = split_histogram,
+        number_of_threads = number_of_threads
     )
 
     # block parameters
@@ -84,6 +90,7 @@ class LGBPHS (Extractor):
         dc_free = gabor_dc_free
     )
     self.m_trafo_image = None
+    self.m_layers = None
     self.m_use_phases = use_gabor_phases
 
     self.m_lbp = bob.ip.base.LBP(
@@ -101,76 +108,95 @@ class LGBPHS (Extractor):
     self.m_sparse = sparse_histogram
     if self.m_sparse and self.m_split:
       raise ValueError("Sparse histograms cannot be split! Check your setup!")
+    if self.m_split not in (None, 'blocks', 'wavelets', 'both'):
+      raise ValueError("The split parameter must be one of ['blocks', 'wavelets', 'both'] or None")
 
+    self.m_number_of_threads = number_of_threads
+    # the thread pool and the process that created it
+    self.m_pool = None
+    self.m_pool_process = None
 
-  def __fill__(self, lgbphs_array, lgbphs_blocks, j):
-    """Copies the given array into the given blocks"""
-    # fill array in the desired shape
+
+  def __shape__(self, jet_length):
+    """Returns the shape of the extracted histogram sequence"""
     if self.m_split is None:
-      start = j * self.m_n_bins * self.m_n_blocks
-      for b in range(self.m_n_blocks):
-        lgbphs_array[start + b * self.m_n_bins : start + (b+1) * self.m_n_bins] = lgbphs_blocks[b][:]
+      return (self.m_n_blocks * self.m_n_bins * jet_length,)
     elif self.m_split == 'blocks':
-      for b in range(self.m_n_blocks):
-        lgbphs_array[b, j * self.m_n_bins : (j+1) * self.m_n_bins] = lgbphs_blocks[b][:]
+      return (self.m_n_blocks, self.m_n_bins * jet_length)
+    elif self.m_split == 'wavelets':
+      return (jet_length, self.m_n_bins * self.m_n_blocks)
+    elif self.m_split == 'both':
+      return (jet_length * self.m_n_blocks, self.m_n_bins)
+
+  def __target__(self, lgbphs_array, j):
+    """Returns the (n_blocks, n_bins) view of the given array, into which the histograms of layer j are written directly;
+    None is returned when the histograms of the layer are not contiguous in the array."""
+    if self.m_split is None:
+      start = j * self.m_n_bins * self.m_n_blocks
+      return lgbphs_array[start : start + self.m_n_bins * self.m_n_blocks].reshape((self.m_n_blocks, self.m_n_bins))
     elif self.m_split == 'wavelets':
-      for b in range(self.m_n_blocks):
-        lgbphs_array[j, b * self.m_n_bins : (b+1) * self.m_n_bins] = lgbphs_blocks[b][:]
+      return lgbphs_array[j].reshape((self.m_n_blocks, self.m_n_bins))
     elif self.m_split == 'both':
-      for b in range(self.m_n_blocks):
-        lgbphs_array[j * self.m_n_blocks + b, 0 : self.m_n_bins] = lgbphs_blocks[b][:]
+      return lgbphs_array[j * self.m_n_blocks : (j+1) * self.m_n_blocks]
+    return None
+
+  def __fill__(self, lgbphs_array, lgbphs_blocks, j):
+    """Copies the given array into the given blocks"""
+    target = self.__target__(lgbphs_array, j)
+    if target is not None:
+      target[:] = lgbphs_blocks
+    else:
+      # split_histogram == 'blocks'
+      lgbphs_array[:, j * self.m_n_bins : (j+1) * self.m_n_bins] = lgbphs_blocks
+
+  def __extract_layer__(self, lgbphs_array, j):
+    """Computes the LBP histograms of layer j and writes them into the given array"""
+    target = self.__target__(lgbphs_array, j)
+    if target is not None:
+      bob.ip.base.lbphs(self.m_layers[j], self.m_lbp, self.m_block_size, self.m_block_overlap, target)
+    else:
+      self.__fill__(lgbphs_array, bob.ip.base.lbphs(self.m_layers[j], self.m_lbp, self.m_block_size, self.m_block_overlap), j)
+
+  def __pool__(self):
+    """Returns the thread pool of the current process, which is created at the first call.
+    Processes that are forked later (e.g., with ``--parallel``) do not inherit the threads of the pool, so they create their own pool."""
+    if self.m_pool is None or self.m_pool_process != os.getpid():
+      self.m_pool = multiprocessing.pool.ThreadPool(self.m_number_of_threads)
+      self.m_pool_process = os.getpid()
+    return self.m_pool
 
   def __call__(self, image):
     """Extracts the local Gabor binary pattern histogram sequence from the given image"""
+    jet_length = self.m_gwt.number_of_wavelets * (2 if self.m_use_phases else 1)
+
     # perform GWT on image
     if self.m_trafo_image is None or self.m_trafo_image.shape[1:3] != image.shape:
       # create trafo image
       self.m_trafo_image = numpy.ndarray((self.m_gwt.number_of_wavelets, image.shape[0], image.shape[1]), numpy.complex128)
+      # create the absolute values (and the phases) of all layers of the trafo image
+      self.m_layers = numpy.ndarray((jet_length, image.shape[0], image.shape[1]), numpy.float64)
 
     # perform Gabor wavelet transform
     self.m_gwt.transform(image, self.m_trafo_image)
 
-    jet_length = self.m_gwt.number_of_wavelets * (2 if self.m_use_phases else 1)
-
-    lgbphs_array = None
-    # iterate through the layers of the trafo image
-    for j in range(self.m_gwt.number_of_wavelets):
-      # compute absolute part of complex response
-      abs_image = numpy.abs(self.m_trafo_image[j])
-      # Computes LBP histograms
-      abs_blocks = bob.ip.base.lbphs(abs_image, self.m_lbp, self.m_block_size, self.m_block_overlap)
-
-      # Converts to Blitz array (of different dimensionalities)
-      self.m_n_bins = abs_blocks.shape[1]
-      self.m_n_blocks = abs_blocks.shape[0]
-
-      if self.m_split is None:
-        shape = (self.m_n_blocks * self.m_n_bins * jet_length,)
-      elif self.m_split == 'blocks':
-        shape = (self.m_n_blocks, self.m_n_bins * jet_length)
-      elif self.m_split == 'wavelets':
-        shape = (jet_length, self.m_n_bins * self.m_n_blocks)
-      elif self.m_split == 'both':
-        shape = (jet_length * self.m_n_blocks, self.m_n_bins)
-      else:
-        raise ValueError("The split parameter must be one of ['blocks', 'wavelets', 'both'] or None")
-
-      # create new array if not done yet
-      if lgbphs_array is None:
-        lgbphs_array = numpy.ndarray(shape, 'float64')
-
-      # fill the array with the absolute values of the Gabor wavelet transform
-      self.__fill__(lgbphs_array, abs_blocks, j)
-
-      if self.m_use_phases:
-        # compute phase part of complex response
-        phase_image = numpy.angle(self.m_trafo_image[j])
-        # Computes LBP histograms
-        phase_blocks = bob.ip.base.lbphs(phase_image, self.m_lbp, self.m_block_size, self.m_block_overlap)
-        # fill the array with the phases at the end of the blocks
-        self.__fill__(lgbphs_array, phase_blocks, j + self.m_gwt.number_of_wavelets)
-
+    # compute absolute part of complex response; the phases are stored after the absolute values
+    numpy.abs(self.m_trafo_image, out = self.m_layers[:self.m_gwt.number_of_wavelets])
+    if self.m_use_phases:
+      # compute phase part of complex response, i.e., numpy.angle
+      numpy.arctan2(self.m_trafo_image.imag, self.m_trafo_image.real, out = self.m_layers[self.m_gwt.number_of_wavelets:])
+
+    # Computes LBP histograms of the first layer, which define the size of the histogram sequence
+    blocks = bob.ip.base.lbphs(self.m_layers[0], self.m_lbp, self.m_block_size, self.m_block_overlap)
+    self.m_n_blocks, self.m_n_bins = blocks.shape
+
+    # create the array and fill it with the histograms of all layers
+    lgbphs_array = numpy.ndarray(self.__shape__(jet_length), numpy.float64)
+    self.__fill__(lgbphs_array, blocks, 0)
+    if self.m_number_of_threads > 1:
+      self.__pool__().map(functools.partial(self.__extract_layer__, lgbphs_array), range(1, jet_length))
+    else:
+      for j in range(1, jet_length):
+        self.__extract_layer__(lgbphs_array, j)
 
     # return the concatenated list of all histograms
     return utils.histogram.sparsify(lgbphs_array) if self.m_sparse else lgbphs_array
-
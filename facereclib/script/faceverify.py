@@ -56,23 +56,31 @@ class ToolChainExecutorZT (ToolChainExecutor.ToolChainExecutor):
         enroller_file = self.m_configuration.enroller_file,
         model_directories = models_directories,
         score_directories = score_directories,
-        zt_score_directories = zt_score_directories
+        zt_score_directories = zt_score_directories,
+        use_feature_store = self.m_args.feature_store
     )
 
     # create the tool chain to be used to actually perform the parts of the experiments
-    self.m_tool_chain = toolchain.ToolChain(self.m_file_selector, self.m_args.write_compressed_score_files)
+    self.m_tool_chain = toolchain.ToolChain(self.m_file_selector, self.m_args.write_compressed_score_files, self.m_args.parallel if not args.grid else 1, self.m_args.zt_norm_in_memory and not args.grid, self.m_args.training_data_storage, self.m_args.prefetch)
 
 
   def execute_tool_chain(self):
     """Executes the ZT tool chain on the local machine."""
+    if self.m_args.streaming:
+      # in streaming mode, the data is preprocessed and features are extracted separately only for the training of the extractor and the projector
+      preprocessing_groups = ['world'] if self.m_extractor.requires_training or self.m_tool.requires_projector_training else []
+      extraction_groups = ['world'] if self.m_tool.requires_projector_training else []
+    else:
+      preprocessing_groups = extraction_groups = self.groups()
+
     # preprocessing
-    if not self.m_args.skip_preprocessing:
+    if not self.m_args.skip_preprocessing and preprocessing_groups:
       if self.m_args.dry_run:
         print ("Would have preprocessed data ...")
       else:
         self.m_tool_chain.preprocess_data(
               self.m_preprocessor,
-              groups = self.groups(),
+              groups = preprocessing_groups,
               force = self.m_args.force)
 
     # feature extraction
@@ -85,14 +93,14 @@ class ToolChainExecutorZT (ToolChainExecutor.ToolChainExecutor):
               self.m_preprocessor,
               force = self.m_args.force)
 
-    if not self.m_args.skip_extraction:
+    if not self.m_args.skip_extraction and extraction_groups:
       if self.m_args.dry_run:
         print ("Would have extracted the features ...")
       else:
         self.m_tool_chain.extract_features(
               self.m_extractor,
               self.m_preprocessor,
-              groups = self.groups(),
+              groups = extraction_groups,
               force = self.m_args.force)
 
     # feature projection
@@ -105,7 +113,7 @@ class ToolChainExecutorZT (ToolChainExecutor.ToolChainExecutor):
               self.m_extractor,
               force = self.m_args.force)
 
-    if not self.m_args.skip_projection and self.m_tool.performs_projection:
+    if not self.m_args.skip_projection and self.m_tool.performs_projection and not self.m_args.streaming:
       if self.m_args.dry_run:
         print ("Would have projected the features ...")
       else:
@@ -115,6 +123,19 @@ class ToolChainExecutorZT (ToolChainExecutor.ToolChainExecutor):
               groups = self.groups(),
               force = self.m_args.force)
 
+    # streaming of the data through preprocessing, feature extraction and projection
+    if self.m_args.streaming and not (self.m_args.skip_preprocessing and self.m_args.skip_extraction and self.m_args.skip_projection):
+      if self.m_args.dry_run:
+        print ("Would have preprocessed, extracted and projected the data in one pass ...")
+      else:
+        self.m_tool_chain.stream_data(
+              self.m_preprocessor,
+              self.m_extractor,
+              self.m_tool,
+              groups = self.groups(),
+              force = self.m_args.force,
+              intermediates = self.m_args.write_intermediates)
+
     # model enrollment
     if not self.m_args.skip_enroller_training and self.m_tool.requires_enroller_training:
       if self.m_args.dry_run:
@@ -462,12 +483,26 @@ def parse_args(command_line_parameters, exclude_resources_from = []):
   ############################ other options ############################################
   other_group.add_argument('-z', '--zt-norm', action='store_true',
       help = 'Enable the computation of ZT norms')
+  other_group.add_argument('--zt-norm-in-memory', action='store_true',
+      help = 'Keep the ZT-norm score matrices in memory instead of writing them to the --zt-temp-directories (ignored when --grid is specified).')
   other_group.add_argument('-c', '--calibrate-scores', action='store_true',
       help = 'Performs score calibration after the scores are computed.')
   other_group.add_argument('-F', '--force', action='store_true',
       help = 'Force to erase former data if already exist')
   other_group.add_argument('-w', '--preload-probes', action='store_true',
       help = 'Preload probe files during score computation (needs more memory, but is faster and requires fewer file accesses). WARNING! Use this flag with care!')
+  other_group.add_argument('-j', '--parallel', metavar = 'N', type = int, default = 1,
+      help = 'Run preprocessing, feature extraction, projection and enrollment in N parallel processes on the local machine (ignored when --grid is specified).')
+  other_group.add_argument('--feature-store', action='store_true',
+      help = 'Write the preprocessed data, the extracted and the projected features into a few shard files per directory instead of one file per sample.')
+  other_group.add_argument('--training-data-storage', choices = ('list', 'array', 'memmap'), default = 'list',
+      help = "How the training data is handed to the training of extractor, projector and enroller: as a 'list' of arrays, in one 'array', or in one array that is memory-mapped to a file in the --temp-directory.")
+  other_group.add_argument('--prefetch', metavar = 'K', type = int, default = 0,
+      help = 'Read up to K input files ahead and write the results in background threads, so that file access overlaps with the computation.')
+  other_group.add_argument('--streaming', action='store_true',
+      help = 'Preprocess, extract and project each file in one pass, without writing the intermediate results (ignored when --grid is specified).')
+  other_group.add_argument('--write-intermediates', nargs = '+', choices = ('preprocessed', 'features'), default = [],
+      help = 'Intermediate results that are written in --streaming mode nevertheless.')
   other_group.add_argument('--groups', metavar = 'GROUP', nargs = '+', default = ['dev'],
       help = "The group (i.e., 'dev' or  'eval') for which the models and scores should be generated")
 
@@ -116,6 +116,22 @@ class FeatureExtractionTest(unittest.TestCase):
     self.assertTrue(extractor.m_graph.nodes[0] == (5, 7))
     self.assertTrue(extractor.m_graph.nodes[-1] == (75, 57))
 
+    # test that graphs can be written as arrays
+    extractor = facereclib.features.GridGraph(
+      gabor_sigma = math.sqrt(2.) * math.pi,
+      node_distance = (10, 10),
+      image_resolution = (80, 64),
+      save_graph_as_array = True
+    )
+    feature = extractor(data)
+    t = tempfile.mkstemp('graph.hdf5', prefix='frltest_')[1]
+    extractor.save_feature(feature, t)
+    array = extractor.read_feature(t)
+    os.remove(t)
+    self.assertEqual(array.shape, (48, 2 * len(feature[0].abs)))
+    for i in range(len(feature)):
+      self.assertTrue((numpy.abs(array[i] - numpy.concatenate((feature[i].abs, feature[i].phase))) < 1e-8).all())
+
 
   def test04_lgbphs(self):
     data = bob.io.base.load(self.input_dir('cropped.hdf5'))
@@ -160,6 +176,33 @@ class FeatureExtractionTest(unittest.TestCase):
     self.assertTrue(len(with_phase.shape) == 1)
     self.assertEqual(no_phase.shape[0]*2, with_phase.shape[0])
 
+    # test that several threads and the split histograms compute the same histograms
+    for split in (None, 'wavelets', 'both', 'blocks'):
+      extractor = facereclib.features.LGBPHS(
+          block_size = 8,
+          block_overlap = 0,
+          gabor_directions = 4,
+          gabor_scales = 2,
+          gabor_sigma = math.sqrt(2.) * math.pi,
+          use_gabor_phases = True,
+          split_histogram = split,
+          number_of_threads = 4
+      )
+      feature = extractor(data)
+      if split == 'blocks':
+        feature = feature.reshape((extractor.m_n_blocks, -1, extractor.m_n_bins)).transpose((1,0,2))
+      self.assertTrue((numpy.abs(feature.flatten() - with_phase) < 1e-8).all())
+
+    # test that the sparse histograms are identical to the non-sparse ones
+    sparse = facereclib.utils.histogram.sparsify(no_phase)
+    self.assertTrue((sparse[1] == no_phase[sparse[0].astype(int)]).all())
+    self.assertEqual(numpy.count_nonzero(no_phase), sparse.shape[1])
+    batch = facereclib.utils.histogram.sparsify_batch([no_phase, with_phase[:no_phase.shape[0]], numpy.zeros(no_phase.shape)])
+    self.assertEqual(len(batch), 3)
+    self.assertTrue((batch[0] == sparse).all())
+    self.assertTrue((batch[1] == facereclib.utils.histogram.sparsify(with_phase[:no_phase.shape[0]])).all())
+    self.assertEqual(batch[2].shape, (2,0))
+
 
   def test05_sift_key_points(self):
     # check if VLSIFT is available
@@ -69,6 +69,50 @@ class ScriptTest (unittest.TestCase):
     shutil.rmtree(test_dir)
 
 
+  def __face_verify_options__(self, extractor, tool, options, sub_dir):
+    """Runs the tool chain with the given extractor and tool twice, without and with the given additional options, and asserts that both runs produce the same scores."""
+    from facereclib.script.faceverify import main
+    test_dir = tempfile.mkdtemp(prefix='frltest_')
+    try:
+      scores = []
+      for name, additional_options in ((sub_dir + '_reference', []), (sub_dir, options)):
+        parameters = [
+            '-d', os.path.join(base_dir, 'scripts', 'atnt_Test.py'),
+            '-p', 'face-crop',
+            '-f', extractor,
+            '-t', tool,
+            '--zt-norm',
+            '-b', name,
+            '--temp-directory', test_dir,
+            '--user-directory', test_dir
+        ] + additional_options
+
+        print (facereclib.utils.command_line(parameters))
+        main([sys.argv[0]] + parameters)
+
+        # read the scores without and with ZT-norm
+        scores.append([])
+        for norm in ('nonorm', 'ztnorm'):
+          score_file = os.path.join(test_dir, name, 'scores', 'Default', norm, 'scores-dev')
+          self.assertTrue(os.path.exists(score_file))
+          f = bob.measure.load.open_file(score_file)
+          d = []
+          for line in f:
+            if isinstance(line, bytes): line = line.decode('utf-8')
+            d.append(line.rstrip().split())
+          scores[-1].append(numpy.array(d))
+
+      for reference, new in zip(scores[0], scores[1]):
+        self.assertEqual(reference.shape, new.shape)
+        # assert that the data order is the same
+        self.assertTrue((reference[:,0:3] == new[:,0:3]).all())
+        # assert that the values are the same
+        self.assertTrue((numpy.abs(reference[:,3].astype(float) - new[:,3].astype(float)) < 1e-5).all())
+
+    finally:
+      shutil.rmtree(test_dir)
+
+
   def grid_available(self):
     try:
       import gridtk
@@ -503,3 +547,47 @@ class ScriptTest (unittest.TestCase):
     self.assertEqual(facereclib.script.parameter_test.job_count, 36)
 
     shutil.rmtree(test_dir)
+
+
+  def test22_faceverify_multiprocess(self):
+    # projection, enrollment and scoring of a projecting tool in several local processes
+    self.__face_verify_options__('eigenfaces', 'facereclib.tools.PCA(10)', ['--parallel', '3'], 'test_22')
+
+
+  def test23_faceverify_zt_norm_in_memory(self):
+    # with preloaded probes, the B, C and D matrices are computed with Tool.score_matrix
+    self.__face_verify_options__('eigenfaces', 'facereclib.tools.PCA(10)', ['--preload-probes', '--zt-norm-in-memory'], 'test_23')
+
+
+  def test24_faceverify_feature_store(self):
+    # shards are written by several processes
+    self.__face_verify_options__('eigenfaces', 'facereclib.tools.PCA(10)', ['--feature-store', '--parallel', '2'], 'test_24')
+
+
+  def test25_faceverify_training_memmap(self):
+    # the training data of extractor and projector are read into memory-mapped arrays
+    self.__face_verify_options__('eigenfaces', 'facereclib.tools.PCA(10)', ['--training-data-storage', 'memmap'], 'test_25')
+
+
+  def test26_faceverify_prefetch(self):
+    self.__face_verify_options__('eigenfaces', 'facereclib.tools.PCA(10)', ['--prefetch', '4'], 'test_26')
+
+
+  def test27_faceverify_streaming(self):
+    # preprocessing, extraction and projection are fused
+    self.__face_verify_options__('eigenfaces', 'facereclib.tools.PCA(10)', ['--streaming'], 'test_27')
+
+
+  def test28_faceverify_threads_and_processes(self):
+    # the GMM statistics are computed in threads, inside processes that are forked after the UBM was trained
+    self.__face_verify_options__('dct', 'facereclib.tools.UBMGMM(number_of_gaussians=2,k_means_training_iterations=1,gmm_training_iterations=1,number_of_threads=2)', ['--parallel', '2'], 'test_28')
+
+
+  def test29_faceverify_extraction_threads_and_processes(self):
+    # the LGBPHS layers are extracted in threads, inside forked processes
+    self.__face_verify_options__('facereclib.features.LGBPHS(block_size=10,block_overlap=4,sparse_histogram=True,number_of_threads=2)', 'lgbphs', ['--parallel', '2'], 'test_29')
+
+
+  def test30_faceverify_streaming_enrollment_from_features(self):
+    # the UBMGMM tool projects the features, but enrolls models from the unprojected features
+    self.__face_verify_options__('dct', 'facereclib.tools.UBMGMM(number_of_gaussians=2,k_means_training_iterations=1,gmm_training_iterations=1)', ['--streaming'], 'test_30')
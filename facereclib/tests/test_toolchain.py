@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+import unittest
+import os
+import shutil
+import tempfile
+import numpy
+
+import facereclib
+
+
+def write_text(data, filename):
+  with open(filename, 'w') as f:
+    f.write(data)
+
+def read_text(filename):
+  with open(filename) as f:
+    return f.read()
+
+
+class ToolChainTest(unittest.TestCase):
+
+  def test01_feature_store(self):
+    test_dir = tempfile.mkdtemp(prefix='frltest_')
+    try:
+      store = facereclib.toolchain.FeatureStore(test_dir)
+      filename = os.path.join(test_dir, 'client', 'file.hdf5')
+      other = os.path.join(test_dir, 'client', 'other.hdf5')
+      self.assertFalse(store.contains(filename))
+
+      # a sequential run writes all files into one shard; the shard is only read after it is closed
+      store.open_shard()
+      self.assertFalse(store.contains(filename))
+      self.assertEqual(store.size(filename), 0)
+      store.write(write_text, 'sequential', filename)
+      store.write(write_text, 'other', other)
+      self.assertEqual([name for name in os.listdir(test_dir) if name.endswith('.tar')], [])
+      store.close_shard()
+      self.assertEqual(store.read(read_text, filename), 'sequential')
+
+      # a forced re-run with parallel processes writes into other shards, which sort before the first shard;
+      # the existing files can be checked while writing, and the old version is removed when the shard is closed
+      store.open_shard((0, 5))
+      self.assertTrue(store.contains(filename))
+      self.assertEqual(store.size(filename), len('sequential'))
+      store.write(write_text, 'parallel', filename)
+      store.close_shard()
+      store.reset()
+      self.assertEqual(sorted(os.listdir(test_dir)), ['shard-0-5.tar', 'shard-all.tar'])
+      self.assertEqual(store.read(read_text, filename), 'parallel')
+      self.assertEqual(store.read(read_text, other), 'other')
+      self.assertEqual(store.size(filename), len('parallel'))
+
+      # re-running the same shard replaces the re-written files and keeps the others; empty shards are removed
+      for i in range(2):
+        store.open_shard()
+        store.write(write_text, 'forced', filename)
+        store.close_shard()
+      store.reset()
+      self.assertEqual(os.listdir(test_dir), ['shard-all.tar'])
+      self.assertEqual(store.read_many(read_text, [filename, other]), ['forced', 'other'])
+      shard_size = os.path.getsize(os.path.join(test_dir, 'shard-all.tar'))
+      store.open_shard()
+      store.write(write_text, 'forced', filename)
+      store.close_shard()
+      self.assertEqual(os.path.getsize(os.path.join(test_dir, 'shard-all.tar')), shard_size)
+
+      # when writing the same file twice into one shard, the latter version is used
+      store.open_shard()
+      store.write(write_text, 'first', filename)
+      store.write(write_text, 'second', filename)
+      store.close_shard()
+      store.reset()
+      self.assertEqual(store.read_many(read_text, [filename, filename]), ['second', 'second'])
+
+      self.assertRaises(IOError, store.read, read_text, os.path.join(test_dir, 'missing.hdf5'))
+      store.reset()
+    finally:
+      shutil.rmtree(test_dir)
+
+
+  def test02_training_data(self):
+    random = numpy.random.RandomState(7)
+    features = [random.uniform(size = (random.randint(1, 5), 3)) for i in range(9)]
+    test_dir = tempfile.mkdtemp(prefix='frltest_')
+    try:
+      # a too small, a too large and no count of features are given
+      for memory_map, count in ((False, 2), (False, 50), (False, None), (True, None)):
+        stacked = facereclib.utils.stack_training_features(iter(features), test_dir, memory_map, client_sizes = (4, 5), count = count)
+        self.assertEqual(stacked.array.shape, (sum(f.shape[0] for f in features), 3))
+        self.assertEqual([len(client) for client in stacked], [4, 5])
+        for stored, feature in zip(stacked[0] + stacked[1], features):
+          self.assertTrue((stored == feature).all())
+        stacked.close()
+      # the memory-mapped file is removed
+      self.assertEqual([name for name in os.listdir(test_dir) if name.endswith('.tar')], [])
+
+      # features that cannot be stacked are returned with the error, so that they need not be read again
+      for memory_map in (False, True):
+        try:
+          facereclib.utils.stack_training_features(iter(features[:3] + [numpy.zeros(3)] + features[3:]), test_dir, memory_map)
+          self.fail("The features should not be stackable")
+        except facereclib.utils.StackingError as e:
+          self.assertEqual(len(e.features), 4)
+          for stored, feature in zip(e.features, features[:3]):
+            self.assertTrue((stored == feature).all())
+        self.assertEqual([name for name in os.listdir(test_dir) if name.endswith('.tar')], [])
+    finally:
+      shutil.rmtree(test_dir)
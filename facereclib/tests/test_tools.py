@@ -18,8 +18,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import bob.io.base
+import bob.ip.gabor
 import bob.learn.linear
 import bob.learn.em
+import bob.math
 
 import unittest
 import os
@@ -98,6 +100,10 @@ class ToolTest(unittest.TestCase):
     sim = tool.score(model, feature)
     self.assertAlmostEqual(sim, 1.)
     self.assertAlmostEqual(tool.score_for_multiple_probes(model, [feature, feature]), 1.)
+    # the batch scoring of the base class gives one score per probe
+    scores = tool.score_batch(model, [feature, feature])
+    self.assertEqual(scores.shape, (2,))
+    self.assertTrue((numpy.abs(scores - sim) < 1e-8).all())
 
     # test averaging
     tool = facereclib.tools.GaborJets(
@@ -119,6 +125,36 @@ class ToolTest(unittest.TestCase):
     self.assertAlmostEqual(sim, 1.)
     self.assertAlmostEqual(tool.score_for_multiple_probes(model, [feature, feature]), 1.)
 
+    # test that the vectorized similarities are identical to the ones of bob.ip.gabor
+    probe = extractor.read_feature(self.input_dir('graph_regular.hdf5'))
+    probe = [bob.ip.gabor.Jet(numpy.roll(jet.abs * numpy.exp(1j * jet.phase), 1)) for jet in probe]
+    for similarity_type in ('ScalarProduct', 'Canberra', 'AbsPhase'):
+      tool = facereclib.tools.GaborJets(similarity_type, multiple_feature_scoring = 'max_jet')
+      model = tool.enroll([feature, probe])
+      similarities = [[tool.m_similarity_function(model[c][n], probe[n]) for n in range(len(probe))] for c in range(len(model))]
+      self.assertAlmostEqual(tool.score(model, probe), numpy.average(numpy.max(similarities, axis=0)))
+      scores = tool.score_batch(model, [feature, probe])
+      self.assertEqual(scores.shape, (2,))
+      self.assertAlmostEqual(scores[1], tool.score(model, probe))
+
+    # test that graphs stored as arrays give the same scores as graphs of jets
+    feature_array = facereclib.utils.gabor.graph_to_array(feature)
+    probe_array = facereclib.utils.gabor.graph_to_array(probe)
+    self.assertEqual(feature_array.shape, (len(feature), 2 * len(feature[0].abs)))
+    t = tempfile.mkstemp('graph.hdf5', prefix='frltest_')[1]
+    for similarity_type, scoring in (('Canberra', 'max_jet'), ('PhaseDiffPlusCanberra', 'max_graph'), ('PhaseDiffPlusCanberra', 'average_model')):
+      tool = facereclib.tools.GaborJets(similarity_type, gabor_sigma = math.sqrt(2.) * math.pi, multiple_feature_scoring = scoring)
+      model = tool.enroll([feature, probe])
+      model_array = tool.enroll([feature_array, probe_array])
+      self.assertTrue(isinstance(model_array, numpy.ndarray))
+      self.assertEqual(model_array.ndim, 2 if scoring == 'average_model' else 3)
+      # the array model is written and read as a whole
+      tool.save_model(model_array, t)
+      self.assertTrue((tool.read_model(t) == model_array).all())
+      self.assertAlmostEqual(tool.score(model_array, probe_array), tool.score(model, probe))
+      self.assertAlmostEqual(tool.score(model_array, probe), tool.score(model, probe))
+    os.remove(t)
+
 
 
   def test02_lgbphs(self):
@@ -138,6 +174,28 @@ class ToolTest(unittest.TestCase):
     self.assertAlmostEqual(sim, 40960.)
     self.assertAlmostEqual(tool.score_for_multiple_probes(model, [feature2, feature2]), sim)
 
+    # test that the batch scoring is identical to the bob.math functions for sparse and non-sparse probes
+    sparse2 = facereclib.utils.histogram.sparsify(feature2)
+    for distance_function in (bob.math.chi_square, bob.math.histogram_intersection):
+      tool = facereclib.tools.LGBPHS(distance_function = distance_function)
+      model = tool.enroll([feature1, sparse2])
+      scores = tool.score_batch(model, [feature1, feature2, sparse2])
+      self.assertEqual(scores.shape, (3,))
+      self.assertAlmostEqual(scores[0], -distance_function(model[0], model[1], feature1[0], feature1[1]))
+      self.assertAlmostEqual(scores[1], -distance_function(model[0], model[1], sparse2[0], sparse2[1]))
+      self.assertAlmostEqual(scores[2], scores[1])
+
+      # tuples and stacked arrays of probes are scored as several probes
+      self.assertAlmostEqual(tool.score_for_multiple_probes(model, (feature1, sparse2)), numpy.average(scores[[0,2]]))
+      dense_model = tool.enroll([feature2])
+      self.assertAlmostEqual(tool.score_for_multiple_probes(dense_model, numpy.vstack([feature2, feature2])), tool.score(dense_model, feature2))
+      self.assertAlmostEqual(tool.score_for_multiple_probes(model, numpy.array([sparse2, sparse2])), scores[2])
+      # single sparse probes are scored against non-sparse models and vice versa
+      self.assertAlmostEqual(tool.score_for_multiple_probes(dense_model, feature1), tool.score(dense_model, feature1))
+      self.assertAlmostEqual(tool.score_for_multiple_probes(dense_model, sparse2), tool.score(dense_model, feature2))
+      self.assertAlmostEqual(tool.score_for_multiple_probes(model, feature2), scores[1])
+      self.assertAlmostEqual(tool.score_for_multiple_probes(model, feature1), scores[0])
+
 
   def test03_pca(self):
     # read input
@@ -198,6 +256,32 @@ class ToolTest(unittest.TestCase):
     self.assertTrue(model.shape == (2,334))
     self.assertAlmostEqual(tool.score(model, projected), 0.)
     self.assertAlmostEqual(tool.score_for_multiple_probes(model, [projected, projected]), 0.)
+    # the batched scores must be identical to the scores of the single probes
+    probes = [projected, projected * 2.]
+    scores = tool.score_batch(model, probes)
+    self.assertEqual(scores.shape, (2,))
+    for i in range(2):
+      self.assertAlmostEqual(scores[i], tool.score(model, probes[i]))
+
+    # the PCA trained chunk by chunk must be identical to the PCA of bob
+    data = numpy.random.RandomState(11).normal(size = (200, 50)) * numpy.linspace(10., 1., 50)
+    machine, variances = bob.learn.linear.PCATrainer().train(data)
+    tool = facereclib.tools.PCA(.9, training_chunk_size = 17)
+    tool.train_projector(list(data), t)
+    self.assertEqual(tool.m_subspace_dim, facereclib.utils.pca.variance_dimension(variances, .9))
+    self.assertTrue(numpy.allclose(tool.m_variances, variances[:tool.m_subspace_dim]))
+    self.assertTrue(numpy.allclose(tool.m_machine.input_subtract, machine.input_subtract))
+    for i in range(tool.m_subspace_dim):
+      self.assertTrue(numpy.allclose(tool.m_machine.weights[:,i], machine.weights[:,i]) or numpy.allclose(tool.m_machine.weights[:,i], -machine.weights[:,i]))
+    # ... also for a small number of dimensions, unless the randomized PCA is enabled, which approximates the largest eigenvalues
+    tool = facereclib.tools.PCA(5, training_chunk_size = 64)
+    tool.train_projector(list(data), t)
+    self.assertTrue(numpy.allclose(tool.m_variances, variances[:5]))
+    tool = facereclib.tools.PCA(5, training_chunk_size = 64, randomized_training = True)
+    tool.train_projector(list(data), t)
+    self.assertEqual(tool.m_machine.shape, (50, 5))
+    self.assertTrue(numpy.allclose(tool.m_variances, variances[:5], rtol = 0.1))
+    os.remove(t)
 
 
   def test04_lda(self):
@@ -253,6 +337,11 @@ class ToolTest(unittest.TestCase):
     # score
     sim = tool.score(model, projected)
     self.assertAlmostEqual(sim, 0.)
+    # batched scoring with variance-weighted distances
+    probes = [projected, projected + 1.]
+    scores = tool.score_batch(model, probes)
+    for i in range(2):
+      self.assertAlmostEqual(scores[i], tool.score(model, probes[i]))
 
     # test the calculation of the subspace dimension based on percentage of variance,
     # and the usage of a different way to compute the final score in case of multiple features per model
@@ -266,6 +355,21 @@ class ToolTest(unittest.TestCase):
     self.assertTrue(model.shape == (2,5))
     self.assertAlmostEqual(tool.score(model, projected), 0.)
     self.assertAlmostEqual(tool.score_for_multiple_probes(model, [projected, projected]), 0.)
+    self.assertTrue((numpy.abs(tool.score_batch(model, [projected, projected])) < 1e-8).all())
+
+    # the LDA trained from accumulated scatter matrices must be identical to the one of the FisherLDATrainer
+    random = numpy.random.RandomState(5)
+    training_set = [[random.normal(size = (4,5)) + c for i in range(3 + c)] for c in range(8)]
+    for pca_subspace in (None, 12):
+      tool = facereclib.tools.LDA(3, pca_subspace)
+      tool.train_projector(training_set, t)
+      scatter_tool = facereclib.tools.LDA(3, pca_subspace, accumulate_scatters = True)
+      scatter_tool.train_projector(training_set, t)
+      os.remove(t)
+      self.assertTrue(numpy.allclose(scatter_tool.m_variances, tool.m_variances))
+      self.assertTrue(numpy.allclose(scatter_tool.m_machine.input_subtract, tool.m_machine.input_subtract))
+      for i in range(3):
+        self.assertTrue(numpy.allclose(scatter_tool.m_machine.weights[:,i], tool.m_machine.weights[:,i]) or numpy.allclose(scatter_tool.m_machine.weights[:,i], -tool.m_machine.weights[:,i]))
 
 
   def test05_bic(self):
@@ -302,6 +406,12 @@ class ToolTest(unittest.TestCase):
     sim = tool.score(model, feature)
     self.assertAlmostEqual(sim, 0.31276072)
 
+    # scoring several probes at once gives the same scores as the BIC machine
+    probes = [feature, numpy.random.RandomState(7).uniform(0., 255., feature.shape), feature * 0.5]
+    scores = tool.score_batch(model, probes)
+    for i, probe in enumerate(probes):
+      self.assertAlmostEqual(scores[i], tool.m_bic_machine(model[0] - probe), places=5)
+
     # now, test without PCA
     tool = facereclib.tools.BIC(numpy.subtract, 100)
     # train the enroller
@@ -321,6 +431,26 @@ class ToolTest(unittest.TestCase):
     # score and compare to the weird reference score ...
     sim = tool.score(model, feature)
     self.assertAlmostEqual(sim, 0.4070329180)
+    scores = tool.score_batch(model, probes)
+    for i, probe in enumerate(probes):
+      self.assertAlmostEqual(scores[i], tool.m_bic_machine(model[0] - probe), places=5)
+
+    # the selected training pairs are identical to the ones of the enumeration of all pairs
+    # here, the features are replaced by their indices; one client has a single feature only
+    train_features = [[0, 1, 2], [3], [4, 5, 6, 7], [8, 9]]
+    for maximum_pair_count in (None, 20, 5):
+      # enumerate all pairs explicitly, as the BIC tool did before
+      intra_pairs = [(client[c], client[c2]) for client in train_features for c in range(len(client)-1) for c2 in range(c+1, len(client))]
+      extra_pairs = [(client[c], impostor[i]) for client in train_features for c in range(len(client)) for impostor in train_features if impostor is not client for i in range(len(impostor))]
+      self.assertEqual((len(intra_pairs), len(extra_pairs)), (10, 70))
+      if maximum_pair_count is not None:
+        intra_pairs = [intra_pairs[i] for i in facereclib.utils.quasi_random_indices(len(intra_pairs), maximum_pair_count)]
+        extra_pairs = [extra_pairs[i] for i in facereclib.utils.quasi_random_indices(len(extra_pairs), maximum_pair_count)]
+
+      tool = facereclib.tools.BIC(numpy.subtract, maximum_pair_count)
+      (intra_first, intra_second), (extra_first, extra_second) = tool.__intra_extra_pairs__(train_features)
+      self.assertEqual(list(zip(intra_first.tolist(), intra_second.tolist())), intra_pairs)
+      self.assertEqual(list(zip(extra_first.tolist(), extra_second.tolist())), extra_pairs)
 
 
   def test06_gmm(self):
@@ -375,6 +505,46 @@ class ToolTest(unittest.TestCase):
     self.assertAlmostEqual(sim, 0.25472347774)
     self.assertAlmostEqual(tool.score_for_multiple_probes(model, [probe, probe]), sim)
 
+    # train the UBM chunk by chunk on a subset of feature vectors
+    tool = facereclib.tools.UBMGMM(
+        number_of_gaussians = 2,
+        k_means_training_iterations = 5,
+        gmm_training_iterations = 5,
+        k_means_training_frames = 100,
+        ubm_training_chunk_size = 50,
+        INIT_SEED = seed_value,
+    )
+    t = tempfile.mkstemp('ubm.hdf5', prefix='frltest_')[1]
+    tool.train_projector(facereclib.utils.tests.random_training_set(feature.shape, count=5, minimum=-5., maximum=5.), t)
+    tool.load_projector(t)
+    os.remove(t)
+    self.assertEqual(tool.m_ubm.shape, (2, feature.shape[1]))
+    self.assertAlmostEqual(numpy.sum(tool.m_ubm.weights), 1.)
+    self.assertTrue(numpy.isfinite(tool.score(tool.enroll([feature]), tool.project(feature))))
+
+    # accumulate the GMM statistics in several threads
+    tool = facereclib.tools.UBMGMM(number_of_gaussians = 2, number_of_threads = 2)
+    tool.load_projector(self.reference_dir('gmm_projector.hdf5'))
+    self.assertTrue(tool.project(feature).is_similar_to(probe))
+    statistics = tool._project_training_features([feature, feature])
+    self.assertEqual(len(statistics), 2)
+    self.assertTrue(statistics[1].is_similar_to(probe))
+
+    # cache the GMM statistics
+    import shutil
+    cache_directory = tempfile.mkdtemp(prefix='frltest_')
+    tool = facereclib.tools.UBMGMM(number_of_gaussians = 2, gmm_stats_cache_directory = cache_directory)
+    tool.load_projector(self.reference_dir('gmm_projector.hdf5'))
+    self.assertTrue(tool._project_training_features([feature])[0].is_similar_to(probe))
+    cache_files = [os.path.join(d, f) for d, _, files in os.walk(cache_directory) for f in files]
+    self.assertEqual(len(cache_files), 1)
+    # the cache is keyed by the hash of the UBM, which is computed when loading the UBM
+    self.assertEqual(os.path.basename(os.path.dirname(cache_files[0])), tool.m_ubm_hash)
+    # the projection reads the statistics from the cache
+    self.assertTrue(tool.project(feature).is_similar_to(probe))
+    self.assertEqual(len([f for _, _, files in os.walk(cache_directory) for f in files]), 1)
+    shutil.rmtree(cache_directory)
+
 
   def test06a_gmm_regular(self):
     # read input
@@ -487,6 +657,14 @@ class ToolTest(unittest.TestCase):
     # score with a concatenation of the probe
     self.assertAlmostEqual(tool.score_for_multiple_probes(model, [probe, probe]), sim, places=5)
 
+    # the matrix scoring is identical to the scores of the ISV machine
+    scores = tool.score_batch(model, [probe, probe])
+    self.assertEqual(scores.shape, (2,))
+    self.assertTrue((numpy.abs(scores - sim) < 1e-8).all())
+    scores = tool.score_matrix([model, reference_model], [probe])
+    self.assertEqual(scores.shape, (2,1))
+    self.assertAlmostEqual(scores[1,0], tool.score(reference_model, probe))
+
 
   def test08_jfa(self):
     # read input
@@ -619,6 +797,15 @@ class ToolTest(unittest.TestCase):
     # score with a concatenation of the probe
     self.assertAlmostEqual(tool.score_for_multiple_probes(model, [feature, feature]), 0.)
 
+    # the batched scoring is identical to the log-likelihood ratio of the PLDA machine
+    probe = numpy.random.RandomState(seed_value).uniform(0., 255., feature.shape)
+    scores = tool.score_matrix([model], [feature, probe])
+    self.assertEqual(scores.shape, (1,2))
+    self.assertAlmostEqual(scores[0,0], sim)
+    projected = numpy.ndarray((tool.m_pca_machine.shape[1],), numpy.float64)
+    tool.m_pca_machine(probe, projected)
+    self.assertAlmostEqual(scores[0,1], model.log_likelihood_ratio(projected), places=5)
+
 
   def test10_ivector(self):
     # NOTE: This test will fail when it is run solely. Please always run all Tool tests in order to assure that they work.
@@ -690,8 +877,14 @@ class ToolTest(unittest.TestCase):
     probe = tool.read_probe(self.reference_dir('ivector_feature.hdf5'))
     self.assertTrue(numpy.allclose(probe,projected))
 
-    # score with projected feature and compare to the weird reference score ...
-    # This in not implemented yet
+    # score with projected feature; models and probes are length-normalized, so the cosine score of identical vectors is 1
+    model = tool.enroll([projected, projected])
+    self.assertAlmostEqual(numpy.linalg.norm(model), 1.)
+    self.assertAlmostEqual(tool.score(model, probe), 1.)
+    scores = tool.score_matrix([model, model], [probe, probe, probe])
+    self.assertEqual(scores.shape, (2,3))
+    self.assertTrue((numpy.abs(scores - 1.) < 1e-8).all())
+    self.assertTrue((numpy.abs(tool.score_batch(model, [probe, probe]) - 1.) < 1e-8).all())
 
     # score with a concatenation of the probe
     # This is not implemented yet
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+import atexit
+import io
+import os
+import tarfile
+import tempfile
+import threading
+import time
+
+from .. import utils
+
+class FeatureStore:
+  """This class stores the files of one directory (e.g., the preprocessed data, the extracted or the projected features) in a few large shard files.
+  Each file is kept as a member of an uncompressed tar shard, keyed by its path relative to the directory.
+  Each process writes its own shard, whose name is given by the index range in open_shard().
+  A shard is written under a temporary name, and it is renamed when it is closed, so that only complete shards are read.
+  When closing a shard, older versions of the written files are removed from all shards.
+  If the same file is stored several times nevertheless (e.g., when several processes clean up the same shard at once), the most recently written version is used.
+  Therefore, the write time is stored with sub-second precision in the (PAX) header of each member.
+  Files can be read from several threads, but only one thread might write."""
+
+  # the staging files are created in memory-backed storage, if available, so that staging a file does not cause additional disk I/O
+  MEMORY_DIRECTORY = '/dev/shm'
+
+  def __init__(self, directory):
+    """Creates the store for the given directory."""
+    self.m_directory = directory
+    self.m_writer = None
+    self.m_shard_file = None
+    self.m_written = set()
+    self.m_readers = {}
+    self.m_staging_files = {}
+    self.m_index = None
+    self.m_lock = threading.Lock()
+    atexit.register(self.__remove_staging_files__)
+
+
+  def reset(self):
+    """Closes all open shards, removes the staging files and forgets the index of the stored files, so that it is re-read at the next access."""
+    self.close_shard()
+    for reader in self.m_readers.values():
+      reader.close()
+    self.m_readers = {}
+    self.__remove_staging_files__()
+    self.m_index = None
+
+
+  def contains(self, filename):
+    """Returns True, if the given file is contained in the store."""
+    return self.__key__(filename) in self.__index__()
+
+  def size(self, filename):
+    """Returns the size of the given file in bytes, or 0 if it is not stored."""
+    if not self.contains(filename):
+      return 0
+    return self.__index__()[self.__key__(filename)][1].size
+
+
+  def open_shard(self, indices = None):
+    """Opens the shard for writing that corresponds to the given index range (or to all files).
+    The shard is written to a temporary file, which is not read before the shard is closed."""
+    self.close_shard()
+    # the index of the already stored files is read before writing, e.g., to check which files need to be computed
+    self.__index__()
+    name = "shard-all.tar" if indices is None else "shard-%d-%d.tar" % tuple(indices)
+    utils.ensure_dir(self.m_directory)
+    self.m_shard_file = os.path.join(self.m_directory, name)
+    self.m_writer = tarfile.open(self.__partial__(self.m_shard_file), 'w', format = tarfile.PAX_FORMAT)
+    self.m_written = set()
+
+  def close_shard(self):
+    """Closes the shard opened for writing.
+    The files of the previous version of the shard that were not re-written are kept, and the re-written files are removed from all other shards."""
+    if self.m_writer is None:
+      return
+    writer, self.m_writer = self.m_writer, None
+    partial = self.__partial__(self.m_shard_file)
+    succeeded = False
+    try:
+      self.__copy_members__(self.m_shard_file, writer)
+      succeeded = True
+    finally:
+      writer.close()
+      if not succeeded:
+        os.remove(partial)
+    os.rename(partial, self.m_shard_file)
+
+    # remove the old versions of the written files from the other shards
+    for name in self.__shards__():
+      shard_file = os.path.join(self.m_directory, name)
+      if shard_file != self.m_shard_file:
+        self.__compact__(shard_file)
+    # the index needs to be updated
+    with self.m_lock:
+      self.m_index = None
+
+
+  def write(self, function, data, filename):
+    """Writes the given data to the store, using the given function that writes the data to a file.
+    The file is written to the staging file of the current thread first, and its contents are added to the currently opened shard afterwards."""
+    if self.m_writer is None:
+      self.open_shard()
+    staging_file = self.__staging_file__(filename)
+    function(data, staging_file)
+    with open(staging_file, 'rb') as f:
+      content = f.read()
+    member = tarfile.TarInfo(self.__key__(filename))
+    member.size = len(content)
+    # the write time decides which version of a file is used, see __index__
+    member.mtime = time.time()
+    self.m_writer.addfile(member, io.BytesIO(content))
+    self.m_written.add(member.name)
+
+
+  def read(self, function, filename):
+    """Reads the given file from the store, using the given function that reads the data from a file."""
+    return self.read_many(function, [filename])[0]
+
+  def read_many(self, function, filenames):
+    """Reads all given files from the store, using the given function that reads the data from a file.
+    The files are read in the order in which they are stored in the shards, so that the shards are accessed sequentially."""
+    index = self.__index__()
+    members = []
+    for i, filename in enumerate(filenames):
+      key = self.__key__(filename)
+      if key not in index:
+        raise IOError("The file '%s' cannot be found in the feature store of directory '%s'" % (filename, self.m_directory))
+      shard_file, member = index[key]
+      members.append((shard_file, member.offset_data, i, member))
+
+    data = [None] * len(filenames)
+    for shard_file, _, i, member in sorted(members, key = lambda m : m[:3]):
+      data[i] = self.__read_member__(function, shard_file, member, filenames[i])
+    return data
+
+
+  def __read_member__(self, function, shard_file, member, filename):
+    """Reads the given member of the shard into memory and reads it with the given function from the staging file of the current thread."""
+    # the open shards are shared between threads
+    with self.m_lock:
+      if shard_file not in self.m_readers:
+        self.m_readers[shard_file] = tarfile.open(shard_file, 'r')
+      content = self.m_readers[shard_file].extractfile(member).read()
+    staging_file = self.__staging_file__(filename)
+    with open(staging_file, 'wb') as f:
+      f.write(content)
+    return function(staging_file)
+
+  def __staging_file__(self, filename):
+    """Returns the staging file of the current thread for files with the extension of the given file.
+    The read and write functions (e.g., of :py:class:`bob.io.base.HDF5File`) require a file name, so each thread re-uses one file, preferably in memory-backed storage."""
+    key = (os.getpid(), threading.current_thread().ident, os.path.splitext(filename)[1])
+    with self.m_lock:
+      if key not in self.m_staging_files:
+        directory = self.MEMORY_DIRECTORY if os.path.isdir(self.MEMORY_DIRECTORY) and os.access(self.MEMORY_DIRECTORY, os.W_OK) else None
+        handle, self.m_staging_files[key] = tempfile.mkstemp(key[2], 'frl_', directory)
+        os.close(handle)
+      return self.m_staging_files[key]
+
+  def __remove_staging_files__(self):
+    """Removes the staging files that were created by the current process."""
+    with self.m_lock:
+      for (pid, thread, extension), staging_file in self.m_staging_files.items():
+        if pid == os.getpid() and os.path.exists(staging_file):
+          os.remove(staging_file)
+      self.m_staging_files = {}
+
+  def __partial__(self, shard_file):
+    """Returns the name of the file, to which the given shard is written until it is closed."""
+    return "%s.%d.partial" % (shard_file, os.getpid())
+
+  def __shards__(self):
+    """Returns the names of all complete shards of the directory."""
+    if not os.path.isdir(self.m_directory):
+      return []
+    return sorted(name for name in os.listdir(self.m_directory) if name.startswith("shard-") and name.endswith(".tar"))
+
+  def __copy_members__(self, shard_file, writer):
+    """Copies all members of the given shard, which have not been written to the given writer, and returns the number of copied members.
+    Shards that have been removed in the meantime are skipped."""
+    try:
+      shard = tarfile.open(shard_file, 'r')
+    except (IOError, OSError):
+      if os.path.exists(shard_file):
+        raise
+      return 0
+    count = 0
+    with shard:
+      for member in shard.getmembers():
+        if member.name not in self.m_written:
+          writer.addfile(member, shard.extractfile(member))
+          count += 1
+    return count
+
+  def __compact__(self, shard_file):
+    """Removes the files written to the last shard from the given shard; the shard is removed when it does not contain any other files."""
+    try:
+      with tarfile.open(shard_file, 'r') as shard:
+        names = shard.getnames()
+    except (IOError, OSError):
+      if os.path.exists(shard_file):
+        raise
+      return
+    if not self.m_written.intersection(names):
+      return
+    partial = self.__partial__(shard_file)
+    with tarfile.open(partial, 'w', format = tarfile.PAX_FORMAT) as writer:
+      count = self.__copy_members__(shard_file, writer)
+    if count:
+      os.rename(partial, shard_file)
+    else:
+      os.remove(partial)
+      os.remove(shard_file)
+
+  def __key__(self, filename):
+    """Returns the name of the given file inside the shards."""
+    return os.path.relpath(str(filename), self.m_directory)
+
+  def __index__(self):
+    """Returns the index of all stored files; the index is computed from the headers of all complete shards.
+    Files that are stored several times are resolved by their write time; later members of the same shard win ties."""
+    with self.m_lock:
+      if self.m_index is None:
+        index = {}
+        for name in self.__shards__():
+          shard_file = os.path.join(self.m_directory, name)
+          try:
+            shard = tarfile.open(shard_file, 'r')
+          except (IOError, OSError):
+            # another process might have removed the shard in the meantime
+            if os.path.exists(shard_file):
+              raise
+            continue
+          with shard:
+            for member in shard.getmembers():
+              if member.name not in index or member.mtime >= index[member.name][1].mtime:
+                index[member.name] = (shard_file, member)
+        self.m_index = index
+      return self.m_index
@@ -4,6 +4,7 @@
 
 import os
 from .. import utils
+from .FeatureStore import FeatureStore
 
 class FileSelector:
   """This class provides shortcuts for selecting different files for different stages of the verification process"""
@@ -20,10 +21,12 @@ class FileSelector:
         model_directories,
         score_directories,
         zt_score_directories = None,
-        default_extension = '.hdf5'
+        default_extension = '.hdf5',
+        use_feature_store = False
       ):
 
-    """Initialize the file selector object with the current configuration."""
+    """Initialize the file selector object with the current configuration.
+    If use_feature_store is enabled, the preprocessed data, the extracted and the projected features are kept in a few shard files per directory, see FeatureStore."""
     self.m_database = database
     self.original_directory = database.original_directory
     self.preprocessed_directory = preprocessed_directory
@@ -36,6 +39,13 @@ class FileSelector:
     self.score_directories = score_directories
     self.zt_score_directories = zt_score_directories
     self.default_extension = default_extension
+    # the probe-id to position index of each group, see probe_indices()
+    self.m_probe_indices = {}
+    # the feature stores for the directories of the per-file stages
+    self.m_feature_stores = {}
+    if use_feature_store:
+      for directory in (preprocessed_directory, features_directory, projected_directory):
+        self.m_feature_stores[directory] = FeatureStore(directory)
 
 
   def uses_probe_file_sets(self):
@@ -56,6 +66,19 @@ class FileSelector:
     return self.m_database.file_names(files, directory, self.default_extension)
 
 
+  def feature_store(self, filename):
+    """Returns the FeatureStore that holds the given file, or None if the file is written as a separate file."""
+    for directory, store in self.m_feature_stores.items():
+      if str(filename).startswith(os.path.join(directory, '')):
+        return store
+    return None
+
+  def reset_feature_stores(self):
+    """Closes all feature stores, so that their contents are re-read at the next access."""
+    for store in self.m_feature_stores.values():
+      store.reset()
+
+
   ### List of files that will be used for all files
   def original_data_list(self, groups = None):
     """Returns the list of original data that can be used for preprocessing."""
@@ -125,6 +148,13 @@ class FileSelector:
     else:
       return self.m_database.probe_files(group = group)
 
+  def probe_indices(self, group):
+    """Returns a dictionary that maps the ids of the probe_objects() of the given group to their position in that list.
+    The index is computed only once per group and cached afterwards."""
+    if group not in self.m_probe_indices:
+      self.m_probe_indices[group] = dict((probe_object.id, index) for index, probe_object in enumerate(self.probe_objects(group)))
+    return self.m_probe_indices[group]
+
   def probe_objects_for_model(self, model_id, group):
     """Returns the probe File objects used to compute the raw scores for the given model id.
     This is actually a sub-set of all probe_objects()."""
@@ -9,8 +9,13 @@ import bob.measure
 
 import os
 import sys
+import math
 import numpy
 import tarfile
+import collections
+import multiprocessing
+import multiprocessing.pool
+import threading
 import six
 
 from .. import utils
@@ -18,16 +23,35 @@ from .. import utils
 class ToolChain:
   """This class includes functionalities for a default tool chain to produce verification scores"""
 
-  def __init__(self, file_selector, write_compressed_score_files = False):
-    """Initializes the tool chain object with the current file selector."""
+  def __init__(self, file_selector, write_compressed_score_files = False, number_of_parallel_processes = 1, zt_norm_in_memory = False, training_data_storage = 'list', prefetch_size = 0):
+    """Initializes the tool chain object with the current file selector.
+    If number_of_parallel_processes is greater than 1, the per-file stages are split into several processes on the local machine.
+    If zt_norm_in_memory is enabled, the A, B, C and D score matrices are kept in memory instead of being written to file,
+    so that compute_scores and zt_norm need to be called on the same ToolChain object.
+    The training_data_storage defines how training data is handed to the training functions:
+    as a 'list' of arrays, or as :py:class:`facereclib.utils.TrainingFeatures` sharing one 'array' or one 'memmap' array.
+    If prefetch_size is greater than 0, the per-file stages read up to prefetch_size inputs ahead and write their results in background threads."""
     self.m_file_selector = file_selector
     self.m_write_compressed = write_compressed_score_files
+    self.m_parallel_processes = number_of_parallel_processes
+    self.m_training_data_storage = training_data_storage
+    self.m_prefetch_size = prefetch_size
+    self.m_prefetch_pool = None
+    self.m_write_pool = None
+    # the feature stores are shared between the prefetch and write threads, so they are accessed one at a time
+    self.m_store_lock = threading.Lock()
+    # the score matrices for ZT-norm, indexed by the name of the file they would have been written to
+    self.m_score_matrices = {} if zt_norm_in_memory else None
 
 
   def __check_file__(self, filename, force, expected_file_size = 1):
     """Checks if the file exists and has size greater or equal to expected_file_size.
     If the file is to small, or if the force option is set to true, the file is removed.
     This function returns true is the file is there, otherwise false"""
+    store = self.m_file_selector.feature_store(filename)
+    if store is not None:
+      # files in the feature store are not removed, but overwritten by the next write
+      return not force and store.size(filename) >= expected_file_size
     if os.path.exists(filename):
       if force or os.path.getsize(filename) < expected_file_size:
         utils.debug("  .. Removing old file '%s'." % filename)
@@ -38,6 +62,154 @@ class ToolChain:
     return False
 
 
+  def __check_score_matrix__(self, score_file, force):
+    """Checks if the given A, B, C or D score matrix has already been computed, see __check_file__."""
+    if self.m_score_matrices is not None:
+      if force:
+        self.m_score_matrices.pop(score_file, None)
+      return score_file in self.m_score_matrices
+    return self.__check_file__(score_file, force)
+
+  def __save_score_matrix__(self, scores, score_file):
+    """Writes the given A, B, C or D score matrix to file, or keeps it in memory."""
+    if self.m_score_matrices is not None:
+      self.m_score_matrices[score_file] = scores
+    else:
+      bob.io.base.save(scores, score_file)
+
+  def __load_score_matrix__(self, score_file):
+    """Reads the A, B, C or D score matrix that was stored with __save_score_matrix__."""
+    if self.m_score_matrices is not None:
+      return self.m_score_matrices[score_file]
+    return bob.io.base.load(score_file)
+
+
+  def __read_file__(self, function, filename):
+    """Reads the given file using the given function, either directly or from the feature store."""
+    store = self.m_file_selector.feature_store(filename)
+    if store is None:
+      return function(str(filename))
+    with self.m_store_lock:
+      return store.read(function, filename)
+
+  def __read_files__(self, function, filenames):
+    """Reads all given files using the given function; files in the feature store are read in the order of the shards."""
+    store = self.m_file_selector.feature_store(filenames[0]) if len(filenames) else None
+    if store is None:
+      return [function(str(filename)) for filename in filenames]
+    with self.m_store_lock:
+      return store.read_many(function, filenames)
+
+  def __write_file__(self, function, data, filename):
+    """Writes the given data using the given function, either to the given file or to the feature store."""
+    store = self.m_file_selector.feature_store(filename)
+    if store is None:
+      utils.ensure_dir(os.path.dirname(filename))
+      function(data, str(filename))
+    else:
+      with self.m_store_lock:
+        store.write(function, data, filename)
+
+  def __prefetch__(self, function, items):
+    """Yields the pairs (item, function(item)) for all given items in order.
+    If prefetching is enabled, the function is evaluated for the next items in background threads, while the caller processes the current item.
+    At most prefetch_size items are processed ahead, which limits the memory that is used."""
+    if not self.m_prefetch_size:
+      for item in items:
+        yield item, function(item)
+      return
+
+    # the pool is shared by all calls of the current stage, see __finish_stage__
+    if self.m_prefetch_pool is None:
+      self.m_prefetch_pool = multiprocessing.pool.ThreadPool(self.m_prefetch_size)
+    pool = self.m_prefetch_pool
+    pending = collections.deque()
+    try:
+      items = iter(items)
+      for item in items:
+        pending.append((item, pool.apply_async(function, (item,))))
+        if len(pending) == self.m_prefetch_size:
+          break
+      while pending:
+        item, result = pending.popleft()
+        # start reading the next item, before the current one is handed to the caller
+        for next_item in items:
+          pending.append((next_item, pool.apply_async(function, (next_item,))))
+          break
+        yield item, result.get()
+    finally:
+      # when the caller stops early, the items that are read ahead are not needed by the next call
+      for item, result in pending:
+        result.wait()
+
+  def __write_file_async__(self, function, data, filename):
+    """Writes the given data in a background thread, if prefetching is enabled, see __write_file__.
+    At most prefetch_size writes are pending at the same time; call __finish_stage__ to wait for all of them."""
+    if not self.m_prefetch_size:
+      return self.__write_file__(function, data, filename)
+    if self.m_write_pool is None:
+      # a single thread keeps the order of writes, and the shards of the feature store consistent
+      self.m_write_pool = multiprocessing.pool.ThreadPool(1)
+      self.m_pending_writes = collections.deque()
+    while len(self.m_pending_writes) >= self.m_prefetch_size:
+      self.m_pending_writes.popleft().get()
+    self.m_pending_writes.append(self.m_write_pool.apply_async(self.__write_file__, (function, data, filename)))
+
+  def __finish_stage__(self):
+    """Waits until all data written with __write_file_async__ is written, and closes the thread pools of the current stage; errors of the writes are raised here."""
+    if self.m_prefetch_pool is not None:
+      self.m_prefetch_pool.terminate()
+      self.m_prefetch_pool = None
+    if self.m_write_pool is not None:
+      try:
+        while self.m_pending_writes:
+          self.m_pending_writes.popleft().get()
+      finally:
+        self.m_write_pool.close()
+        self.m_write_pool.join()
+        self.m_write_pool = None
+
+  def __open_shard__(self, directory, indices):
+    """Opens the shard of the feature store of the given directory that is written by the current index range, if the feature store is used."""
+    store = self.m_file_selector.feature_store(os.path.join(directory, ''))
+    if store is not None:
+      store.open_shard(indices)
+
+  def __parallel_indices__(self, indices, number_of_objects):
+    """Splits the given index range (or the range of all objects) into one sub-range for each parallel process."""
+    start, end = indices if indices is not None else (0, number_of_objects)
+    count = max(int(math.ceil(float(end - start) / float(self.m_parallel_processes))), 1)
+    return [(first, min(first + count, end)) for first in range(start, end, count)]
+
+  def __parallel_worker__(self, function, args, kwargs):
+    """Executes the given stage function inside a worker process; the worker itself runs sequentially."""
+    self.m_parallel_processes = 1
+    # do not share open shards with the parent process
+    self.m_file_selector.reset_feature_stores()
+    function(*args, **kwargs)
+    self.m_file_selector.reset_feature_stores()
+
+  def __execute_parallel__(self, function, number_of_objects, indices, *args, **kwargs):
+    """Executes the given stage function in several processes on the local machine, each of which handles a part of the index range.
+    The workers are forked, so that the preprocessor, extractor or tool is loaded only once per process."""
+    context = multiprocessing.get_context('fork') if hasattr(multiprocessing, 'get_context') else multiprocessing
+    processes = []
+    for sub_indices in self.__parallel_indices__(indices, number_of_objects):
+      kwargs['indices'] = sub_indices
+      process = context.Process(target = self.__parallel_worker__, args = (function, args, dict(kwargs)))
+      process.start()
+      processes.append(process)
+
+    # wait for all processes to finish
+    for process in processes:
+      process.join()
+    failed = [process for process in processes if process.exitcode != 0]
+    if failed:
+      raise RuntimeError("%d of %d parallel processes failed with exit codes %s" % (len(failed), len(processes), [process.exitcode for process in failed]))
+    # the workers might have written new shards
+    self.m_file_selector.reset_feature_stores()
+
+
 
   def preprocess_data(self, preprocessor, groups=None, indices=None, force=False):
     """Preprocesses the original data with the given preprocessor."""
@@ -45,6 +217,10 @@ class ToolChain:
     data_files = self.m_file_selector.original_data_list(groups=groups)
     preprocessed_data_files = self.m_file_selector.preprocessed_data_list(groups=groups)
 
+    if self.m_parallel_processes > 1:
+      utils.info("- Preprocessing: using %d parallel processes" % self.m_parallel_processes)
+      return self.__execute_parallel__(self.preprocess_data, len(data_files), indices, preprocessor, groups=groups, force=force)
+
     # select a subset of keys to iterate
     if indices != None:
       index_range = range(indices[0], indices[1])
@@ -57,40 +233,69 @@ class ToolChain:
 
     # read annotation files
     annotation_list = self.m_file_selector.annotation_list(groups=groups)
-
-    for i in index_range:
-      preprocessed_data_file = preprocessed_data_files[i]
-
-      if not self.__check_file__(preprocessed_data_file, force, 1000):
-        file_name = data_files[i]
-        if isinstance(file_name,six.text_type):
-          file_name = str(file_name)
-        data = preprocessor.read_original_data(file_name)
-
-        # get the annotations; might be None
-        annotations = self.m_file_selector.get_annotations(annotation_list[i])
-
-        # call the preprocessor
-        preprocessed_data = preprocessor(data, annotations)
-        if preprocessed_data is None:
-          utils.error("Preprocessing of file %s was not successful" % str(data_files[i]))
-
-        utils.ensure_dir(os.path.dirname(preprocessed_data_file))
-        preprocessor.save_data(preprocessed_data, str(preprocessed_data_file))
-
-
-  def __read_data__(self, files, preprocessor):
+    self.__open_shard__(self.m_file_selector.preprocessed_directory, indices)
+
+    def read_original_data(i):
+      file_name = data_files[i]
+      if isinstance(file_name,six.text_type):
+        file_name = str(file_name)
+      return preprocessor.read_original_data(file_name)
+
+    # process only the files that are not there yet
+    index_range = [i for i in index_range if not self.__check_file__(preprocessed_data_files[i], force, 1000)]
+    for i, data in self.__prefetch__(read_original_data, index_range):
+      # get the annotations; might be None
+      annotations = self.m_file_selector.get_annotations(annotation_list[i])
+
+      # call the preprocessor
+      preprocessed_data = preprocessor(data, annotations)
+      if preprocessed_data is None:
+        utils.error("Preprocessing of file %s was not successful" % str(data_files[i]))
+
+      self.__write_file_async__(preprocessor.save_data, preprocessed_data, preprocessed_data_files[i])
+
+    self.__finish_stage__()
+    self.m_file_selector.reset_feature_stores()
+
+
+  def __read_training_files__(self, function, files, by_client, trained_file):
+    """Reads the training files using the given function, and returns them in the configured training data storage.
+    If the data cannot be stored in one array, a list is returned."""
+    if self.m_training_data_storage != 'list':
+      all_files = [f for client_files in files for f in client_files] if by_client else files
+      try:
+        return utils.stack_training_features(
+            (self.__read_file__(function, f) for f in all_files),
+            directory = os.path.dirname(trained_file),
+            memory_map = self.m_training_data_storage == 'memmap',
+            client_sizes = [len(client_files) for client_files in files] if by_client else None,
+            count = len(all_files)
+        )
+      except utils.StackingError as e:
+        utils.warn("The training data cannot be stored in one array (%s); using a list of arrays instead" % e)
+        # only read the files that have not been read yet
+        data = e.features + self.__read_files__(function, all_files[len(e.features):])
+        if by_client:
+          client_offsets = numpy.cumsum([0] + [len(client_files) for client_files in files])
+          return [data[client_offsets[c]:client_offsets[c+1]] for c in range(len(files))]
+        return data
+    if by_client:
+      return [self.__read_files__(function, client_files) for client_files in files]
+    return self.__read_files__(function, files)
+
+  def __release_training_data__(self, data):
+    """Releases the training data, and removes the memory-mapped file, if any."""
+    if isinstance(data, utils.TrainingFeatures):
+      data.close()
+
+  def __read_data__(self, files, preprocessor, trained_file):
     """Reads the preprocessed data from file using the given reader."""
-    return [preprocessor.read_data(str(f)) for f in files]
+    return self.__read_training_files__(preprocessor.read_data, files, False, trained_file)
 
-  def __read_data_by_client__(self, files, preprocessor):
+  def __read_data_by_client__(self, files, preprocessor, trained_file):
     """Reads the preprocessed data from file using the given reader.
     In this case, the data is grouped by clients."""
-    retval = []
-    for client_files in files:
-      # data for the client
-      retval.append([preprocessor.read_data(str(f)) for f in client_files])
-    return retval
+    return self.__read_training_files__(preprocessor.read_data, files, True, trained_file)
 
   def train_extractor(self, extractor, preprocessor, force = False):
     """Trains the feature extractor using preprocessed data of the 'world' set, if the feature extractor requires training."""
@@ -103,23 +308,29 @@ class ToolChain:
         # read training files
         if extractor.split_training_data_by_client:
           train_files = self.m_file_selector.training_list('preprocessed', 'train_extractor', arrange_by_client = True)
-          train_data = self.__read_data_by_client__(train_files, preprocessor)
+          train_data = self.__read_data_by_client__(train_files, preprocessor, extractor_file)
           utils.info("- Extraction: training extractor '%s' using %d identities: " %(extractor_file, len(train_files)))
         else:
           train_files = self.m_file_selector.training_list('preprocessed', 'train_extractor')
-          train_data = self.__read_data__(train_files, preprocessor)
+          train_data = self.__read_data__(train_files, preprocessor, extractor_file)
           utils.info("- Extraction: training extractor '%s' using %d training files: " %(extractor_file, len(train_files)))
         # train model
         extractor.train(train_data, extractor_file)
+        self.__release_training_data__(train_data)
 
 
 
   def extract_features(self, extractor, preprocessor, groups=None, indices = None, force=False):
     """Extracts the features from the preprocessed data using the given extractor."""
-    extractor.load(str(self.m_file_selector.extractor_file))
     data_files = self.m_file_selector.preprocessed_data_list(groups=groups)
     feature_files = self.m_file_selector.feature_list(groups=groups)
 
+    if self.m_parallel_processes > 1:
+      utils.info("- Extraction: using %d parallel processes" % self.m_parallel_processes)
+      return self.__execute_parallel__(self.extract_features, len(data_files), indices, extractor, preprocessor, groups=groups, force=force)
+
+    extractor.load(str(self.m_file_selector.extractor_file))
+
     # select a subset of indices to iterate
     if indices != None:
       index_range = range(indices[0], indices[1])
@@ -129,33 +340,29 @@ class ToolChain:
 
     utils.ensure_dir(self.m_file_selector.features_directory)
     utils.info("- Extraction: extracting %d features from directory '%s' to directory '%s'" % (len(index_range), self.m_file_selector.preprocessed_directory, self.m_file_selector.features_directory))
-    for i in index_range:
-      data_file = data_files[i]
-      feature_file = feature_files[i]
+    self.__open_shard__(self.m_file_selector.features_directory, indices)
+    # process only the files that are not there yet
+    index_range = [i for i in index_range if not self.__check_file__(feature_files[i], force, 1000)]
+    # load data
+    for i, data in self.__prefetch__(lambda i : self.__read_file__(preprocessor.read_data, data_files[i]), index_range):
+      # extract feature
+      feature = extractor(data)
+      # Save feature
+      self.__write_file_async__(extractor.save_feature, feature, feature_files[i])
 
-      if not self.__check_file__(feature_file, force, 1000):
-        # load data
-        data = preprocessor.read_data(str(data_file))
-        # extract feature
-        feature = extractor(data)
-        # Save feature
-        utils.ensure_dir(os.path.dirname(feature_file))
-        extractor.save_feature(feature, str(feature_file))
+    self.__finish_stage__()
+    self.m_file_selector.reset_feature_stores()
 
 
 
-  def __read_features__(self, files, reader):
+  def __read_features__(self, files, reader, trained_file):
     """Reads all features from file using the given reader."""
-    return [reader.read_feature(str(file)) for file in files]
+    return self.__read_training_files__(reader.read_feature, files, False, trained_file)
 
-  def __read_features_by_client__(self, files, reader):
+  def __read_features_by_client__(self, files, reader, trained_file):
     """Reads all features from file using the given reader.
     In this case, the features are split up by the according client."""
-    retval = []
-    for client_files in files:
-      # features for the client
-      retval.append([reader.read_feature(str(feature)) for feature in client_files])
-    return retval
+    return self.__read_training_files__(reader.read_feature, files, True, trained_file)
 
   def train_projector(self, tool, extractor, force=False):
     """Train the feature projector with the extracted features of the world group."""
@@ -170,26 +377,31 @@ class ToolChain:
         if tool.split_training_features_by_client:
           train_files = self.m_file_selector.training_list('features', 'train_projector', arrange_by_client = True)
           utils.info("- Projection: training projector '%s' using %d identities: " %(projector_file, len(train_files)))
-          train_features = self.__read_features_by_client__(train_files, extractor)
+          train_features = self.__read_features_by_client__(train_files, extractor, projector_file)
         else:
           train_files = self.m_file_selector.training_list('features', 'train_projector')
           utils.info("- Projection: training projector '%s' using %d training files: " %(projector_file, len(train_files)))
-          train_features = self.__read_features__(train_files, extractor)
+          train_features = self.__read_features__(train_files, extractor, projector_file)
 
         # perform training
         tool.train_projector(train_features, str(projector_file))
+        self.__release_training_data__(train_features)
 
 
 
   def project_features(self, tool, extractor, groups = None, indices = None, force=False):
     """Projects the features for all files of the database."""
-    # load the projector file
     if tool.performs_projection:
-      tool.load_projector(str(self.m_file_selector.projector_file))
-
       feature_files = self.m_file_selector.feature_list(groups=groups)
       projected_files = self.m_file_selector.projected_list(groups=groups)
 
+      if self.m_parallel_processes > 1:
+        utils.info("- Projection: using %d parallel processes" % self.m_parallel_processes)
+        return self.__execute_parallel__(self.project_features, len(feature_files), indices, tool, extractor, groups=groups, force=force)
+
+      # load the projector file
+      tool.load_projector(str(self.m_file_selector.projector_file))
+
       # select a subset of indices to iterate
       if indices != None:
         index_range = range(indices[0], indices[1])
@@ -199,19 +411,92 @@ class ToolChain:
 
       utils.ensure_dir(self.m_file_selector.projected_directory)
       utils.info("- Projection: projecting %d features from directory '%s' to directory '%s'" % (len(index_range), self.m_file_selector.features_directory, self.m_file_selector.projected_directory))
-      # extract the features
-      for i in index_range:
-        feature_file = feature_files[i]
-        projected_file = projected_files[i]
+      self.__open_shard__(self.m_file_selector.projected_directory, indices)
+      # process only the files that are not there yet
+      index_range = [i for i in index_range if not self.__check_file__(projected_files[i], force, 1000)]
+      # load feature
+      for i, feature in self.__prefetch__(lambda i : self.__read_file__(extractor.read_feature, feature_files[i]), index_range):
+        # project feature
+        projected = tool.project(feature)
+        # write it
+        self.__write_file_async__(tool.save_feature, projected, projected_files[i])
+
+      self.__finish_stage__()
+      self.m_file_selector.reset_feature_stores()
+
+
+
+  def stream_data(self, preprocessor, extractor, tool, groups = None, indices = None, force = False, intermediates = ()):
+    """Preprocesses the original data, extracts the features and projects them (if the tool performs projection) in one pass, without writing and reading the intermediate results.
+    Only the final result (the projected features, or the extracted features if the tool does not perform projection) is written,
+    the extracted features if the tool enrolls models from unprojected features,
+    and the intermediate results that are listed in intermediates ('preprocessed' and/or 'features').
+    The extractor and the projector need to be trained beforehand."""
+    data_files = self.m_file_selector.original_data_list(groups=groups)
+    # the files that will be written, depending on the directory type
+    output_files = {}
+    if 'preprocessed' in intermediates:
+      output_files['preprocessed'] = self.m_file_selector.preprocessed_data_list(groups=groups)
+    if 'features' in intermediates or not tool.performs_projection or not tool.use_projected_features_for_enrollment:
+      output_files['features'] = self.m_file_selector.feature_list(groups=groups)
+    if tool.performs_projection:
+      output_files['projected'] = self.m_file_selector.projected_list(groups=groups)
+
+    if self.m_parallel_processes > 1:
+      utils.info("- Streaming: using %d parallel processes" % self.m_parallel_processes)
+      return self.__execute_parallel__(self.stream_data, len(data_files), indices, preprocessor, extractor, tool, groups=groups, force=force, intermediates=intermediates)
+
+    extractor.load(str(self.m_file_selector.extractor_file))
+    if tool.performs_projection:
+      tool.load_projector(str(self.m_file_selector.projector_file))
+
+    # select a subset of indices to iterate
+    if indices != None:
+      index_range = range(indices[0], indices[1])
+      utils.info("- Streaming: splitting of index range %s" % str(indices))
+    else:
+      index_range = range(len(data_files))
+
+    utils.info("- Streaming: processing %d data files from directory '%s' to directories %s" % (len(index_range), self.m_file_selector.m_database.original_directory, sorted(output_files.keys())))
+
+    # read annotation files
+    annotation_list = self.m_file_selector.annotation_list(groups=groups)
+    for directory_type in output_files:
+      directory = getattr(self.m_file_selector, directory_type + '_directory')
+      utils.ensure_dir(directory)
+      self.__open_shard__(directory, indices)
+
+    def read_original_data(i):
+      file_name = data_files[i]
+      if isinstance(file_name,six.text_type):
+        file_name = str(file_name)
+      return preprocessor.read_original_data(file_name)
+
+    # process only the files for which any of the outputs is not there yet
+    index_range = [i for i in index_range if not all(self.__check_file__(files[i], force, 1000) for files in output_files.values())]
+    for i, data in self.__prefetch__(read_original_data, index_range):
+      # get the annotations; might be None
+      annotations = self.m_file_selector.get_annotations(annotation_list[i])
+
+      # call the preprocessor
+      preprocessed_data = preprocessor(data, annotations)
+      if preprocessed_data is None:
+        utils.error("Preprocessing of file %s was not successful" % str(data_files[i]))
+      if 'preprocessed' in output_files:
+        self.__write_file_async__(preprocessor.save_data, preprocessed_data, output_files['preprocessed'][i])
+
+      # extract feature
+      feature = extractor(preprocessed_data)
+      if 'features' in output_files:
+        self.__write_file_async__(extractor.save_feature, feature, output_files['features'][i])
+
+      # project feature
+      if tool.performs_projection:
+        projected = tool.project(feature)
+        self.__write_file_async__(tool.save_feature, projected, output_files['projected'][i])
 
-        if not self.__check_file__(projected_file, force, 1000):
-          # load feature
-          feature = extractor.read_feature(str(feature_file))
-          # project feature
-          projected = tool.project(feature)
-          # write it
-          utils.ensure_dir(os.path.dirname(projected_file))
-          tool.save_feature(projected, str(projected_file))
+    self.__finish_stage__()
+    self.m_file_selector.reset_feature_stores()
 
 
 
@@ -230,11 +515,12 @@ class ToolChain:
         # training models
         train_files = self.m_file_selector.training_list('projected' if tool.use_projected_features_for_enrollment else 'features', 'train_enroller', arrange_by_client = True)
         utils.info("- Enrollment: loading %d enroller training files" %len(train_files))
-        train_features = self.__read_features_by_client__(train_files, reader)
+        train_features = self.__read_features_by_client__(train_files, reader, enroller_file)
 
         # perform training
         utils.info("- Enrollment: training enroller '%s' using %d identities: " %(enroller_file, len(train_features)))
         tool.train_enroller(train_features, str(enroller_file))
+        self.__release_training_data__(train_features)
 
 
 
@@ -243,6 +529,16 @@ class ToolChain:
        This function uses the extracted or projected features to compute the models,
        depending on your setup of the base class Tool."""
 
+    if self.m_parallel_processes > 1:
+      # split the models of each group and type separately
+      utils.info("- Enrollment: using %d parallel processes" % self.m_parallel_processes)
+      for group in groups:
+        if 'N' in types:
+          self.__execute_parallel__(self.enroll_models, len(self.m_file_selector.model_ids(group)), indices, tool, extractor, compute_zt_norm, groups=[group], types=['N'], force=force)
+        if 'T' in types and compute_zt_norm:
+          self.__execute_parallel__(self.enroll_models, len(self.m_file_selector.t_model_ids(group)), indices, tool, extractor, compute_zt_norm, groups=[group], types=['T'], force=force)
+      return
+
     # read the projector file, if needed
     tool.load_projector(self.m_file_selector.projector_file)
     # read the model enrollment file
@@ -261,21 +557,16 @@ class ToolChain:
           utils.info("- Enrollment: splitting of index range %s" % str(indices))
 
         utils.info("- Enrollment: enrolling models of group '%s'" % group)
-        for model_id in model_ids:
-          # Path to the model
-          model_file = self.m_file_selector.model_file(model_id, group)
+        # Removes old files if required, and collects the enrollment files of the remaining models
+        models = [(self.m_file_selector.model_file(model_id, group), self.m_file_selector.enroll_files(model_id, group, 'projected' if tool.use_projected_features_for_enrollment else 'features')) for model_id in model_ids if not self.__check_file__(self.m_file_selector.model_file(model_id, group), force, 1000)]
 
-          # Removes old file if required
-          if not self.__check_file__(model_file, force, 1000):
-            enroll_files = self.m_file_selector.enroll_files(model_id, group, 'projected' if tool.use_projected_features_for_enrollment else 'features')
+        # load all files of the model into memory
+        for (model_file, enroll_files), enroll_features in self.__prefetch__(lambda model : self.__read_files__(reader.read_feature, model[1]), models):
+          model = tool.enroll(enroll_features)
+          # save the model
+          self.__write_file_async__(tool.save_model, model, model_file)
 
-            # load all files into memory
-            enroll_features = [reader.read_feature(str(enroll_file)) for enroll_file in enroll_files]
-
-            model = tool.enroll(enroll_features)
-            # save the model
-            utils.ensure_dir(os.path.dirname(model_file))
-            tool.save_model(model, str(model_file))
+        self.__finish_stage__()
 
     # T-Norm-Models
     if 'T' in types and compute_zt_norm:
@@ -287,42 +578,35 @@ class ToolChain:
           utils.info("- Enrollment: splitting of index range %s" % str(indices))
 
         utils.info("- Enrollment: enrolling T-models of group '%s'" % group)
-        for t_model_id in t_model_ids:
-          # Path to the model
-          t_model_file = self.m_file_selector.t_model_file(t_model_id, group)
-
-          # Removes old file if required
-          if not self.__check_file__(t_model_file, force, 1000):
-            t_enroll_files = self.m_file_selector.t_enroll_files(t_model_id, group, 'projected' if tool.use_projected_features_for_enrollment else 'features')
+        # Removes old files if required, and collects the enrollment files of the remaining models
+        t_models = [(self.m_file_selector.t_model_file(t_model_id, group), self.m_file_selector.t_enroll_files(t_model_id, group, 'projected' if tool.use_projected_features_for_enrollment else 'features')) for t_model_id in t_model_ids if not self.__check_file__(self.m_file_selector.t_model_file(t_model_id, group), force, 1000)]
 
-            # load all files into memory
-            t_enroll_features = [reader.read_feature(str(t_enroll_file)) for t_enroll_file in t_enroll_files]
+        # load all files of the model into memory
+        for (t_model_file, t_enroll_files), t_enroll_features in self.__prefetch__(lambda t_model : self.__read_files__(reader.read_feature, t_model[1]), t_models):
+          t_model = tool.enroll(t_enroll_features)
+          # save model
+          self.__write_file_async__(tool.save_model, t_model, t_model_file)
 
-            t_model = tool.enroll(t_enroll_features)
-            # save model
-            utils.ensure_dir(os.path.dirname(t_model_file))
-            tool.save_model(t_model, str(t_model_file))
+        self.__finish_stage__()
 
 
 
-  def __scores__(self, model, probe_files):
-    """Compute simple scores for the given model."""
+  def __scores__(self, model, probe_files, block_size = 128):
+    """Compute simple scores for the given model.
+    Probes are read in blocks of the given size and scored at once using the Tool.score_batch function."""
     scores = numpy.ndarray((1,len(probe_files)), 'float64')
     if self.m_file_selector.uses_probe_file_sets():
       assert isinstance(probe_files[0], list)
-      # Loops over the probe sets
-      for i in range(len(probe_files)):
-        # read probes from probe sets
-        probes = [self.m_tool.read_probe(str(probe_file)) for probe_file in probe_files[i]]
+      # Loops over the probe sets, and reads the probes of each probe set
+      for i, probes in self.__prefetch__(lambda i : self.__read_files__(self.m_tool.read_probe, probe_files[i]), range(len(probe_files))):
         # compute score
         scores[0,i] = self.m_tool.score_for_multiple_probes(model, probes)
     else:
-      # Loops over the probes
-      for i in range(len(probe_files)):
-        # read probe
-        probe = self.m_tool.read_probe(str(probe_files[i]))
-        # compute score
-        scores[0,i] = self.m_tool.score(model, probe)
+      # Loops over blocks of probes, and reads the probes of each block
+      blocks = [(start, min(start + block_size, len(probe_files))) for start in range(0, len(probe_files), block_size)]
+      for (start, end), probes in self.__prefetch__(lambda block : self.__read_files__(self.m_tool.read_probe, probe_files[block[0]:block[1]]), blocks):
+        # compute scores
+        scores[0,start:end] = self.m_tool.score_batch(model, probes)
     # Returns the scores
     return scores
 
@@ -330,30 +614,35 @@ class ToolChain:
     """Compute simple scores for the given model."""
     scores = numpy.ndarray((1,len(preloaded_probes)), 'float64')
 
-    # Loops over the probes
-    for i in range(len(preloaded_probes)):
-      # take pre-loaded probe
-      probe = preloaded_probes[i]
-      # compute score
-      scores[0,i] = self.m_tool.score(model, probe)
+    if self.m_file_selector.uses_probe_file_sets():
+      # Loops over the probe sets
+      for i in range(len(preloaded_probes)):
+        scores[0,i] = self.m_tool.score_for_multiple_probes(model, preloaded_probes[i])
+    else:
+      # compute the scores of all pre-loaded probes at once
+      scores[0,:] = self.m_tool.score_batch(model, preloaded_probes)
 
     # Returns the scores
     return scores
 
 
-  def __probe_split__(self, selected_probe_objects, all_probe_objects, all_preloaded_probes):
+  def __scores_preloaded_matrix__(self, model_files, preloaded_probes):
+    """Compute the scores of all given models with the pre-loaded probes, one row per model.
+    All models are read at once, so that the Tool.score_matrix function can compute the whole matrix with one call."""
+    models = [self.m_tool.read_model(str(model_file)) for model_file in model_files]
+    if self.m_file_selector.uses_probe_file_sets():
+      return numpy.vstack([self.__scores_preloaded__(model, preloaded_probes) for model in models])
+    return self.m_tool.score_matrix(models, preloaded_probes)
+
+
+  def __probe_columns__(self, selected_probe_objects, probe_indices):
+    """Returns the positions of the selected probe objects in the list of all probe objects of the group, i.e., their columns in the score matrices."""
+    return numpy.array([probe_indices[probe_object.id] for probe_object in selected_probe_objects], numpy.int64)
+
+  def __probe_split__(self, selected_probe_objects, group, all_preloaded_probes):
     """Helper function required when probe files are preloaded."""
-    res = []
-    selected_index = 0
-    for all_index in range(len(all_probe_objects)):
-      if selected_index < len(selected_probe_objects) and selected_probe_objects[selected_index].id == all_probe_objects[all_index].id:
-        res.append(all_preloaded_probes[all_index])
-        selected_index += 1
-    assert selected_index == len(selected_probe_objects)
-    assert len(selected_probe_objects) == len(res)
-
-    # return the split database
-    return res
+    # look up the positions of the selected probes in the list of all probes
+    return [all_preloaded_probes[index] for index in self.__probe_columns__(selected_probe_objects, self.m_file_selector.probe_indices(group))]
 
   def __save_scores__(self, score_file, scores, probe_objects, client_id):
     """Saves the scores into a text file."""
@@ -393,13 +682,12 @@ class ToolChain:
     # preload the probe files for a faster access (and fewer network load)
     if preload_probes:
       utils.info("- Scoring: preloading probe files of group '%s'" % group)
-      all_probe_objects = self.m_file_selector.probe_objects(group)
       all_probe_files = self.m_file_selector.get_paths(self.m_file_selector.probe_objects(group), 'projected' if self.m_use_projected_dir else 'features')
       # read all probe files into memory
       if self.m_file_selector.uses_probe_file_sets():
-        all_preloaded_probes = [[self.m_tool.read_probe(str(probe_file)) for probe_file in file_set] for file_set in all_probe_files]
+        all_preloaded_probes = [self.__read_files__(self.m_tool.read_probe, file_set) for file_set in all_probe_files]
       else:
-        all_preloaded_probes = [self.m_tool.read_probe(str(probe_file)) for probe_file in all_probe_files]
+        all_preloaded_probes = self.__read_files__(self.m_tool.read_probe, all_probe_files)
 
     if compute_zt_norm:
       utils.info("- Scoring: computing score matrix A for group '%s'" % group)
@@ -410,7 +698,7 @@ class ToolChain:
     for model_id in model_ids:
       # test if the file is already there
       score_file = self.m_file_selector.a_file(model_id, group) if compute_zt_norm else self.m_file_selector.no_norm_file(model_id, group)
-      if self.__check_file__(score_file, force):
+      if (self.__check_score_matrix__(score_file, force) if compute_zt_norm else self.__check_file__(score_file, force)):
         utils.warn("score file '%s' already exists." % (score_file))
       else:
         # get the probe split
@@ -418,7 +706,7 @@ class ToolChain:
         model = self.m_tool.read_model(self.m_file_selector.model_file(model_id, group))
         if preload_probes:
           # select the probe files for this model from all probes
-          current_preloaded_probes = self.__probe_split__(current_probe_objects, all_probe_objects, all_preloaded_probes)
+          current_preloaded_probes = self.__probe_split__(current_probe_objects, group, all_preloaded_probes)
           # compute A matrix
           a = self.__scores_preloaded__(model, current_preloaded_probes)
         else:
@@ -427,7 +715,7 @@ class ToolChain:
 
         if compute_zt_norm:
           # write A matrix only when you want to compute zt norm afterwards
-          bob.io.base.save(a, self.m_file_selector.a_file(model_id, group))
+          self.__save_score_matrix__(a, self.m_file_selector.a_file(model_id, group))
 
         # Save scores to text file
         self.__save_scores__(self.m_file_selector.no_norm_file(model_id, group), a, current_probe_objects, self.m_file_selector.client_id(model_id, group))
@@ -442,25 +730,33 @@ class ToolChain:
       utils.info("- Scoring: preloading Z-probe files of group '%s'" % group)
       # read all probe files into memory
       if self.m_file_selector.uses_probe_file_sets():
-        preloaded_z_probes = [[self.m_tool.read_probe(str(z_probe_file)) for z_probe_file in file_set] for file_set in z_probe_files]
+        preloaded_z_probes = [self.__read_files__(self.m_tool.read_probe, file_set) for file_set in z_probe_files]
       else:
-        preloaded_z_probes = [self.m_tool.read_probe(str(z_probe_file)) for z_probe_file in z_probe_files]
+        preloaded_z_probes = self.__read_files__(self.m_tool.read_probe, z_probe_files)
 
     utils.info("- Scoring: computing score matrix B for group '%s'" % group)
 
-    # Loads the models
+    # collect the models for which scores need to be computed
+    missing_model_ids = []
     for model_id in model_ids:
       # test if the file is already there
       score_file = self.m_file_selector.b_file(model_id, group)
-      if self.__check_file__(score_file, force):
+      if self.__check_score_matrix__(score_file, force):
         utils.warn("score file '%s' already exists." % (score_file))
       else:
+        missing_model_ids.append(model_id)
+
+    if preload_probes and missing_model_ids:
+      # compute the B matrix for all models at once
+      b_all = self.__scores_preloaded_matrix__([self.m_file_selector.model_file(model_id, group) for model_id in missing_model_ids], preloaded_z_probes)
+      for m, model_id in enumerate(missing_model_ids):
+        self.__save_score_matrix__(b_all[m:m+1,:], self.m_file_selector.b_file(model_id, group))
+    else:
+      # Loads the models
+      for model_id in missing_model_ids:
         model = self.m_tool.read_model(self.m_file_selector.model_file(model_id, group))
-        if preload_probes:
-          b = self.__scores_preloaded__(model, preloaded_z_probes)
-        else:
-          b = self.__scores__(model, z_probe_files)
-        bob.io.base.save(b, score_file)
+        b = self.__scores__(model, z_probe_files)
+        self.__save_score_matrix__(b, self.m_file_selector.b_file(model_id, group))
 
   def __scores_c__(self, t_model_ids, group, force, preload_probes):
     """Computes C scores."""
@@ -473,25 +769,33 @@ class ToolChain:
       utils.info("- Scoring: preloading probe files of group '%s'" % group)
       # read all probe files into memory
       if self.m_file_selector.uses_probe_file_sets():
-        preloaded_probes = [[self.m_tool.read_probe(str(probe_file)) for probe_file in file_set] for file_set in all_probe_files]
+        preloaded_probes = [self.__read_files__(self.m_tool.read_probe, file_set) for file_set in probe_files]
       else:
-        preloaded_probes = [self.m_tool.read_probe(str(probe_file)) for probe_file in probe_files]
+        preloaded_probes = self.__read_files__(self.m_tool.read_probe, probe_files)
 
     utils.info("- Scoring: computing score matrix C for group '%s'" % group)
 
-    # Computes the raw scores for the T-Norm model
+    # collect the T-Norm models for which scores need to be computed
+    missing_t_model_ids = []
     for t_model_id in t_model_ids:
       # test if the file is already there
       score_file = self.m_file_selector.c_file(t_model_id, group)
-      if self.__check_file__(score_file, force):
+      if self.__check_score_matrix__(score_file, force):
         utils.warn("score file '%s' already exists." % (score_file))
       else:
+        missing_t_model_ids.append(t_model_id)
+
+    if preload_probes and missing_t_model_ids:
+      # compute the C matrix for all T-Norm models at once
+      c_all = self.__scores_preloaded_matrix__([self.m_file_selector.t_model_file(t_model_id, group) for t_model_id in missing_t_model_ids], preloaded_probes)
+      for m, t_model_id in enumerate(missing_t_model_ids):
+        self.__save_score_matrix__(c_all[m:m+1,:], self.m_file_selector.c_file(t_model_id, group))
+    else:
+      # Computes the raw scores for the T-Norm model
+      for t_model_id in missing_t_model_ids:
         t_model = self.m_tool.read_model(self.m_file_selector.t_model_file(t_model_id, group))
-        if preload_probes:
-          c = self.__scores_preloaded__(t_model, preloaded_probes)
-        else:
-          c = self.__scores__(t_model, probe_files)
-        bob.io.base.save(c, score_file)
+        c = self.__scores__(t_model, probe_files)
+        self.__save_score_matrix__(c, self.m_file_selector.c_file(t_model_id, group))
 
   def __scores_d__(self, t_model_ids, group, force, preload_probes):
     """Computes D scores."""
@@ -504,9 +808,9 @@ class ToolChain:
       utils.info("- Scoring: preloading Z-probe files of group '%s'" % group)
       # read all probe files into memory
       if self.m_file_selector.uses_probe_file_sets():
-        preloaded_z_probes = [[self.m_tool.read_probe(str(z_probe_file)) for z_probe_file in file_set] for file_set in z_probe_files]
+        preloaded_z_probes = [self.__read_files__(self.m_tool.read_probe, file_set) for file_set in z_probe_files]
       else:
-        preloaded_z_probes = [self.m_tool.read_probe(str(z_probe_file)) for z_probe_file in z_probe_files]
+        preloaded_z_probes = self.__read_files__(self.m_tool.read_probe, z_probe_files)
 
     utils.info("- Scoring: computing score matrix D for group '%s'" % group)
 
@@ -515,24 +819,33 @@ class ToolChain:
     for z_probe_object in z_probe_objects:
       z_probe_ids.append(z_probe_object.client_id)
 
-    # Loads the T-Norm models
+    # collect the T-Norm models for which scores need to be computed
+    missing_t_model_ids = []
     for t_model_id in t_model_ids:
       # test if the file is already there
       score_file = self.m_file_selector.d_file(t_model_id, group)
       same_score_file = self.m_file_selector.d_same_value_file(t_model_id, group)
-      if self.__check_file__(score_file, force) and self.__check_file__(same_score_file, force):
+      if self.__check_score_matrix__(score_file, force) and self.__check_score_matrix__(same_score_file, force):
         utils.warn("score files '%s' and '%s' already exist." % (score_file, same_score_file))
+      else:
+        missing_t_model_ids.append(t_model_id)
+
+    if preload_probes and missing_t_model_ids:
+      # compute the D matrix for all T-Norm models at once
+      d_all = self.__scores_preloaded_matrix__([self.m_file_selector.t_model_file(t_model_id, group) for t_model_id in missing_t_model_ids], preloaded_z_probes)
+
+    # Loads the T-Norm models
+    for m, t_model_id in enumerate(missing_t_model_ids):
+      if preload_probes:
+        d = d_all[m:m+1,:]
       else:
         t_model = self.m_tool.read_model(self.m_file_selector.t_model_file(t_model_id, group))
-        if preload_probes:
-          d = self.__scores_preloaded__(t_model, preloaded_z_probes)
-        else:
-          d = self.__scores__(t_model, z_probe_files)
-        bob.io.base.save(d, score_file)
+        d = self.__scores__(t_model, z_probe_files)
+      self.__save_score_matrix__(d, self.m_file_selector.d_file(t_model_id, group))
 
-        t_client_id = [self.m_file_selector.client_id(t_model_id, group, True)]
-        d_same_value_tm = bob.learn.em.ztnorm_same_value(t_client_id, z_probe_ids)
-        bob.io.base.save(d_same_value_tm, same_score_file)
+      t_client_id = [self.m_file_selector.client_id(t_model_id, group, True)]
+      d_same_value_tm = bob.learn.em.ztnorm_same_value(t_client_id, z_probe_ids)
+      self.__save_score_matrix__(d_same_value_tm, self.m_file_selector.d_same_value_file(t_model_id, group))
 
 
   def compute_scores(self, tool, compute_zt_norm, force = False, indices = None, groups = ['dev', 'eval'], types = ['A', 'B', 'C', 'D'], preload_probes = False):
@@ -588,54 +901,42 @@ class ToolChain:
             t_model_ids_short = t_model_ids
           self.__scores_d__(t_model_ids_short, group, force, preload_probes)
 
+    self.__finish_stage__()
 
 
-  def __c_matrix_split_for_model__(self, selected_probe_objects, all_probe_objects, all_c_scores):
-    """Helper function to sub-select the c-scores in case not all probe files were used to compute A scores."""
-    c_scores_for_model = numpy.ndarray((all_c_scores.shape[0], len(selected_probe_objects)), numpy.float64)
-    selected_index = 0
-    for all_index in range(len(all_probe_objects)):
-      if selected_index < len(selected_probe_objects) and selected_probe_objects[selected_index].id == all_probe_objects[all_index].id:
-        c_scores_for_model[:,selected_index] = all_c_scores[:,all_index]
-        selected_index += 1
-    assert selected_index == len(selected_probe_objects)
 
-    # return the split database
-    return c_scores_for_model
+  def __stack_score_matrices__(self, score_files, dtype = numpy.float64):
+    """Reads the given score matrices of one row each into a single preallocated matrix with one row per file."""
+    matrix = None
+    for i, score_file in enumerate(score_files):
+      scores = self.__load_score_matrix__(score_file)
+      if matrix is None:
+        matrix = numpy.ndarray((len(score_files), scores.shape[1]), dtype)
+      matrix[i:i+1,:] = scores
+    return matrix
+
+  def __c_matrix_split_for_model__(self, selected_probe_objects, probe_indices, all_c_scores):
+    """Helper function to sub-select the c-scores in case not all probe files were used to compute A scores."""
+    return all_c_scores[:, self.__probe_columns__(selected_probe_objects, probe_indices)]
 
   def __scores_c_normalize__(self, model_ids, t_model_ids, group):
     """Compute normalized probe scores using T-model scores."""
     # read all tmodel scores
-    c_for_all = None
-    for t_model_id in t_model_ids:
-      tmp = bob.io.base.load(self.m_file_selector.c_file(t_model_id, group))
-      if c_for_all is None:
-        c_for_all = tmp
-      else:
-        c_for_all = numpy.vstack((c_for_all, tmp))
+    c_for_all = self.__stack_score_matrices__([self.m_file_selector.c_file(t_model_id, group) for t_model_id in t_model_ids])
     # iterate over all models and generate C matrices for that specific model
-    all_probe_objects = self.m_file_selector.probe_objects(group)
+    probe_indices = self.m_file_selector.probe_indices(group)
     for model_id in model_ids:
       # select the correct probe files for the current model
       probe_objects_for_model = self.m_file_selector.probe_objects_for_model(model_id, group)
-      c_matrix_for_model = self.__c_matrix_split_for_model__(probe_objects_for_model, all_probe_objects, c_for_all)
+      c_matrix_for_model = self.__c_matrix_split_for_model__(probe_objects_for_model, probe_indices, c_for_all)
       # Save C matrix to file
       bob.io.base.save(c_matrix_for_model, self.m_file_selector.c_file_for_model(model_id, group))
 
   def __scores_d_normalize__(self, t_model_ids, group):
     """Compute normalized D scores for the given T-model ids"""
-    # initialize D and D_same_value matrices
-    d_for_all = None
-    d_same_value = None
-    for t_model_id in t_model_ids:
-      tmp = bob.io.base.load(self.m_file_selector.d_file(t_model_id, group))
-      tmp2 = bob.io.base.load(self.m_file_selector.d_same_value_file(t_model_id, group))
-      if d_for_all is None and d_same_value is None:
-        d_for_all = tmp
-        d_same_value = tmp2
-      else:
-        d_for_all = numpy.vstack((d_for_all, tmp))
-        d_same_value = numpy.vstack((d_same_value, tmp2))
+    # read D and D_same_value matrices
+    d_for_all = self.__stack_score_matrices__([self.m_file_selector.d_file(t_model_id, group) for t_model_id in t_model_ids])
+    d_same_value = self.__stack_score_matrices__([self.m_file_selector.d_same_value_file(t_model_id, group) for t_model_id in t_model_ids], bool)
 
     # Saves to files
     bob.io.base.save(d_for_all, self.m_file_selector.d_matrix_file(group))
@@ -643,14 +944,49 @@ class ToolChain:
 
 
 
+  def __zt_norm_in_memory__(self, model_ids, t_model_ids, group):
+    """Computes ZT-Norm for all models of the group at once, using the score matrices that are kept in memory.
+    The A scores of all models are placed in one matrix over all probes of the group, where model/probe pairs that are not compared are NaN.
+    As each ZT-normalized score only depends on the B scores of its model and the C scores of its probe, one call to bob.learn.em.ztnorm normalizes all models."""
+    probe_indices = self.m_file_selector.probe_indices(group)
+
+    # collect the B, C and D matrices of all (T-)models
+    b = self.__stack_score_matrices__([self.m_file_selector.b_file(model_id, group) for model_id in model_ids])
+    c = self.__stack_score_matrices__([self.m_file_selector.c_file(t_model_id, group) for t_model_id in t_model_ids])
+    d = self.__stack_score_matrices__([self.m_file_selector.d_file(t_model_id, group) for t_model_id in t_model_ids])
+    d_same_value = self.__stack_score_matrices__([self.m_file_selector.d_same_value_file(t_model_id, group) for t_model_id in t_model_ids], bool)
+
+    # spread the A scores of all models into the model x probe matrix
+    a = numpy.empty((len(model_ids), len(probe_indices)), numpy.float64)
+    a.fill(numpy.nan)
+    probe_objects = []
+    probe_columns = []
+    for m, model_id in enumerate(model_ids):
+      probe_objects.append(self.m_file_selector.probe_objects_for_model(model_id, group))
+      probe_columns.append(self.__probe_columns__(probe_objects[m], probe_indices))
+      a[m, probe_columns[m]] = self.__load_score_matrix__(self.m_file_selector.a_file(model_id, group))[0]
+
+    # compute zt scores of all models
+    zt_scores = bob.learn.em.ztnorm(a, b, c, d, d_same_value)
+
+    for m, model_id in enumerate(model_ids):
+      # Saves to text file
+      self.__save_scores__(self.m_file_selector.zt_norm_file(model_id, group), zt_scores[m:m+1, probe_columns[m]], probe_objects[m], self.m_file_selector.client_id(model_id, group))
+
+
   def zt_norm(self, groups = ['dev', 'eval']):
-    """Computes ZT-Norm using the previously generated A, B, C, and D files"""
+    """Computes ZT-Norm using the previously generated A, B, C, and D files (or score matrices, when they are kept in memory)"""
     for group in groups:
       utils.info("- Scoring: computing ZT-norm for group '%s'" % group)
       # list of models
       model_ids = self.m_file_selector.model_ids(group)
       t_model_ids = self.m_file_selector.t_model_ids(group)
 
+      if self.m_score_matrices is not None:
+        # normalize all models at once
+        self.__zt_norm_in_memory__(model_ids, t_model_ids, group)
+        continue
+
       # first, normalize C and D scores
       self.__scores_c_normalize__(model_ids, t_model_ids, group)
       # and normalize it
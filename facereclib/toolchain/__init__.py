@@ -4,6 +4,7 @@
 
 """Tool chain for computing verification scores"""
 
+from .FeatureStore import FeatureStore
 from .FileSelector import FileSelector
 from .ToolChain import ToolChain
 
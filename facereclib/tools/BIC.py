@@ -57,6 +57,8 @@ class BIC (Tool):
       self.m_bic_machine = bob.learn.linear.BICMachine(False)
       self.m_M_I = None
       self.m_M_E = None
+    # the parameters of the BIC machine, which are used to compute many scores at once
+    self.m_bic_parameters = None
 
 
   def __compare__(self, feature_1, feature_2):
@@ -64,39 +66,69 @@ class BIC (Tool):
     return self.m_comparison_function(feature_1, feature_2)
 
 
+  def __select_pairs__(self, count, kind):
+    """Returns the indices of the pairs that are selected from the given number of pairs."""
+    if self.m_maximum_pair_count is not None and count > self.m_maximum_pair_count:
+      utils.info("  -> Limiting %s pairs from %d to %d" % (kind, count, self.m_maximum_pair_count))
+      return numpy.array(utils.quasi_random_indices(count, self.m_maximum_pair_count), numpy.int64)
+    return numpy.arange(count, dtype = numpy.int64)
+
+
   def __intra_extra_pairs__(self, train_features):
-    """Computes intrapersonal and extrapersonal pairs of features from given training files"""
-    # generate intrapersonal pairs
-    intra_pairs = []
-    for client in range(len(train_features)):
-      for c in range(len(train_features[client])-1):
-        for c2 in range (c+1, len(train_features[client])):
-          intra_pairs.append((train_features[client][c], train_features[client][c2]))
-
-    # generate extrapersonal pairs
-    extra_pairs = []
-    for client in range(len(train_features)):
-      for c in range(len(train_features[client])):
-        for impostor in range(len(train_features)):
-          if client != impostor:
-            for i in range(len(train_features[impostor])):
-              extra_pairs.append((train_features[client][c], train_features[impostor][i]))
-
-    # limit the number of pairs by random selection
-    if self.m_maximum_pair_count != None:
-      if len(intra_pairs) > self.m_maximum_pair_count:
-        utils.info("  -> Limiting intrapersonal pairs from %d to %d" %(len(intra_pairs),self.m_maximum_pair_count))
-        intra_pairs = [intra_pairs[i] for i in utils.quasi_random_indices(len(intra_pairs), self.m_maximum_pair_count)]
-      if len(extra_pairs) > self.m_maximum_pair_count:
-        utils.info("  -> Limiting extrapersonal pairs from %d to %d" %(len(extra_pairs), self.m_maximum_pair_count))
-        extra_pairs = [extra_pairs[i] for i in utils.quasi_random_indices(len(extra_pairs), self.m_maximum_pair_count)]
-
-    return (intra_pairs, extra_pairs)
-
-
-  def __trainset_for__(self, pairs):
-    """Computes the array containing the comparison results for the given set of image pairs."""
-    return numpy.vstack([self.__compare__(f1, f2) for (f1, f2) in pairs])
+    """Computes intrapersonal and extrapersonal pairs of features from given training files.
+    The features are identified by their index in the list of all features, client by client.
+    Each set of pairs is returned as two index arrays, one for the first and one for the second features of the pairs.
+    Only the selected pairs are generated, without listing all possible pairs."""
+    sizes = numpy.array([len(client) for client in train_features], numpy.int64)
+    starts = numpy.concatenate(([0], numpy.cumsum(sizes)))
+    clients = numpy.repeat(numpy.arange(len(sizes)), sizes)
+
+    # intrapersonal pairs: for each client, all pairs (c, c2) with c < c2
+    intra_counts = sizes * (sizes - 1) // 2
+    intra_ends = numpy.cumsum(intra_counts)
+    intra_indices = self.__select_pairs__(int(intra_ends[-1]) if len(sizes) else 0, "intrapersonal")
+    intra_clients = numpy.searchsorted(intra_ends, intra_indices, side = 'right')
+    intra_offsets = intra_indices - (intra_ends - intra_counts)[intra_clients]
+    intra_first = numpy.ndarray(intra_indices.shape, numpy.int64)
+    intra_second = numpy.ndarray(intra_indices.shape, numpy.int64)
+    for client in numpy.unique(intra_clients):
+      selected = intra_clients == client
+      # the pairs of a client are enumerated in the same order as the upper triangle of its feature matrix
+      rows, columns = numpy.triu_indices(sizes[client], 1)
+      intra_first[selected] = starts[client] + rows[intra_offsets[selected]]
+      intra_second[selected] = starts[client] + columns[intra_offsets[selected]]
+
+    # extrapersonal pairs: for each feature, all features of the other clients
+    extra_counts = starts[-1] - sizes[clients]
+    extra_ends = numpy.cumsum(extra_counts)
+    extra_indices = self.__select_pairs__(int(extra_ends[-1]) if len(clients) else 0, "extrapersonal")
+    extra_first = numpy.searchsorted(extra_ends, extra_indices, side = 'right')
+    extra_second = extra_indices - (extra_ends - extra_counts)[extra_first]
+    # skip the features of the client itself
+    client_of_first = clients[extra_first]
+    extra_second += numpy.where(extra_second >= starts[client_of_first], sizes[client_of_first], 0)
+
+    return ((intra_first, intra_second), (extra_first, extra_second))
+
+
+  def __trainset_for__(self, features, pairs, batch_size = 4096):
+    """Computes the array containing the comparison results for the given pairs of features, which are given as two index arrays."""
+    first, second = pairs
+    if not len(first):
+      raise ValueError("No training pairs could be generated; please check your training data")
+    # compute the first comparison to get the length of the comparison results
+    vector = self.__compare__(features[first[0]], features[second[0]])
+    vectors = numpy.ndarray((len(first), vector.shape[0]), numpy.float64)
+    if isinstance(self.m_comparison_function, numpy.ufunc) and all(isinstance(f, numpy.ndarray) and f.shape == features[0].shape and f.ndim == 1 for f in features):
+      # compare the features of batches of pairs at once
+      stacked = numpy.vstack(features)
+      for start in range(0, len(first), batch_size):
+        end = min(start + batch_size, len(first))
+        vectors[start:end] = self.m_comparison_function(stacked[first[start:end]], stacked[second[start:end]])
+    else:
+      for p in range(len(first)):
+        vectors[p] = self.__compare__(features[first[p]], features[second[p]])
+    return vectors
 
 
   def train_enroller(self, train_features, enroller_file):
@@ -105,12 +137,13 @@ class BIC (Tool):
     # compute intrapersonal and extrapersonal pairs
     utils.info("  -> Computing pairs")
     intra_pairs, extra_pairs = self.__intra_extra_pairs__(train_features)
+    features = [feature for client in train_features for feature in client]
 
     # train the BIC Machine with these pairs
-    utils.info("  -> Computing %d intrapersonal results" % len(intra_pairs))
-    intra_vectors = self.__trainset_for__(intra_pairs)
-    utils.info("  -> Computing %d extrapersonal results" % len(extra_pairs))
-    extra_vectors = self.__trainset_for__(extra_pairs)
+    utils.info("  -> Computing %d intrapersonal results" % len(intra_pairs[0]))
+    intra_vectors = self.__trainset_for__(features, intra_pairs)
+    utils.info("  -> Computing %d extrapersonal results" % len(extra_pairs[0]))
+    extra_vectors = self.__trainset_for__(features, extra_pairs)
 
     utils.info("  -> Training BIC machine")
     trainer = bob.learn.linear.BICTrainer(self.m_M_I, self.m_M_E) if self.m_M_I != None else bob.learn.linear.BICTrainer()
@@ -126,6 +159,55 @@ class BIC (Tool):
     # to set this should not be required, but just in case
     # you re-use a trained enroller file that hat different setup of use_DFFS
     self.m_bic_machine.use_DFFS = self.m_use_dffs
+    self.m_bic_parameters = self.__read_bic_parameters__(bob.io.base.HDF5File(enroller_file, 'r'))
+
+
+  def __read_bic_parameters__(self, hdf5):
+    """Reads the means, variances and (optionally) subspaces of the BIC machine from the given enroller file.
+    The scores that are computed from these parameters are checked against the BIC machine; if they differ, None is returned."""
+    names = ['intra_mean', 'intra_variance', 'extra_mean', 'extra_variance']
+    if not hdf5.has_key('project_data'):
+      utils.warn("The enroller file does not contain the parameters of the BIC machine; scores are computed one by one")
+      return None
+    parameters = {'project_data' : bool(hdf5.read('project_data'))}
+    if parameters['project_data']:
+      names += ['intra_subspace', 'intra_rho', 'extra_subspace', 'extra_rho']
+    for name in names:
+      if not hdf5.has_key(name):
+        utils.warn("The enroller file does not contain the parameters of the BIC machine; scores are computed one by one")
+        return None
+      parameters[name] = hdf5.read(name)
+
+    # check that the parameters are interpreted correctly
+    vector = numpy.random.RandomState(42).uniform(-1., 1., parameters['intra_mean'].shape)
+    self.m_bic_parameters = parameters
+    if abs(self.__bic_scores__(vector[numpy.newaxis,:])[0] - self.m_bic_machine(vector)) > 1e-8 * max(1., abs(self.m_bic_machine(vector))):
+      utils.warn("The parameters of the BIC machine could not be interpreted; scores are computed one by one")
+      return None
+    return parameters
+
+
+  def __bic_scores__(self, vectors):
+    """Applies the BIC machine to all rows of the given 2D array of comparison results at once"""
+    parameters = self.m_bic_parameters
+    if parameters is None:
+      return numpy.array([self.m_bic_machine(vector) for vector in vectors])
+
+    intra_difference = vectors - parameters['intra_mean']
+    extra_difference = vectors - parameters['extra_mean']
+    if not parameters['project_data']:
+      # IEC: the average of the normalized differences
+      return numpy.mean(extra_difference ** 2 / parameters['extra_variance'] - intra_difference ** 2 / parameters['intra_variance'], axis = 1)
+
+    # BIC: Mahalanobis distances in the intrapersonal and extrapersonal subspaces
+    intra_projected = numpy.dot(intra_difference, parameters['intra_subspace'])
+    extra_projected = numpy.dot(extra_difference, parameters['extra_subspace'])
+    scores = numpy.sum(extra_projected ** 2 / parameters['extra_variance'], axis = 1) - numpy.sum(intra_projected ** 2 / parameters['intra_variance'], axis = 1)
+    if self.m_use_dffs:
+      # add the distances from feature space
+      scores += (numpy.sum(extra_difference ** 2, axis = 1) - numpy.sum(extra_projected ** 2, axis = 1)) / parameters['extra_rho']
+      scores -= (numpy.sum(intra_difference ** 2, axis = 1) - numpy.sum(intra_projected ** 2, axis = 1)) / parameters['intra_rho']
+    return scores / (intra_projected.shape[1] + extra_projected.shape[1])
 
 
   def enroll(self, enroll_features):
@@ -169,7 +251,21 @@ class BIC (Tool):
     # apply the BIC machine
     return self.m_bic_machine(distance_vector)
 
+  def __comparisons__(self, model, probes):
+    """Computes the comparison results of all model features with all probes, as a 2D array with one row per (model feature, probe) pair"""
+    if isinstance(self.m_comparison_function, numpy.ufunc) and all(isinstance(f, numpy.ndarray) and f.ndim == 1 for f in list(model) + list(probes)):
+      # compare all pairs in one array operation
+      model_features = numpy.vstack(model)[:,numpy.newaxis,:]
+      probe_features = numpy.vstack(probes)[numpy.newaxis,:,:]
+      return self.m_comparison_function(model_features, probe_features).reshape((-1, model_features.shape[2]))
+    return numpy.vstack([self.__compare__(model_feature, probe) for model_feature in model for probe in probes])
+
   def score(self, model, probe):
     """Computes the IEC score for the given model and probe pair"""
+    return self.score_batch(model, [probe])[0]
+
+  def score_batch(self, model, probes):
+    """Computes the IEC scores of the given model with all given probes at once; the scores of the model features are fused for each probe"""
+    scores = self.__bic_scores__(self.__comparisons__(model, probes)).reshape((len(model), len(probes)))
     # compute average score for the models
-    return self.m_model_fusion_function([self.__iec_score__(model[i], probe) for i in range(len(model))])
+    return self.m_model_fusion_function(scores, axis = 0)
@@ -9,6 +9,7 @@ import numpy
 import math
 
 from .Tool import Tool
+from .. import utils
 
 class GaborJets (Tool):
   """Tool chain for computing Gabor jets, Gabor graphs, and Gabor graph comparisons"""
@@ -59,6 +60,7 @@ class GaborJets (Tool):
 
     # jet comparison function
     self.m_similarity_function = bob.ip.gabor.Similarity(gabor_jet_similarity_type, gwt)
+    self.m_similarity_type = gabor_jet_similarity_type
 
     # how to proceed with multiple features per model
     self.m_jet_scoring = {
@@ -85,18 +87,25 @@ class GaborJets (Tool):
 
 
   def enroll(self, enroll_features):
-    """Enrolls the model by computing an average graph for each model"""
+    """Enrolls the model by computing an average graph for each model.
+    When the features are graph arrays, the model is an array as well: a 3D array of all enrollment graphs, or the 2D array of the average graph."""
     assert len(enroll_features)
+    as_array = isinstance(enroll_features[0], numpy.ndarray)
     if self.m_jet_scoring is not None:
-      return enroll_features
+      return utils.gabor.graphs_to_array(enroll_features) if as_array else enroll_features
 
     # compute average model
-    return [bob.ip.gabor.Jet([enroll_features[g][n] for g in range(len(enroll_features))], normalize=True) for n in range(len(enroll_features[0]))]
+    enroll_graphs = [utils.gabor.array_to_graph(graph) for graph in enroll_features]
+    model = [bob.ip.gabor.Jet([enroll_graphs[g][n] for g in range(len(enroll_graphs))], normalize=True) for n in range(len(enroll_graphs[0]))]
+    return utils.gabor.graph_to_array(model) if as_array else model
 
 
   def save_model(self, model, model_file):
     f = bob.io.base.HDF5File(model_file, 'w')
-    if self.m_jet_scoring is None:
+    if isinstance(model, numpy.ndarray):
+      # the graph(s) are stored in one array
+      utils.gabor.save(model, f)
+    elif self.m_jet_scoring is None:
       # only one averaged model
       bob.ip.gabor.save_jets(model, f)
     else:
@@ -112,7 +121,10 @@ class GaborJets (Tool):
 
   def read_model(self, model_file):
     f = bob.io.base.HDF5File(model_file)
-    if self.m_jet_scoring is None:
+    if utils.gabor.is_array_file(f):
+      # the graph(s) are stored in one array
+      return utils.gabor.load(f)
+    elif self.m_jet_scoring is None:
       # only one graph
       assert not f.has_key("NumberOfModels")
       return bob.ip.gabor.load_jets(f)
@@ -128,30 +140,71 @@ class GaborJets (Tool):
       return model
 
   def read_probe(self, probe_file):
-    return bob.ip.gabor.load_jets(bob.io.base.HDF5File(probe_file))
+    f = bob.io.base.HDF5File(probe_file)
+    if utils.gabor.is_array_file(f):
+      return utils.gabor.load(f)
+    return bob.ip.gabor.load_jets(f)
+
+  def __graph_arrays__(self, graphs):
+    """Returns the absolute values and the phases of the jets of the given graphs, each as an array of shape (graph, node, wavelet).
+    Graphs that are stored as arrays are not copied."""
+    return utils.gabor.split(utils.gabor.graphs_to_array(graphs))
+
+  def __similarities__(self, model_graphs, probe_graphs):
+    """Computes the similarities between the jets of all model graphs and the jets at the same nodes of all probe graphs.
+    The result is an array of shape (model graph, probe graph, node).
+    The ScalarProduct, Canberra and AbsPhase similarities are computed for all jets at once.
+    The similarities that estimate the disparity between two jets (e.g., Disparity, PhaseDiff and PhaseDiffPlusCanberra) fall back to calling :py:class:`bob.ip.gabor.Similarity` for each pair of jets,
+    so that the iterative disparity estimation is identical to the one of bob."""
+    if self.m_similarity_type in ('ScalarProduct', 'Canberra', 'AbsPhase'):
+      # these similarities are computed for all jets at once
+      model_abs, model_phase = self.__graph_arrays__(model_graphs)
+      probe_abs, probe_phase = self.__graph_arrays__(probe_graphs)
+      if self.m_similarity_type == 'ScalarProduct':
+        return numpy.einsum('mnj,pnj->mpn', model_abs, probe_abs)
+      if self.m_similarity_type == 'AbsPhase':
+        # a1 * a2 * cos(p1 - p2) = a1 * cos(p1) * a2 * cos(p2) + a1 * sin(p1) * a2 * sin(p2)
+        return numpy.einsum('mnj,pnj->mpn', model_abs * numpy.cos(model_phase), probe_abs * numpy.cos(probe_phase)) \
+             + numpy.einsum('mnj,pnj->mpn', model_abs * numpy.sin(model_phase), probe_abs * numpy.sin(probe_phase))
+      # Canberra
+      model_abs = model_abs[:,numpy.newaxis]
+      probe_abs = probe_abs[numpy.newaxis,:]
+      return numpy.mean(1. - numpy.abs(model_abs - probe_abs) / (model_abs + probe_abs), axis=3)
+
+    # the similarities that estimate the disparity are computed for each pair of jets
+    similarities = numpy.ndarray((len(model_graphs), len(probe_graphs), len(probe_graphs[0])), numpy.float64)
+    model_graphs = [utils.gabor.array_to_graph(graph) for graph in model_graphs]
+    probe_graphs = [utils.gabor.array_to_graph(graph) for graph in probe_graphs]
+    for m, model_graph in enumerate(model_graphs):
+      for p, probe_graph in enumerate(probe_graphs):
+        for n in range(len(model_graph)):
+          similarities[m,p,n] = self.m_similarity_function(model_graph[n], probe_graph[n])
+    return similarities
+
+  def __model_graphs__(self, model):
+    """Returns the list of graphs of the given model."""
+    return [model] if self.m_jet_scoring is None else model
+
 
   def score(self, model, probe):
     """Computes the score of the probe and the model"""
-    if self.m_jet_scoring is None:
-      # compute sum of Gabor jet similarities between averaged model graph and probe graph
-      return numpy.average([self.m_similarity_function(model[n], probe[n]) for n in range(len(model))])
-    else:
-      # compute all Gabor jet similarities
-      scores = [[self.m_similarity_function(model[c][n], probe[n]) for n in range(len(model[0]))] for c in range(len(model))]
-      # for each jet location, compute the desired score averaging
-      return self.m_graph_scoring(self.m_jet_scoring(scores, axis=0))
+    return self.score_batch(model, [probe])[0]
 
+  def score_batch(self, model, probes):
+    """Computes the scores of the given model graph(s) with all given probe graphs at once."""
+    similarities = self.__similarities__(self.__model_graphs__(model), probes)
+    if self.m_jet_scoring is None:
+      # compute the average Gabor jet similarity between averaged model graph and probe graphs
+      return numpy.average(similarities[0], axis=1)
+    # for each jet location, compute the desired score averaging over the model graphs, and fuse the scores of all jet locations
+    return self.m_graph_scoring(self.m_jet_scoring(similarities, axis=0), axis=1)
 
   def score_for_multiple_probes(self, model, probes):
     """This function computes the score between the given model graph(s) and several given probe graphs."""
+    similarities = self.__similarities__(self.__model_graphs__(model), probes)
     if self.m_jet_scoring is None:
-      # compute sum of Gabor jet similarities between averaged model graph and probe graphs
-      return numpy.average([self.m_similarity_function(model[n], probes[p][n]) for n in range(len(model)) for p in range(len(probes))])
-    else:
-      # compute all Gabor jet similarities
-      scores = [[self.m_similarity_function(model[c][n], probes[p][n]) for n in range(len(model[0]))] for p in range(len(probes)) for c in range(len(model))]
-      # for each jet location, compute the desired score averaging
-      return self.m_graph_scoring(self.m_jet_scoring(scores, axis=0))
-
-
-
+      # compute the average Gabor jet similarity between averaged model graph and probe graphs
+      return numpy.average(similarities)
+    # each pair of model and probe graph is handled like a separate model graph
+    similarities = similarities.reshape((-1, similarities.shape[2]))
+    return self.m_graph_scoring(self.m_jet_scoring(similarities, axis=0))
@@ -69,7 +69,7 @@ class ISV (UBMGMM):
   def train_projector(self, train_features, projector_file):
     """Train Projector and Enroller at the same time"""
 
-    data1 = numpy.vstack([feature for client in train_features for feature in client])
+    data1 = utils.vstack_features(train_features)
 
     UBMGMM._train_projector_using_array(self, data1)
     # to save some memory, we might want to delete these data
@@ -77,14 +77,7 @@ class ISV (UBMGMM):
 
     # project training data
     utils.info("  -> Projecting training data")
-    data = []
-    for client_features in train_features:
-      list = []
-      for feature in client_features:
-        # Initializes GMMStats object
-        self.m_gmm_stats = bob.learn.em.GMMStats(*self.m_ubm.shape)
-        list.append(UBMGMM.project(self, feature))
-      data.append(list)
+    data = [self._project_training_features(client_features) for client_features in train_features]
 
     # train ISV
     self._train_isv(data)
@@ -193,6 +186,33 @@ class ISV (UBMGMM):
     Ux = probe[1]
     return model.forward_ux(gmmstats, Ux)
 
+  def __probe_matrix__(self, probes):
+    """Packs the first order statistics of the given probes, centered by the UBM means and the channel offsets Ux, into the rows of one matrix.
+    Additionally, the number of frames of each probe is returned."""
+    ubm_means = self.m_ubm.mean_supervector
+    dimension = self.m_ubm.shape[1]
+    matrix = numpy.ndarray((len(probes), ubm_means.shape[0]), numpy.float64)
+    frames = numpy.ndarray((len(probes),), numpy.float64)
+    for p, (gmmstats, Ux) in enumerate(probes):
+      # F - N * (m + Ux)
+      matrix[p] = gmmstats.sum_px.flatten() - numpy.repeat(gmmstats.n, dimension) * (ubm_means + Ux)
+      frames[p] = gmmstats.t
+    return matrix, frames
+
+  def __model_matrix__(self, models):
+    """Packs the offsets D * z of the given models from the UBM means, divided by the UBM variances, into the rows of one matrix"""
+    return numpy.vstack([model.isv_base.d * model.z for model in models]) / self.m_ubm.variance_supervector
+
+  def score_batch(self, model, probes):
+    """Computes the scores of the given model with all given probes at once"""
+    return self.score_matrix([model], probes)[0]
+
+  def score_matrix(self, models, probes):
+    """Computes the scores of all given models with all given probes in one matrix product.
+    The scores are identical to the linear scoring with frame length normalization of ISVMachine.forward_ux."""
+    probe_matrix, frames = self.__probe_matrix__(probes)
+    return numpy.dot(self.__model_matrix__(models), probe_matrix.T) / frames
+
   def score_for_multiple_probes(self, model, probes):
     """This function computes the score between the given model and several given probe files."""
     if self.m_probe_fusion_function is not None:
@@ -56,11 +56,7 @@ class IVector (UBMGMM):
 
   def _train_ivector(self, train_features):
     utils.info("  -> Projecting training data")
-    data = []
-    for feature in train_features:
-      # Initializes GMMStats object
-      self.m_gmm_stats = bob.learn.em.GMMStats(*self.m_ubm.shape)
-      data.append(UBMGMM.project(self, feature))
+    data = self._project_training_features(train_features)
 
     utils.info("  -> Training IVector enroller")
     self.m_tv = bob.learn.em.IVectorMachine(self.m_ubm, self.m_subspace_dimension_of_t)
@@ -85,7 +81,7 @@ class IVector (UBMGMM):
   def train_projector(self, train_features, projector_file):
     """Train Projector and Enroller at the same time"""
 
-    data = numpy.vstack(train_features)
+    data = utils.vstack_features(train_features)
 
     UBMGMM._train_projector_using_array(self, data)
     # to save some memory, we might want to delete these data
@@ -124,6 +120,7 @@ class IVector (UBMGMM):
     # read UBM
     self.m_ubm = bob.learn.em.GMMMachine(hdf5file)
     self.m_ubm.set_variance_thresholds(self.m_variance_threshold)
+    self.m_ubm_hash = self.__ubm_hash__()
     # Initializes GMMStats object
     self.m_gmm_stats = bob.learn.em.GMMStats(*self.m_ubm.shape)
 
@@ -189,32 +186,39 @@ class IVector (UBMGMM):
   #######################################################
   ################## Model  Enrollment ###################
   def enroll(self, enroll_features):
-    """Performs IVector enrollment"""
+    """Performs IVector enrollment, the model is the length-normalized average i-vector"""
     model = numpy.mean(numpy.vstack(enroll_features), axis=0)
-    return model
+    return model / numpy.linalg.norm(model)
 
 
   ######################################################
   ################ Feature comparison ##################
   def read_model(self, model_file):
-    """Reads the whitened i-vector that holds the model"""
-    return utils.load(model_file)
+    """Reads the whitened i-vector that holds the model, and assures that it is length-normalized"""
+    model = utils.load(model_file).astype(numpy.float64)
+    return model / numpy.linalg.norm(model)
 
   def read_probe(self, probe_file):
-    """read probe file which is an i-vector"""
-    return utils.load(probe_file)
+    """read probe file which is an i-vector, and assures that it is length-normalized"""
+    probe = utils.load(probe_file).astype(numpy.float64)
+    return probe / numpy.linalg.norm(probe)
 
   def score(self, model, probe):
-    """Computes the score for the given model and the given probe."""
-    a = model/numpy.linalg.norm(model)
-    b = probe/numpy.linalg.norm(probe)
-    if len(a) != len(b):
+    """Computes the cosine score for the given length-normalized model and probe."""
+    if len(model) != len(probe):
         raise ValueError("a and b must be same length")
-    numerator = sum(tup[0] * tup[1] for tup in zip(a,b))
-    return numerator
+    return numpy.dot(model, probe)
+
+  def score_batch(self, model, probes):
+    """Computes the cosine scores of the given length-normalized model and all given length-normalized probes with one matrix-vector product."""
+    return numpy.dot(numpy.vstack(probes), model)
+
+  def score_matrix(self, models, probes):
+    """Computes the cosine scores of all given length-normalized models and probes with one matrix product."""
+    return numpy.dot(numpy.vstack(models), numpy.vstack(probes).T)
 
 
   def score_for_multiple_probes(self, model, probes):
     """This function computes the score between the given model and several given probe files."""
-    probes = numpy.vstack([numpy.mean(numpy.vstack(probes), axis=0)])
-    return self.score(model,probes)
+    probe = numpy.mean(numpy.vstack(probes), axis=0)
+    return self.score(model, probe / numpy.linalg.norm(probe))
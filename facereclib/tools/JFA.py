@@ -59,6 +59,7 @@ class JFA (UBMGMM):
     # read UBM
     self.m_ubm = bob.learn.em.GMMMachine(bob.io.base.HDF5File(projector_file))
     self.m_ubm.set_variance_thresholds(self.m_variance_threshold)
+    self.m_ubm_hash = self.__ubm_hash__()
     # Initializes GMMStats object
     self.m_gmm_stats = bob.learn.em.GMMStats(*self.m_ubm.shape)
 
@@ -6,6 +6,7 @@ import bob.io.base
 import bob.learn.linear
 
 import numpy
+import scipy.linalg
 import scipy.spatial
 
 from .Tool import Tool
@@ -21,6 +22,9 @@ class LDA (Tool):
       distance_function = scipy.spatial.distance.euclidean,
       is_distance_function = True,
       uses_variances = False,
+      pca_training_chunk_size = None, # if given, the PCA is trained chunk by chunk with the given number of features per chunk
+      pca_randomized_training = False, # if enabled (and pca_training_chunk_size is given), the largest PCA eigenvectors are approximated with randomized subspace iterations
+      accumulate_scatters = False, # if enabled, the LDA is trained by accumulating the scatter matrices client by client
       **kwargs  # parameters directly sent to the base class
   ):
     """Initializes the LDA tool with the given configuration"""
@@ -36,6 +40,9 @@ class LDA (Tool):
         distance_function = str(distance_function),
         is_distance_function = is_distance_function,
         uses_variances = uses_variances,
+        pca_training_chunk_size = pca_training_chunk_size,
+        pca_randomized_training = pca_randomized_training,
+        accumulate_scatters = accumulate_scatters,
 
         **kwargs
     )
@@ -50,28 +57,46 @@ class LDA (Tool):
     self.m_distance_function = distance_function
     self.m_factor = -1 if is_distance_function else 1.
     self.m_uses_variances = uses_variances
+    self.m_pca_training_chunk_size = pca_training_chunk_size
+    self.m_pca_randomized_training = pca_randomized_training
+    self.m_accumulate_scatters = accumulate_scatters
 
 
-  def __read_data__(self, training_files):
-    data = []
+  def __valid_clients__(self, training_files):
+    """Returns the list of clients that have enough files for LDA training"""
+    clients = []
     for client_files in training_files:
       # at least two files per client are required!
       if len(client_files) < 2:
         utils.warn("Skipping one client since the number of client files is only %d" %len(client_files))
         continue
-      data.append(numpy.vstack([feature.flatten() for feature in client_files]))
+      clients.append(client_files)
+    return clients
+
+  def __read_data__(self, training_files):
+    data = []
+    for client_files in self.__valid_clients__(training_files):
+      data.append(self.__read_client__(client_files))
 
     # Returns the list of lists of arrays
     return data
 
+  def __read_client__(self, client_files):
+    """Returns the flattened features of one client as rows of a 2D array"""
+    return numpy.vstack([feature.flatten() for feature in client_files])
+
   def __train_pca__(self, training_set):
     """Trains and returns a LinearMachine that is trained using PCA"""
-    data_list = [feature for client in training_set for feature in client]
-    data = numpy.vstack(data_list)
-
     utils.info("  -> Training LinearMachine using PCA")
-    t = bob.learn.linear.PCATrainer()
-    machine, eigen_values = t.train(data)
+    if self.m_pca_training_chunk_size:
+      # train PCA without stacking the training features; keep enough dimensions for the LDA subspace
+      dimension = max(self.m_pca_subspace, self.m_lda_subspace + 1) if isinstance(self.m_pca_subspace, int) else self.m_pca_subspace
+      machine, eigen_values = utils.pca.train(training_set, dimension, self.m_pca_training_chunk_size, randomized = self.m_pca_randomized_training)
+    else:
+      data_list = [feature for client in training_set for feature in client]
+      data = numpy.vstack(data_list)
+      t = bob.learn.linear.PCATrainer()
+      machine, eigen_values = t.train(data)
 
     if isinstance(self.m_pca_subspace, float):
       cummulated = numpy.cumsum(eigen_values) / numpy.sum(eigen_values)
@@ -100,19 +125,83 @@ class LDA (Tool):
     return data
 
 
+  def __project_client__(self, machine, client_data):
+    """Projects all features of one client into the PCA subspace at once"""
+    return numpy.dot((client_data - machine.input_subtract) / machine.input_divide, machine.weights) + machine.biases
+
+
+  def __scatters__(self, clients, pca_machine = None):
+    """Accumulates the within-class and between-class scatter matrices and the mean of the given clients, which are read (and PCA-projected) one at a time.
+    As the :py:class:`bob.learn.linear.FisherLDATrainer`, the between-class scatter is weighted by the number of features per client."""
+    within_scatter = between_scatter = shift = None
+    count = 0
+    total = None
+    for client_files in clients:
+      client_data = self.__read_client__(client_files)
+      if pca_machine is not None:
+        client_data = self.__project_client__(pca_machine, client_data)
+      client_mean = numpy.mean(client_data, axis = 0)
+      if shift is None:
+        # all means are shifted by the mean of the first client to avoid cancellation
+        shift = client_mean
+        within_scatter = numpy.zeros((shift.shape[0], shift.shape[0]))
+        between_scatter = numpy.zeros((shift.shape[0], shift.shape[0]))
+        total = numpy.zeros(shift.shape)
+      centered = client_data - client_mean
+      within_scatter += numpy.dot(centered.T, centered)
+      between_scatter += client_data.shape[0] * numpy.outer(client_mean - shift, client_mean - shift)
+      total += client_data.shape[0] * (client_mean - shift)
+      count += client_data.shape[0]
+
+    if shift is None:
+      raise ValueError("LDA training requires at least one client with two or more features")
+    difference = total / count
+    between_scatter -= count * numpy.outer(difference, difference)
+    return within_scatter, between_scatter, shift + difference
+
+
+  def __train_lda_from_scatters__(self, clients, pca_machine = None):
+    """Trains the LDA machine from the scatter matrices, which are accumulated client by client, so that memory is bounded by the squared feature dimension"""
+    within_scatter, between_scatter, mean = self.__scatters__(clients, pca_machine)
+    # solve the generalized eigenvalue problem, and sort by decreasing eigenvalue
+    eigen_values, eigen_vectors = scipy.linalg.eigh(between_scatter, within_scatter)
+    eigen_values, eigen_vectors = eigen_values[::-1], eigen_vectors[:,::-1]
+    if self.m_lda_subspace == 0:
+      # strip to the rank of the between-class scatter matrix
+      rank = min(len(clients) - 1, mean.shape[0])
+      eigen_values, eigen_vectors = eigen_values[:rank], eigen_vectors[:,:rank]
+    # as the FisherLDATrainer, normalize the eigenvectors to unit length
+    eigen_vectors = eigen_vectors / numpy.sqrt(numpy.sum(eigen_vectors ** 2, axis = 0))
+
+    machine = bob.learn.linear.Machine(numpy.ascontiguousarray(eigen_vectors))
+    machine.input_subtract = mean
+    return machine, eigen_values.copy()
+
+
   def train_projector(self, training_features, projector_file):
     """Generates the LDA projection matrix from the given features (that are sorted by identity)"""
-    # Initializes an array for the data
-    data = self.__read_data__(training_features)
+    if self.m_accumulate_scatters:
+      # read the clients one by one; the features are stacked only if PCA is trained on stacked data
+      clients = self.__valid_clients__(training_features)
+      pca_machine = None
+      if self.m_pca_subspace:
+        pca_machine = self.__train_pca__(clients if self.m_pca_training_chunk_size else self.__read_data__(clients))
+      utils.info("  -> Training LinearMachine using LDA with accumulated scatter matrices")
+      self.m_machine, self.m_variances = self.__train_lda_from_scatters__(clients, pca_machine)
 
-    if self.m_pca_subspace:
-      pca_machine = self.__train_pca__(data)
-      utils.info("  -> Projecting training data to PCA subspace")
-      data = self.__perform_pca__(pca_machine, data)
+    else:
+      # Initializes an array for the data
+      data = self.__read_data__(training_features)
+
+      if self.m_pca_subspace:
+        pca_machine = self.__train_pca__(data)
+        utils.info("  -> Projecting training data to PCA subspace")
+        data = self.__perform_pca__(pca_machine, data)
+
+      utils.info("  -> Training LinearMachine using LDA")
+      t = bob.learn.linear.FisherLDATrainer(strip_to_rank = (self.m_lda_subspace == 0))
+      self.m_machine, self.m_variances = t.train(data)
 
-    utils.info("  -> Training LinearMachine using LDA")
-    t = bob.learn.linear.FisherLDATrainer(strip_to_rank = (self.m_lda_subspace == 0))
-    self.m_machine, self.m_variances = t.train(data)
     if self.m_lda_subspace:
       self.m_machine.resize(self.m_machine.shape[0], self.m_lda_subspace)
       self.m_variances = self.m_variances.copy()
@@ -173,3 +262,8 @@ class LDA (Tool):
     else:
       # single model, single probe (multiple probes have already been handled)
       return self.m_factor * self.m_distance_function(model, probe)
+
+
+  def score_batch(self, model, probes):
+    """Computes the distances between the model and all given probes at once, using the distance function taken from the config file"""
+    return utils.distance_scores(self.m_distance_function, model, probes, self.m_factor, self.m_variances if self.m_uses_variances else None, self.m_model_fusion_function)
@@ -39,31 +39,18 @@ class LGBPHS (Tool):
     """Enrolling model by taking the average of all features"""
     sparse = len(enroll_features) > 0 and enroll_features[0].shape[0] == 2
     if sparse:
-      # get all indices for the sparse model
-      values = {}
       # assert that we got sparse features
       assert enroll_features[0].shape[0] == 2
-      # iterate through all sparse features
-      for i in range(len(enroll_features)):
-        feature = enroll_features[i]
-        # collect the values by index
-        for j in range(feature.shape[1]):
-          index = int(feature[0,j])
-          value = feature[1,j] / float(len(enroll_features))
-          # add up values
-          if index in values:
-            values[index] += value
-          else:
-            values[index] = value
+      # collect the indices and values of all sparse features
+      indices = numpy.concatenate([feature[0] for feature in enroll_features]).astype(numpy.int64)
+      values = numpy.concatenate([feature[1] for feature in enroll_features])
+      # add up the values by index; the unique indices are sorted
+      model_indices, positions = numpy.unique(indices, return_inverse = True)
 
       # create model containing all the used indices
-      model = numpy.ndarray((2, len(values)), dtype = numpy.float64)
-
-      i = 0
-      for index in sorted(values.keys()):
-        model[0,i] = index
-        model[1,i] = values[index]
-        i += 1
+      model = numpy.ndarray((2, len(model_indices)), dtype = numpy.float64)
+      model[0,:] = model_indices
+      model[1,:] = numpy.bincount(positions, weights = values, minlength = len(model_indices)) / float(len(enroll_features))
     else:
       model = numpy.zeros(enroll_features[0].shape, dtype = numpy.float64)
       # add up models
@@ -76,8 +63,65 @@ class LGBPHS (Tool):
     return model
 
 
+  def __is_vectorized__(self):
+    """Returns True, if the distance function can be computed for many probes at once."""
+    return self.m_distance_function in (bob.math.chi_square, bob.math.histogram_intersection)
+
+  def __model_bins__(self, model):
+    """Returns the (sorted) indices and the values of the non-zero bins of the given sparse or non-sparse model."""
+    if model.shape[0] == 2:
+      return model[0,:].astype(numpy.int64), model[1,:]
+    model = model.flatten()
+    indices = numpy.nonzero(model)[0]
+    return indices, model[indices]
+
+  def __probe_bins__(self, indices, probes):
+    """Returns the values of the given sparse or non-sparse probes at the given bin indices as an array of shape (probe, index),
+    and the sum of the values of each probe."""
+    values = numpy.zeros((len(probes), len(indices)), dtype = numpy.float64)
+    sums = numpy.zeros((len(probes),), dtype = numpy.float64)
+    sparse = numpy.array([probe.ndim == 2 and probe.shape[0] == 2 for probe in probes], dtype = bool)
+
+    sparse_rows = numpy.flatnonzero(sparse)
+    if len(sparse_rows):
+      # concatenate the bins of all sparse probes, and remember to which probe each bin belongs
+      probe_rows = numpy.repeat(sparse_rows, [probes[p].shape[1] for p in sparse_rows])
+      probe_indices = numpy.concatenate([probes[p][0,:] for p in sparse_rows]).astype(numpy.int64)
+      probe_values = numpy.concatenate([probes[p][1,:] for p in sparse_rows])
+      sums += numpy.bincount(probe_rows, weights = probe_values, minlength = len(probes))
+      # find the bins of the sparse probes that are contained in the model
+      if len(indices):
+        positions = numpy.minimum(numpy.searchsorted(indices, probe_indices), len(indices) - 1)
+        found = indices[positions] == probe_indices
+        values[probe_rows[found], positions[found]] = probe_values[found]
+
+    dense_rows = numpy.flatnonzero(~sparse)
+    if len(dense_rows):
+      if isinstance(probes, numpy.ndarray) and len(dense_rows) == len(probes):
+        # stacked non-sparse probes
+        dense = probes.reshape((len(probes), -1))
+      else:
+        dense = numpy.vstack([probes[p].flatten() for p in dense_rows])
+      values[dense_rows,:] = dense[:,indices]
+      sums[dense_rows] = numpy.sum(dense, axis = 1)
+    return values, sums
+
+  def __distances__(self, model_values, probe_values, probe_sums):
+    """Computes the distances between the model bins and the probe bins of several probes at once."""
+    if self.m_distance_function == bob.math.chi_square:
+      sums = model_values + probe_values
+      with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+        distances = numpy.sum(numpy.where(sums != 0., (model_values - probe_values)**2 / sums, 0.), axis = 1)
+      # each probe bin that is not in the model contributes its value
+      return distances + probe_sums - numpy.sum(probe_values, axis = 1)
+    # histogram intersection: the probe bins that are not in the model do not contribute
+    return numpy.sum(numpy.minimum(model_values, probe_values), axis = 1)
+
+
   def score(self, model, probe):
     """Computes the score using the specified histogram measure; returns a similarity value (bigger -> better)"""
+    if self.__is_vectorized__():
+      return self.score_batch(model, [probe])[0]
     sparse = model.shape[0] == 2
     if sparse:
       # assure that the probe is sparse as well
@@ -86,4 +130,42 @@ class LGBPHS (Tool):
     else:
       return self.m_factor * self.m_distance_function(model.flatten(), probe.flatten())
 
-
+  def score_batch(self, model, probes):
+    """Computes the scores of the model with all given sparse or non-sparse probes at once.
+    For chi-square and histogram intersection, only the non-zero bins of the model are compared with the probes."""
+    if not self.__is_vectorized__():
+      return Tool.score_batch(self, model, probes)
+    model_indices, model_values = self.__model_bins__(model)
+    scores = numpy.ndarray((len(probes),), dtype = numpy.float64)
+    # limit the memory of the (probe, bin) array, as histograms might have several hundred thousand bins
+    block_size = 32
+    for start in range(0, len(probes), block_size):
+      probe_values, probe_sums = self.__probe_bins__(model_indices, probes[start:start+block_size])
+      scores[start:start+block_size] = self.__distances__(model_values, probe_values, probe_sums)
+    return self.m_factor * scores
+
+  def __is_sparse__(self, histogram):
+    """Returns True, if the given histogram is sparse, i.e., its first row contains the increasing indices of the non-zero bins, and its second row their values."""
+    if histogram.ndim != 2 or histogram.shape[0] != 2:
+      return False
+    indices = histogram[0,:]
+    return bool(numpy.all(indices >= 0) and numpy.all(indices == numpy.floor(indices)) and numpy.all(numpy.diff(indices) > 0))
+
+  def __is_probe_sequence__(self, model, probes):
+    """Returns True, if the given probes are a sequence of histograms rather than a single (sparse or non-sparse) histogram.
+    Besides lists and tuples, arrays of stacked sparse or non-sparse histograms are accepted."""
+    if isinstance(probes, (list, tuple)):
+      return True
+    if not isinstance(probes, numpy.ndarray) or self.__is_sparse__(probes):
+      return False
+    if model.shape[0] == 2:
+      # non-sparse histograms that are compared with sparse models are 1D
+      return probes.ndim > 1
+    # a single non-sparse probe has the dimensions of the non-sparse model
+    return probes.ndim > model.ndim
+
+  def score_for_multiple_probes(self, model, probes):
+    """Computes the scores of the model with all given probes at once, and fuses them"""
+    if self.__is_probe_sequence__(model, probes):
+      return self.m_probe_fusion_function(self.score_batch(model, probes))
+    return self.score(model, probes)
@@ -20,6 +20,8 @@ class PCA (Tool):
       distance_function = scipy.spatial.distance.euclidean,
       is_distance_function = True,
       uses_variances = False,
+      training_chunk_size = None, # if given, the PCA is trained chunk by chunk with the given number of features per chunk
+      randomized_training = False, # if enabled (and training_chunk_size is given), the largest eigenvectors are approximated with randomized subspace iterations
       **kwargs  # parameters directly sent to the base class
   ):
 
@@ -33,6 +35,8 @@ class PCA (Tool):
         distance_function = str(distance_function),
         is_distance_function = is_distance_function,
         uses_variances = uses_variances,
+        training_chunk_size = training_chunk_size,
+        randomized_training = randomized_training,
 
         **kwargs
     )
@@ -42,16 +46,21 @@ class PCA (Tool):
     self.m_distance_function = distance_function
     self.m_factor = -1. if is_distance_function else 1.
     self.m_uses_variances = uses_variances
+    self.m_training_chunk_size = training_chunk_size
+    self.m_randomized_training = randomized_training
 
 
   def train_projector(self, training_features, projector_file):
     """Generates the PCA covariance matrix"""
-    # Initializes the data
-    data = numpy.vstack([feature.flatten() for feature in training_features])
-
     utils.info("  -> Training LinearMachine using PCA")
-    t = bob.learn.linear.PCATrainer()
-    self.m_machine, self.m_variances = t.train(data)
+    if self.m_training_chunk_size:
+      # train PCA without stacking the training features
+      self.m_machine, self.m_variances = utils.pca.train(training_features, self.m_subspace_dim, self.m_training_chunk_size, randomized = self.m_randomized_training)
+    else:
+      # Initializes the data
+      data = utils.vstack_features(training_features, flatten = True)
+      t = bob.learn.linear.PCATrainer()
+      self.m_machine, self.m_variances = t.train(data)
     # For re-shaping, we need to copy...
     self.m_variances = self.m_variances.copy()
 
@@ -118,3 +127,8 @@ class PCA (Tool):
     else:
       # single model, single probe (multiple probes have already been handled)
       return self.m_factor * self.m_distance_function(model, probe)
+
+
+  def score_batch(self, model, probes):
+    """Computes the distances between the model and all given probes at once, using the distance function taken from the config file"""
+    return utils.distance_scores(self.m_distance_function, model, probes, self.m_factor, self.m_variances if self.m_uses_variances else None, self.m_model_fusion_function)
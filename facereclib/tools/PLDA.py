@@ -20,7 +20,9 @@ class PLDA (Tool):
       self,
       subspace_dimension_of_f, # Size of subspace F
       subspace_dimension_of_g, # Size of subspace G
-      subspace_dimension_pca = None,  # if given, perform PCA on data and reduce the PCA subspace to the given dimension
+      subspace_dimension_pca = None,  # if given, perform PCA on data and reduce the PCA subspace to the given dimension; if float, the percentage of variance to keep
+      pca_training_chunk_size = None, # if given, the PCA is trained chunk by chunk with the given number of features per chunk
+      pca_randomized_training = False, # if enabled (and pca_training_chunk_size is given), the largest PCA eigenvectors are approximated with randomized subspace iterations
       plda_training_iterations = 200, # Maximum number of iterations for the EM loop
       # TODO: refactor the remaining parameters!
       INIT_SEED = 5489, # seed for initializing
@@ -39,6 +41,8 @@ class PLDA (Tool):
         subspace_dimension_of_f = subspace_dimension_of_f, # Size of subspace F
         subspace_dimension_of_g = subspace_dimension_of_g, # Size of subspace G
         subspace_dimension_pca = subspace_dimension_pca,  # if given, perform PCA on data and reduce the PCA subspace to the given dimension
+        pca_training_chunk_size = pca_training_chunk_size,
+        pca_randomized_training = pca_randomized_training,
         plda_training_iterations = plda_training_iterations, # Maximum number of iterations for the EM loop
         # TODO: refactor the remaining parameters!
         INIT_SEED = INIT_SEED, # seed for initializing
@@ -52,6 +56,8 @@ class PLDA (Tool):
     self.m_subspace_dimension_of_f = subspace_dimension_of_f
     self.m_subspace_dimension_of_g = subspace_dimension_of_g
     self.m_subspace_dimension_pca = subspace_dimension_pca
+    self.m_pca_training_chunk_size = pca_training_chunk_size
+    self.m_pca_randomized_training = pca_randomized_training
     self.m_plda_training_iterations = plda_training_iterations
     self.m_score_set = {'joint_likelihood': 'joint_likelihood', 'average':numpy.average, 'min':min, 'max':max}[multiple_probe_scoring]
 
@@ -61,16 +67,24 @@ class PLDA (Tool):
 
   def __train_pca__(self, training_set):
     """Trains and returns a LinearMachine that is trained using PCA"""
-    data_list = []
-    for client in training_set:
-      for feature in client:
-        # Appends in the array
-        data_list.append(feature)
-    data = numpy.vstack(data_list)
-
     utils.info("  -> Training LinearMachine using PCA ")
-    t = bob.learn.linear.PCATrainer()
-    machine, __eig_vals = t.train(data)
+    if self.m_pca_training_chunk_size:
+      # train PCA without stacking the training features
+      machine, eigen_values = utils.pca.train(training_set, self.m_subspace_dimension_pca, self.m_pca_training_chunk_size, randomized = self.m_pca_randomized_training)
+    else:
+      data_list = []
+      for client in training_set:
+        for feature in client:
+          # Appends in the array
+          data_list.append(feature)
+      data = numpy.vstack(data_list)
+
+      t = bob.learn.linear.PCATrainer()
+      machine, eigen_values = t.train(data)
+
+    if isinstance(self.m_subspace_dimension_pca, float):
+      self.m_subspace_dimension_pca = utils.pca.variance_dimension(eigen_values, self.m_subspace_dimension_pca)
+      utils.info("  ... Keeping %d PCA dimensions" % self.m_subspace_dimension_pca)
     # limit number of pcs
     machine.resize(machine.shape[0], self.m_subspace_dimension_pca)
     return machine
@@ -144,6 +158,25 @@ class PLDA (Tool):
     #self.m_plda_base = bob.machine.PLDABase(bob.io.HDF5File(projector_file))
     self.m_plda_machine = bob.learn.em.PLDAMachine(self.m_plda_base)
     self.m_plda_trainer = bob.learn.em.PLDATrainer()
+    self.__prepare_scoring__()
+
+  def __prepare_scoring__(self):
+    """Precomputes the terms of the PLDA base that are used to compute the log-likelihood ratios of many probes at once"""
+    F, G = self.m_plda_base.f, self.m_plda_base.g
+    isigma = 1. / self.m_plda_base.sigma
+    # alpha = (I + G^T sigma^-1 G)^-1 and beta = sigma^-1 - sigma^-1 G alpha G^T sigma^-1
+    isigma_g = isigma[:,numpy.newaxis] * G
+    alpha = numpy.linalg.inv(numpy.eye(G.shape[1]) + numpy.dot(G.T, isigma_g))
+    beta = numpy.diag(isigma) - numpy.dot(numpy.dot(isigma_g, alpha), isigma_g.T)
+    self.m_ft_beta = numpy.dot(F.T, beta)
+    self.m_ft_beta_f = numpy.dot(self.m_ft_beta, F)
+    self.m_gammas = {}
+
+  def __gamma__(self, a):
+    """Returns gamma_a = (I + a F^T beta F)^-1 for the given number of samples a"""
+    if a not in self.m_gammas:
+      self.m_gammas[a] = numpy.linalg.inv(numpy.eye(self.m_ft_beta_f.shape[0]) + a * self.m_ft_beta_f)
+    return self.m_gammas[a]
 
   def enroll(self, enroll_features):
     """Enrolls the model by computing an average of the given input vectors"""
@@ -160,36 +193,53 @@ class PLDA (Tool):
     plda_machine = bob.learn.em.PLDAMachine(bob.io.base.HDF5File(model_file), self.m_plda_base)
     return plda_machine
 
+  def __project_probes__(self, probes):
+    """Stacks the given probes into the rows of one array, and projects all of them at once with the PCA machine (if any)"""
+    probes = numpy.vstack(probes).astype(numpy.float64)
+    if self.m_subspace_dimension_pca is not None:
+      machine = self.m_pca_machine
+      probes = numpy.dot((probes - machine.input_subtract) / machine.input_divide, machine.weights) + machine.biases
+    return probes
+
+  def __log_likelihood_ratios__(self, models, probes):
+    """Computes the log-likelihood ratios of all given models with all given (projected) probes, one row per model.
+    For each probe x, w = F^T beta (x - mu) is computed once.
+    For a model enrolled from n samples with the weighted sum s, the log-likelihood ratio is:
+    c + w^T gamma_{n+1} s + 1/2 w^T (gamma_{n+1} - gamma_1) w,
+    where the model-dependent constant c is the log-likelihood ratio of the probe x = mu, for which w = 0."""
+    mu = self.m_plda_base.mu
+    w = numpy.dot(probes - mu, self.m_ft_beta.T)
+    probe_terms = {}
+    def probe_term(a):
+      # 1/2 w^T gamma_a w for all probes
+      if a not in probe_terms:
+        probe_terms[a] = 0.5 * numpy.sum(numpy.dot(w, self.__gamma__(a)) * w, axis = 1)
+      return probe_terms[a]
+
+    scores = numpy.ndarray((len(models), probes.shape[0]), numpy.float64)
+    for m, model in enumerate(models):
+      a = model.n_samples + 1
+      constant = model.log_likelihood_ratio(mu)
+      scores[m,:] = constant + numpy.dot(w, numpy.dot(self.__gamma__(a), model.weighted_sum)) + probe_term(a) - probe_term(1)
+    return scores
+
   def score(self, model, probe):
     """Computes the PLDA score for the given model and probe"""
-    return self.score_for_multiple_probes(model, [probe])
+    return self.score_batch(model, [probe])[0]
+
+  def score_batch(self, model, probes):
+    """Computes the PLDA scores of the given model with all given probes at once"""
+    return self.score_matrix([model], probes)[0]
+
+  def score_matrix(self, models, probes):
+    """Computes the PLDA scores of all given models with all given probes; all probes are projected only once"""
+    return self.__log_likelihood_ratios__(models, self.__project_probes__(probes))
 
   def score_for_multiple_probes(self, model, probes):
     """This function computes the score between the given model and several given probe files.
-    In this base class implementation, it computes the scores for each probe file using the 'score' method,
-    and fuses the scores using the fusion method specified in the constructor of this class."""
-    n_probes = len(probes)
-    if self.m_subspace_dimension_pca is not None:
-      # project probe
-      probe_ = numpy.ndarray((n_probes, self.m_pca_machine.shape[1]), numpy.float64)
-      projected_probe = numpy.ndarray(self.m_pca_machine.shape[1], numpy.float64)
-      for i in range(n_probes):
-        self.m_pca_machine(probes[i], projected_probe)
-        probe_[i,:] = projected_probe
-      # forward
-      if self.m_score_set == 'joint_likelihood':
-        return model.log_likelihood_ratio(probe_)
-      else:
-        scores = [model.log_likelihood_ratio(probe_[i,:]) for i in range(n_probes)]
-        return self.m_score_set(scores)
-    else:
-      # just forward
-      if self.m_score_set == 'joint_likelihood':
-        probe_ = numpy.ndarray((n_probes, probe[0].shape[0]), numpy.float64)
-        for i in range(n_probes):
-          probe_[i,:] = probes[i]
-        return model.forward(probe_)
-      # forward
-      else:
-        scores = [model.forward(probes[i]) for i in range(n_probes)]
-        return self.m_score_set(scores)
+    For the joint likelihood, the log-likelihood ratio of all probes together is computed,
+    otherwise the scores of the single probes are fused using the fusion method specified in the constructor of this class."""
+    projected_probes = self.__project_probes__(probes)
+    if self.m_score_set == 'joint_likelihood':
+      return model.log_likelihood_ratio(projected_probes)
+    return self.m_score_set(self.__log_likelihood_ratios__([model], projected_probes)[0])
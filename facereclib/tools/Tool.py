@@ -74,6 +74,25 @@ class Tool:
     raise NotImplementedError("Please overwrite this function in your derived class")
 
 
+  def score_batch(self, model, probes):
+    """This function computes the scores between the given model and all of the given probes.
+    It returns a 1D numpy.ndarray containing one score per probe, in the order of the probes.
+    In this base class implementation, it computes the scores for each probe using the 'score' method.
+    Overwrite this function, if your tool can compute the scores of many probes more efficiently at once."""
+    return numpy.array([self.score(model, probe) for probe in probes], numpy.float64)
+
+
+  def score_matrix(self, models, probes):
+    """This function computes the scores between all of the given models and all of the given probes.
+    It returns a 2D numpy.ndarray with one row per model and one column per probe.
+    In this base class implementation, it calls the 'score_batch' method for each model.
+    Overwrite this function, if your tool can compute the whole score matrix more efficiently at once."""
+    scores = numpy.ndarray((len(models), len(probes)), numpy.float64)
+    for m, model in enumerate(models):
+      scores[m,:] = self.score_batch(model, probes)
+    return scores
+
+
   def score_for_multiple_models(self, models, probe):
     """This function computes the score between the given model list and the given probe.
     In this base class implementation, it computes the scores for each model using the 'score' method,
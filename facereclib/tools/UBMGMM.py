@@ -7,6 +7,10 @@ import bob.io.base
 import bob.learn.em
 
 import numpy
+import scipy.sparse
+import os
+import hashlib
+import multiprocessing.pool
 
 from .Tool import Tool
 from .. import utils
@@ -27,6 +31,10 @@ class UBMGMM (Tool):
       update_means = True,
       update_variances = True,
       normalize_before_k_means = True,  # Normalize the input features before running K-Means
+      k_means_training_frames = None,   # If given, K-Means is trained on a random subset of the given number of feature vectors
+      ubm_training_chunk_size = None,   # If given, the UBM is trained chunk by chunk with the given number of feature vectors per chunk, without stacking all training features
+      number_of_threads = 1,            # The number of threads used to accumulate the GMM statistics during UBM training and projection
+      gmm_stats_cache_directory = None, # If given, the GMM statistics of the projected features are cached in this directory, keyed by the UBM and the feature content
       # parameters of the GMM enrollment
       relevance_factor = 4,         # Relevance factor as described in Reynolds paper
       gmm_enroll_iterations = 1,    # Number of iterations for the enrollment phase
@@ -52,6 +60,10 @@ class UBMGMM (Tool):
         update_means = update_means,
         update_variances = update_variances,
         normalize_before_k_means = normalize_before_k_means,
+        k_means_training_frames = k_means_training_frames,
+        ubm_training_chunk_size = ubm_training_chunk_size,
+        number_of_threads = number_of_threads,
+        gmm_stats_cache_directory = gmm_stats_cache_directory,
         relevance_factor = relevance_factor,
         gmm_enroll_iterations = gmm_enroll_iterations,
         responsibility_threshold = responsibility_threshold,
@@ -72,6 +84,12 @@ class UBMGMM (Tool):
     self.m_update_means = update_means
     self.m_update_variances = update_variances
     self.m_normalize_before_k_means = normalize_before_k_means
+    self.m_k_means_training_frames = k_means_training_frames
+    self.m_ubm_training_chunk_size = ubm_training_chunk_size
+    self.m_number_of_threads = number_of_threads
+    self.m_gmm_stats_cache_directory = gmm_stats_cache_directory
+    # the hash of the current UBM, which keys the cached GMM statistics; it is computed when the UBM is trained or loaded
+    self.m_ubm_hash = None
     self.m_relevance_factor = relevance_factor
     self.m_gmm_enroll_iterations = gmm_enroll_iterations
     self.m_init_seed = INIT_SEED
@@ -83,61 +101,343 @@ class UBMGMM (Tool):
 
   #######################################################
   ################ UBM training #########################
-  def __normalize_std_array__(self, array):
-    """Applies a unit variance normalization to an array"""
+  def __chunks__(self, data, chunk_size = None):
+    """Iterates over the feature vectors of the given 2D array (or list of 2D arrays) in 2D float64 chunks of (at least) the given number of feature vectors"""
+    chunk_size = chunk_size or 65536
+    if isinstance(data, utils.TrainingFeatures):
+      data = data.array
+    if isinstance(data, numpy.ndarray):
+      for start in range(0, data.shape[0], chunk_size):
+        yield numpy.asarray(data[start : start + chunk_size], numpy.float64)
+    else:
+      chunk, size = [], 0
+      for feature in data:
+        chunk.append(feature)
+        size += feature.shape[0]
+        if size >= chunk_size:
+          yield numpy.vstack(chunk).astype(numpy.float64)
+          chunk, size = [], 0
+      if chunk:
+        yield numpy.vstack(chunk).astype(numpy.float64)
+
+
+  def __moments__(self, data):
+    """Computes the number of feature vectors and the mean and the standard deviation of each dimension in a single pass over the data"""
+    count, sums, squares = 0, 0., 0.
+    for chunk in self.__chunks__(data):
+      count += chunk.shape[0]
+      sums = sums + numpy.sum(chunk, axis = 0)
+      squares = squares + numpy.einsum('ij,ij->j', chunk, chunk)
+    mean = sums / count
+    return count, mean, numpy.sqrt(squares / count - mean ** 2)
 
-    # Initializes variables
-    n_samples = array.shape[0]
-    length = array.shape[1]
-    mean = numpy.ndarray((length,), 'float64')
-    std = numpy.ndarray((length,), 'float64')
 
-    mean.fill(0)
-    std.fill(0)
+  def __normalize_std_array__(self, array):
+    """Applies a unit variance normalization to an array"""
+    std = self.__moments__(array)[2]
+    return (array / std, std)
 
-    # Computes mean and variance
-    for k in range(n_samples):
-      x = array[k,:].astype('float64')
-      mean += x
-      std += (x ** 2)
 
-    mean /= n_samples
-    std /= n_samples
-    std -= (mean ** 2)
-    std = std ** 0.5 # sqrt(std)
+  def __multiply_vectors_by_factors__(self, matrix, vector):
+    """Used to unnormalize some data"""
+    matrix *= vector
+
+
+  def __random_frames__(self, count, frames):
+    """Returns the sorted indices of the given number of randomly selected (distinct) feature vectors.
+    Unless more than half of the feature vectors are selected, the memory is proportional to the number of selected feature vectors, not to their total count."""
+    rng = numpy.random.RandomState(self.m_init_seed)
+    if 2 * frames > count:
+      return numpy.sort(rng.permutation(count)[:frames])
+    # draw with replacement, and draw again for the duplicates
+    indices = numpy.unique(rng.randint(0, count, frames))
+    while len(indices) < frames:
+      indices = numpy.unique(numpy.concatenate((indices, rng.randint(0, count, frames - len(indices)))))
+    return indices
+
+  def __select_frames__(self, data, indices):
+    """Collects the feature vectors with the given sorted indices in one pass over the data"""
+    selected, start = [], 0
+    for chunk in self.__chunks__(data, self.m_ubm_training_chunk_size):
+      end = start + chunk.shape[0]
+      selected.append(chunk[indices[(indices >= start) & (indices < end)] - start])
+      start = end
+    return numpy.vstack(selected)
+
+
+  def __cluster_statistics__(self, data, means, std, squares = False):
+    """Assigns the (normalized) feature vectors to the closest means, chunk by chunk.
+    Returns the number of feature vectors, their sum and (optionally) their sum of squares for each cluster, and the average distance to the closest means."""
+    gaussians, dimensions = means.shape
+    counts = numpy.zeros((gaussians,))
+    sums = numpy.zeros((gaussians, dimensions))
+    sums_of_squares = numpy.zeros((gaussians, dimensions))
+    distance, count = 0., 0
+    mean_norms = numpy.sum(means ** 2, axis = 1)
+    for chunk in self.__chunks__(data, self.m_ubm_training_chunk_size):
+      # the chunk might be a view on the data, which must not be modified
+      chunk = chunk / std
+      # squared Euclidean distances between all feature vectors of the chunk and all means
+      distances = numpy.sum(chunk ** 2, axis = 1)[:,numpy.newaxis] - 2. * numpy.dot(chunk, means.T) + mean_norms
+      labels = numpy.argmin(distances, axis = 1)
+      distance += numpy.sum(distances[numpy.arange(len(labels)), labels])
+      count += chunk.shape[0]
+      counts += numpy.bincount(labels, minlength = gaussians)
+      # sum up the feature vectors of each cluster with a sparse one-hot matrix product
+      assignment = scipy.sparse.csr_matrix((numpy.ones(len(labels)), (labels, numpy.arange(len(labels)))), shape = (gaussians, len(labels)))
+      sums += assignment.dot(chunk)
+      if squares:
+        sums_of_squares += assignment.dot(chunk ** 2)
+    return counts, sums, sums_of_squares, distance / count
+
+
+  def __k_means__(self, data, count, std):
+    """Trains the K-Means means on the given data chunk by chunk, and returns the means, variances and weights of the clusters in the normalized space"""
+    means = self.__select_frames__(data, self.__random_frames__(count, self.m_gaussians)) / std
+    average_distance = None
+    for i in range(self.m_k_means_training_iterations):
+      counts, sums, _, distance = self.__cluster_statistics__(data, means, std)
+      # clusters without feature vectors keep their means
+      valid = counts > 0
+      means[valid] = sums[valid] / counts[valid,numpy.newaxis]
+      utils.debug(" .... K-Means iteration %d: average distance %f" % (i+1, distance))
+      if average_distance is not None and self.m_training_threshold and abs((average_distance - distance) / average_distance) <= self.m_training_threshold:
+        break
+      average_distance = distance
+
+    counts, sums, sums_of_squares, _ = self.__cluster_statistics__(data, means, std, squares = True)
+    counts_ = numpy.maximum(counts, 1)[:,numpy.newaxis]
+    variances = sums_of_squares / counts_ - (sums / counts_) ** 2
+    return means, variances, counts / numpy.sum(counts)
+
+
+  def __train_gmm__(self, data):
+    """Trains the GMM using maximum likelihood, accumulating the statistics of each E-step chunk by chunk"""
+    stats = bob.learn.em.GMMStats(self.m_ubm.shape[0], self.m_ubm.shape[1])
+    def e_step():
+      stats.init()
+      for chunk in self.__chunks__(data, self.m_ubm_training_chunk_size):
+        self.__acc_statistics__(chunk, stats)
+      return stats.log_likelihood / stats.t
+
+    average_likelihood = e_step()
+    for i in range(self.m_gmm_training_iterations):
+      # M-step as in the ML_GMMTrainer; Gaussians without responsibilities keep their means and variances
+      valid = stats.n > numpy.finfo(numpy.float64).eps
+      n = stats.n[valid,numpy.newaxis]
+      means = numpy.array(self.m_ubm.means)
+      if self.m_update_weights:
+        self.m_ubm.weights = stats.n / stats.t
+      if self.m_update_means:
+        means[valid] = stats.sum_px[valid] / n
+        self.m_ubm.means = means
+      if self.m_update_variances:
+        variances = numpy.array(self.m_ubm.variances)
+        variances[valid] = stats.sum_pxx[valid] / n - means[valid] ** 2
+        self.m_ubm.variances = variances
+        self.m_ubm.set_variance_thresholds(self.m_variance_threshold)
+
+      previous_likelihood = average_likelihood
+      average_likelihood = e_step()
+      utils.debug(" .... GMM iteration %d: average log-likelihood %f" % (i+1, average_likelihood))
+      if self.m_training_threshold and abs((previous_likelihood - average_likelihood) / previous_likelihood) <= self.m_training_threshold:
+        break
 
-    ar_std_list = []
-    for k in range(n_samples):
-      ar_std_list.append(array[k,:].astype('float64') / std)
-    ar_std = numpy.vstack(ar_std_list)
 
-    return (ar_std,std)
+  #######################################################
+  ############ Parallel GMM statistics ##################
+
+  def __map__(self, function, items):
+    """Applies the given function to all items, using a thread pool if several threads are requested.
+    The pool only lives during this call, so that no idle pool is inherited by processes that are forked later (e.g., with ``--parallel``)."""
+    if self.m_number_of_threads <= 1:
+      return [function(item) for item in items]
+    pool = multiprocessing.pool.ThreadPool(self.m_number_of_threads)
+    try:
+      return pool.map(function, items)
+    finally:
+      pool.terminate()
+
+  def __ubm_parameters__(self):
+    """Returns the parameters of the UBM that are required to compute the log-likelihoods of all Gaussians with a few matrix products"""
+    means = numpy.array(self.m_ubm.means)
+    inverse_variances = 1. / numpy.array(self.m_ubm.variances)
+    # log(weight) - 0.5 * (D * log(2 pi) + sum(log(variance)) + sum(mean^2 / variance))
+    constants = numpy.log(numpy.array(self.m_ubm.weights)) - 0.5 * (means.shape[1] * numpy.log(2. * numpy.pi) - numpy.sum(numpy.log(inverse_variances), axis = 1) + numpy.sum(means ** 2 * inverse_variances, axis = 1))
+    return means * inverse_variances, inverse_variances, constants
+
+  def __statistics__(self, array, parameters, block_size = 4096):
+    """Computes the zeroth, first and second order statistics and the log-likelihood of the given feature vectors with numpy.
+    The feature vectors are processed in blocks, which limits the size of the (feature vector, Gaussian) posterior array."""
+    weighted_means, inverse_variances, constants = parameters
+    n, sum_px, sum_pxx, log_likelihood = 0., 0., 0., 0.
+    for start in range(0, array.shape[0], block_size):
+      block = numpy.asarray(array[start : start + block_size], numpy.float64)
+      squares = block ** 2
+      # log(weight * N(x | mean, variance)) for all feature vectors and Gaussians
+      log_likelihoods = constants + numpy.dot(block, weighted_means.T) - 0.5 * numpy.dot(squares, inverse_variances.T)
+      maximum = numpy.max(log_likelihoods, axis = 1)[:,numpy.newaxis]
+      log_sums = maximum + numpy.log(numpy.sum(numpy.exp(log_likelihoods - maximum), axis = 1))[:,numpy.newaxis]
+      posteriors = numpy.exp(log_likelihoods - log_sums)
+      n = n + numpy.sum(posteriors, axis = 0)
+      sum_px = sum_px + numpy.dot(posteriors.T, block)
+      sum_pxx = sum_pxx + numpy.dot(posteriors.T, squares)
+      log_likelihood += numpy.sum(log_sums)
+    return n, sum_px, sum_pxx, log_likelihood, array.shape[0]
+
+  def __add_statistics__(self, stats, statistics):
+    """Adds the given statistics, as returned by __statistics__, to the given GMMStats object"""
+    for n, sum_px, sum_pxx, log_likelihood, t in statistics:
+      if not t: continue
+      stats.n = stats.n + n
+      stats.sum_px = stats.sum_px + sum_px
+      stats.sum_pxx = stats.sum_pxx + sum_pxx
+      stats.log_likelihood = stats.log_likelihood + log_likelihood
+      stats.t = stats.t + t
+
+  def __acc_statistics__(self, array, stats):
+    """Accumulates the GMM statistics of the given feature vectors into the given GMMStats object.
+    If several threads are requested, the feature vectors are split between the threads and the partial statistics are summed up."""
+    if self.m_number_of_threads <= 1:
+      self.m_ubm.acc_statistics(array, stats)
+    else:
+      parameters = self.__ubm_parameters__()
+      parts = numpy.array_split(array, self.m_number_of_threads)
+      self.__add_statistics__(stats, self.__map__(lambda part : self.__statistics__(part, parameters), parts))
+
+  def __gmm_statistics__(self, features):
+    """Computes the GMM statistics of each of the given features; with several threads, the features are distributed between the threads."""
+    if self.m_number_of_threads <= 1:
+      statistics = []
+      for feature in features:
+        stats = bob.learn.em.GMMStats(*self.m_ubm.shape)
+        self.m_ubm.acc_statistics(feature, stats)
+        statistics.append(stats)
+      return statistics
+
+    parameters = self.__ubm_parameters__()
+    statistics = []
+    for partial in self.__map__(lambda feature : self.__statistics__(feature, parameters), features):
+      stats = bob.learn.em.GMMStats(*self.m_ubm.shape)
+      self.__add_statistics__(stats, [partial])
+      statistics.append(stats)
+    return statistics
 
 
-  def __multiply_vectors_by_factors__(self, matrix, vector):
-    """Used to unnormalize some data"""
-    for i in range(0, matrix.shape[0]):
-      for j in range(0, matrix.shape[1]):
-        matrix[i, j] *= vector[j]
+  #######################################################
+  ############## GMM statistics cache ###################
+
+  def __cache_file__(self, feature, ubm_hash):
+    """Returns the name of the cache file for the GMM statistics of the given feature, which is keyed by the hash of the UBM and the content of the feature"""
+    hasher = hashlib.sha1()
+    hasher.update(str((feature.shape, feature.dtype.str)).encode())
+    hasher.update(numpy.ascontiguousarray(feature))
+    return os.path.join(self.m_gmm_stats_cache_directory, ubm_hash, hasher.hexdigest() + ".hdf5")
+
+  def __ubm_hash__(self):
+    """Returns a hash of the parameters of the current UBM, or None if no GMM statistics are cached"""
+    if self.m_gmm_stats_cache_directory is None:
+      return None
+    hasher = hashlib.sha1()
+    for parameter in (self.m_ubm.weights, self.m_ubm.means, self.m_ubm.variances, self.m_ubm.variance_thresholds):
+      hasher.update(numpy.ascontiguousarray(parameter, numpy.float64))
+    return hasher.hexdigest()
+
+  def __read_cache__(self, cache_file):
+    """Reads the GMM statistics from the given cache file, or returns None if the file does not exist"""
+    if not os.path.exists(cache_file):
+      return None
+    return bob.learn.em.GMMStats(bob.io.base.HDF5File(cache_file))
+
+  def __write_cache__(self, stats, cache_file):
+    """Writes the GMM statistics to the given cache file; the file is renamed after writing, so that concurrent processes never read incomplete files"""
+    utils.ensure_dir(os.path.dirname(cache_file))
+    temp_file = "%s.%d.tmp" % (cache_file, os.getpid())
+    hdf5file = bob.io.base.HDF5File(temp_file, 'w')
+    stats.save(hdf5file)
+    hdf5file.close()
+    os.rename(temp_file, cache_file)
+
+
+  def _project_training_features(self, features):
+    """Computes the GMM statistics of each of the given training features.
+    If several threads are requested, the features are distributed between the threads.
+    If a cache directory is given, only the statistics that are not cached yet are computed."""
+    if self.m_gmm_stats_cache_directory is None:
+      return self.__gmm_statistics__(features)
+
+    cache_files = [self.__cache_file__(feature, self.m_ubm_hash) for feature in features]
+    statistics = [self.__read_cache__(cache_file) for cache_file in cache_files]
+    missing = [i for i in range(len(features)) if statistics[i] is None]
+    utils.debug(" .... Computing the GMM statistics of %d of %d features, the others are cached" % (len(missing), len(features)))
+    for i, stats in zip(missing, self.__gmm_statistics__([features[i] for i in missing])):
+      self.__write_cache__(stats, cache_files[i])
+      statistics[i] = stats
+    return statistics
 
 
   #######################################################
   ################ UBM training #########################
 
+  def _train_projector_using_chunks(self, data):
+    """Trains the UBM chunk by chunk from the given 2D array or list of 2D arrays, without holding a normalized copy of the data in memory"""
+    utils.debug(" .... Computing the statistics of the feature vectors")
+    count, _, std = self.__moments__(data)
+    input_size = std.shape[0]
+    utils.debug(" .... Training with %d feature vectors in chunks of %d" % (count, self.m_ubm_training_chunk_size))
+    if not self.m_normalize_before_k_means:
+      std = numpy.ones((input_size,))
+
+    # select the data for K-Means
+    k_means_data = data
+    if self.m_k_means_training_frames is not None and self.m_k_means_training_frames < count:
+      utils.debug(" .... Selecting %d feature vectors for K-Means" % self.m_k_means_training_frames)
+      k_means_data = self.__select_frames__(data, self.__random_frames__(count, self.m_k_means_training_frames))
+      count = self.m_k_means_training_frames
+
+    utils.info("  -> Training K-Means")
+    means, variances, weights = self.__k_means__(k_means_data, count, std)
+
+    # Undoes the normalization
+    self.__multiply_vectors_by_factors__(means, std)
+    self.__multiply_vectors_by_factors__(variances, std ** 2)
+
+    # Initializes the GMM
+    self.m_ubm = bob.learn.em.GMMMachine(self.m_gaussians, input_size)
+    self.m_ubm.means = means
+    self.m_ubm.variances = variances
+    self.m_ubm.weights = weights
+    self.m_ubm.set_variance_thresholds(self.m_variance_threshold)
+
+    # Trains the GMM
+    utils.info("  -> Training GMM")
+    self.__train_gmm__(data)
+    self.m_ubm_hash = self.__ubm_hash__()
+
+
   def _train_projector_using_array(self, array):
 
+    if self.m_ubm_training_chunk_size is not None:
+      return self._train_projector_using_chunks(array)
+
     utils.debug(" .... Training with %d feature vectors" % array.shape[0])
 
     # Computes input size
     input_size = array.shape[1]
 
-    # Normalizes the array if required
+    # Selects the data for K-Means, before normalizing it, so that only the selected feature vectors are copied
+    k_means_array = array
+    if self.m_k_means_training_frames is not None and self.m_k_means_training_frames < array.shape[0]:
+      utils.debug(" .... Selecting %d feature vectors for K-Means" % self.m_k_means_training_frames)
+      k_means_array = array[self.__random_frames__(array.shape[0], self.m_k_means_training_frames)]
+
+    # Normalizes the array if required; the standard deviation is computed from all feature vectors
     utils.debug(" .... Normalizing the array")
     if not self.m_normalize_before_k_means:
-      normalized_array = array
+      normalized_array = k_means_array
     else:
-      normalized_array, std_array = self.__normalize_std_array__(array)
-
+      std_array = self.__moments__(array)[2]
+      normalized_array = k_means_array / std_array
 
     # Creates the machines (KMeans and GMM)
     utils.debug(" .... Creating machines")
@@ -168,8 +468,13 @@ class UBMGMM (Tool):
 
     # Trains the GMM
     utils.info("  -> Training GMM")
-    trainer = bob.learn.em.ML_GMMTrainer(self.m_update_means, self.m_update_variances, self.m_update_weights)
-    bob.learn.em.train(trainer, self.m_ubm, array, self.m_gmm_training_iterations, self.m_training_threshold, bob.core.random.mt19937(self.m_init_seed))
+    if self.m_number_of_threads > 1:
+      # the E-step is computed in several threads
+      self.__train_gmm__(array)
+    else:
+      trainer = bob.learn.em.ML_GMMTrainer(self.m_update_means, self.m_update_variances, self.m_update_weights)
+      bob.learn.em.train(trainer, self.m_ubm, array, self.m_gmm_training_iterations, self.m_training_threshold, bob.core.random.mt19937(self.m_init_seed))
+    self.m_ubm_hash = self.__ubm_hash__()
 
 
   def _save_projector(self, projector_file):
@@ -184,10 +489,13 @@ class UBMGMM (Tool):
 
     utils.info("  -> Training UBM model with %d training files" % len(train_features))
 
-    # Loads the data into an array
-    array = numpy.vstack(train_features)
-
-    self._train_projector_using_array(array)
+    if self.m_ubm_training_chunk_size is not None:
+      # the features are used chunk by chunk
+      self._train_projector_using_chunks(train_features)
+    else:
+      # Loads the data into an array
+      array = utils.vstack_features(train_features)
+      self._train_projector_using_array(array)
 
     self._save_projector(projector_file)
 
@@ -200,6 +508,7 @@ class UBMGMM (Tool):
     # read UBM
     self.m_ubm = bob.learn.em.GMMMachine(hdf5file)
     self.m_ubm.set_variance_thresholds(self.m_variance_threshold)
+    self.m_ubm_hash = self.__ubm_hash__()
     # Initializes GMMStats object
     self.m_gmm_stats = bob.learn.em.GMMStats(self.m_ubm.shape[0], self.m_ubm.shape[1])
 
@@ -216,9 +525,18 @@ class UBMGMM (Tool):
 
   def _project_using_array(self, array):
     utils.debug(" .... Projecting %d feature vectors" % array.shape[0])
+    if self.m_gmm_stats_cache_directory is not None:
+      cache_file = self.__cache_file__(array, self.m_ubm_hash)
+      stats = self.__read_cache__(cache_file)
+      if stats is not None:
+        return stats
+
     # Accumulates statistics
     self.m_gmm_stats.init()
-    self.m_ubm.acc_statistics(array, self.m_gmm_stats)
+    self.__acc_statistics__(array, self.m_gmm_stats)
+
+    if self.m_gmm_stats_cache_directory is not None:
+      self.__write_cache__(self.m_gmm_stats, cache_file)
 
     # return the resulting statistics
     return self.m_gmm_stats
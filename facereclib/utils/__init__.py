@@ -4,10 +4,13 @@
 # Roy Wallace <roy.wallace@idiap.ch>
 
 from . import histogram
+from . import gabor
+from . import pca
 from . import tests
 from . import resources
 from .logger import add_logger_command_line_option, set_verbosity_level, add_bob_handlers, debug, info, warn, error
 from .grid import GridParameters
+from .training_data import TrainingFeatures, StackingError, stack_training_features, vstack_features
 
 import bob.io.base
 import bob.io.image
@@ -15,6 +18,7 @@ import bob.ip.color
 
 import os
 import numpy
+import scipy.spatial
 import tempfile, tarfile
 
 def load(file):
@@ -121,16 +125,18 @@ def score_fusion_strategy(strategy_name = 'avarage'):
   Different strategies are employed:
 
   * ``'average'`` : The averaged score is computed using the :py:func:`numpy.average` function.
-  * ``'min'`` : The minimum score is computed using the :py:func:`min` function.
-  * ``'max'`` : The maximum score is computed using the :py:func:`max` function.
+  * ``'min'`` : The minimum score is computed using the :py:func:`numpy.min` function.
+  * ``'max'`` : The maximum score is computed using the :py:func:`numpy.max` function.
   * ``'median'`` : The median score is computed using the :py:func:`numpy.median` function.
   * ``None`` is also accepted, in which case ``None`` is returned.
+
+  All returned functions accept an ``axis`` parameter, so that they can be applied to score matrices.
   """
   try:
     return {
         'average' : numpy.average,
-        'min' : min,
-        'max' : max,
+        'min' : numpy.min,
+        'max' : numpy.max,
         'median' : numpy.median,
         None : None
     }[strategy_name]
@@ -139,6 +145,37 @@ def score_fusion_strategy(strategy_name = 'avarage'):
     return None
 
 
+def distance_matrix(distance_function, models, probes, variances = None):
+  """Computes the matrix of distances between all rows of the given models and all rows of the given probes.
+  The result is a 2D array of shape (len(models), len(probes)).
+
+  Distance functions of :py:mod:`scipy.spatial.distance` are evaluated with the compiled implementation of :py:func:`scipy.spatial.distance.cdist`.
+  Other functions are called once for each pair of model and probe.
+  If variances are given, they are handed to the distance function as the third parameter, e.g., for :py:func:`scipy.spatial.distance.seuclidean`.
+  """
+  name = getattr(distance_function, '__name__', None)
+  is_scipy_function = name is not None and getattr(scipy.spatial.distance, name, None) is distance_function
+  if is_scipy_function and variances is None and name in ('braycurtis', 'canberra', 'chebyshev', 'cityblock', 'correlation', 'cosine', 'euclidean', 'sqeuclidean'):
+    return scipy.spatial.distance.cdist(models, probes, name)
+  if is_scipy_function and name == 'seuclidean' and variances is not None:
+    return scipy.spatial.distance.cdist(models, probes, name, V = variances)
+  if variances is None:
+    return scipy.spatial.distance.cdist(models, probes, distance_function)
+  return scipy.spatial.distance.cdist(models, probes, lambda model, probe: distance_function(model, probe, variances))
+
+
+def distance_scores(distance_function, model, probes, factor = 1., variances = None, fusion_function = numpy.average):
+  """Computes the scores of the given model, which might contain several features in its rows, with all given probes, using :py:func:`distance_matrix`.
+  The distances are multiplied with the given factor, e.g., -1 to turn them into similarities.
+  If the model contains several features, their scores are fused for each probe using the given fusion function, see :py:func:`score_fusion_strategy`."""
+  # compute the full model feature x probe distance matrix
+  scores = factor * distance_matrix(distance_function, numpy.atleast_2d(model), numpy.vstack([probe.flatten() for probe in probes]), variances)
+  if scores.shape[0] == 1:
+    return scores[0]
+  # fuse the scores of multiple model features
+  return fusion_function(scores, axis = 0)
+
+
 def gray_channel(image, channel = 'gray'):
   """Returns the desired channel of the given image. Currently, gray, red, green and blue channels are supported."""
   if image.ndim == 2:
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Functions to store Gabor graphs as arrays instead of lists of :py:class:`bob.ip.gabor.Jet` objects.
+
+A graph is stored as a 2D array of shape (node, 2*wavelet), where each row contains the absolute values of the jet, followed by its phases.
+Several graphs (e.g., of a model) are stored as a 3D array of shape (graph, node, 2*wavelet)."""
+
+import numpy
+import bob.ip.gabor
+
+
+def graph_to_array(graph):
+  """Converts the given graph, which might be a list of :py:class:`bob.ip.gabor.Jet` objects or already an array, into a 2D array."""
+  if isinstance(graph, numpy.ndarray):
+    return graph
+  return numpy.array([numpy.concatenate((jet.abs, jet.phase)) for jet in graph])
+
+def graphs_to_array(graphs):
+  """Converts the given list of graphs into a 3D array."""
+  if isinstance(graphs, numpy.ndarray):
+    return graphs
+  return numpy.array([graph_to_array(graph) for graph in graphs])
+
+def array_to_graph(array):
+  """Converts the given 2D array into a list of :py:class:`bob.ip.gabor.Jet` objects; lists of jets are returned unchanged."""
+  if not isinstance(array, numpy.ndarray):
+    return array
+  absolute, phase = split(array)
+  return [bob.ip.gabor.Jet(absolute[n] * numpy.exp(1j * phase[n]), normalize = False) for n in range(array.shape[0])]
+
+def split(array):
+  """Returns views on the absolute values and the phases of the given 2D or 3D graph array."""
+  wavelets = array.shape[-1] // 2
+  return array[...,:wavelets], array[...,wavelets:]
+
+
+def save(array, hdf5):
+  """Writes the given 2D graph array or 3D array of graphs to the given HDF5 file."""
+  hdf5.set("GaborGraph" if array.ndim == 2 else "GaborGraphs", array)
+
+def is_array_file(hdf5):
+  """Returns True if the given HDF5 file contains a graph array written with :py:func:`save`."""
+  return hdf5.has_key("GaborGraph") or hdf5.has_key("GaborGraphs")
+
+def load(hdf5):
+  """Reads the 2D graph array or the 3D array of graphs from the given HDF5 file."""
+  return hdf5.read("GaborGraph" if hdf5.has_key("GaborGraph") else "GaborGraphs")
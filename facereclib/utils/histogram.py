@@ -20,15 +20,23 @@
 import numpy
 
 def sparsify(array):
-  """This function generates a sparse histogram from a non-sparse one."""
+  """This function generates a sparse histogram from a non-sparse one.
+  The sparse histogram is a 2D array, which contains the indices of the non-zero bins in the first row and their values in the second row."""
   if len(array.shape) == 2 and array.shape[0] == 2:
     return array
   assert len(array.shape) == 1
-  indices = []
-  values = []
-  for i in range(array.shape[0]):
-    if array[i] != 0.:
-      indices.append(i)
-      values.append(array[i])
+  indices = numpy.flatnonzero(array)
+  return numpy.vstack((indices, array[indices])).astype(numpy.float64)
 
-  return numpy.array([indices, values], dtype = numpy.float64)
+
+def sparsify_batch(arrays):
+  """This function generates sparse histograms from several non-sparse histograms of the same length at once.
+  The histograms can be given as a list of 1D arrays, or as the rows of a 2D array.
+  It returns a list of sparse histograms, each in the same layout as returned by :py:func:`sparsify`."""
+  arrays = numpy.asarray(arrays)
+  assert len(arrays.shape) == 2
+  rows, indices = numpy.nonzero(arrays)
+  sparse = numpy.vstack((indices, arrays[rows, indices])).astype(numpy.float64)
+  # the non-zero entries are sorted by row; split them at the row boundaries
+  boundaries = numpy.cumsum(numpy.bincount(rows, minlength = arrays.shape[0]))[:-1]
+  return numpy.split(sparse, boundaries, axis = 1)
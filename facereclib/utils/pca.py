@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Functions to train a PCA projection chunk by chunk, without stacking all training features into one array.
+
+The training features are iterated several times, each time in chunks of the given number of features, which are flattened into the rows of a 2D array.
+Hence, the features might be given as a list of arrays, a list of lists of arrays (one for each client), or as :py:class:`facereclib.utils.TrainingFeatures`, which might be memory-mapped."""
+
+import numpy
+import bob.learn.linear
+
+from .logger import info
+
+
+def chunks(features, chunk_size):
+  """Yields the given features in chunks of the given number of features; each chunk is a 2D array of flattened features."""
+  if len(features) and isinstance(features[0], list):
+    features = [feature for client in features for feature in client]
+  for start in range(0, len(features), chunk_size):
+    yield numpy.vstack([numpy.asarray(feature, numpy.float64).flatten() for feature in features[start : start + chunk_size]])
+
+
+def variance_dimension(eigenvalues, fraction):
+  """Returns the number of eigenvalues that are required to keep the given fraction of the variance.
+  As in the PCA and LDA tools, the eigenvector that exceeds the fraction is not included."""
+  cummulated = numpy.cumsum(eigenvalues) / numpy.sum(eigenvalues)
+  return int(min(numpy.searchsorted(cummulated, fraction, side = 'right'), len(cummulated) - 1))
+
+
+def __mean__(features, chunk_size):
+  """Computes the number of features and their mean in one pass over the data."""
+  count, total = 0, None
+  for chunk in chunks(features, chunk_size):
+    count += chunk.shape[0]
+    total = chunk.sum(axis = 0) if total is None else total + chunk.sum(axis = 0)
+  if count < 2:
+    raise ValueError("PCA requires at least two training features, but got %d" % count)
+  return count, total / count
+
+
+def __covariance_product__(features, chunk_size, mean, matrix):
+  """Computes the product of the scatter matrix of the features with the given matrix in one pass over the data, without computing the scatter matrix."""
+  result = numpy.zeros(matrix.shape)
+  for chunk in chunks(features, chunk_size):
+    chunk -= mean
+    result += numpy.dot(chunk.T, numpy.dot(chunk, matrix))
+  return result
+
+
+def __covariance_eigenvectors__(features, chunk_size, mean, count):
+  """Computes all eigenvectors and eigenvalues of the covariance matrix, which is accumulated chunk by chunk."""
+  scatter = numpy.zeros((mean.shape[0], mean.shape[0]))
+  for chunk in chunks(features, chunk_size):
+    chunk -= mean
+    scatter += numpy.dot(chunk.T, chunk)
+  eigenvalues, eigenvectors = numpy.linalg.eigh(scatter / (count - 1))
+  # the covariance matrix has at most count-1 non-zero eigenvalues
+  rank = min(mean.shape[0], count - 1)
+  return eigenvalues[::-1][:rank], eigenvectors[:,::-1][:,:rank]
+
+
+def __randomized_eigenvectors__(features, chunk_size, mean, count, dimension, oversampling, iterations, seed):
+  """Approximates the largest eigenvectors and eigenvalues of the covariance matrix with randomized subspace iterations.
+  Only matrices of size (feature dimension) x (dimension + oversampling) are held in memory."""
+  width = min(dimension + (dimension if oversampling is None else oversampling), mean.shape[0])
+  basis = numpy.random.RandomState(seed).normal(size = (mean.shape[0], width))
+  for i in range(iterations):
+    basis, _ = numpy.linalg.qr(__covariance_product__(features, chunk_size, mean, basis))
+  # Rayleigh-Ritz: solve the eigenvalue problem in the subspace
+  eigenvalues, rotation = numpy.linalg.eigh(numpy.dot(basis.T, __covariance_product__(features, chunk_size, mean, basis)) / (count - 1))
+  eigenvectors = numpy.dot(basis, rotation)
+  return eigenvalues[::-1][:dimension], eigenvectors[:,::-1][:,:dimension]
+
+
+def train(features, subspace_dimension = None, chunk_size = 1024, randomized = False, oversampling = None, iterations = 4, seed = 42):
+  """Trains a PCA projection matrix from the given features, which are read chunk by chunk with the given number of features per chunk.
+
+  Returns a :py:class:`bob.learn.linear.Machine` and the eigenvalues (i.e., the variances), both sorted by decreasing eigenvalue, like :py:meth:`bob.learn.linear.PCATrainer.train`.
+  Only the first subspace_dimension eigenvectors are kept, if it is an integral value.
+  If it is a float (or None), all eigenvectors are returned, and the caller can compute the number of eigenvectors to keep, e.g., using :py:func:`variance_dimension`.
+
+  By default, the covariance matrix is accumulated, which requires memory quadratic in the feature dimension, and the exact eigenvectors are computed.
+  If randomized is enabled and subspace_dimension is integral, the eigenvectors are approximated with randomized subspace iterations instead.
+  In this case, the training features are iterated iterations+2 times, and the subspace is extended by the given number of oversampling dimensions (by default, by subspace_dimension)."""
+  count, mean = __mean__(features, chunk_size)
+  if not isinstance(subspace_dimension, int):
+    # the variance criterion requires all eigenvalues
+    randomized = False
+
+  if randomized:
+    info("  -> Approximating %d PCA dimensions of %d features with randomized subspace iterations" % (subspace_dimension, count))
+    eigenvalues, eigenvectors = __randomized_eigenvectors__(features, chunk_size, mean, count, subspace_dimension, oversampling, iterations, seed)
+  else:
+    info("  -> Computing PCA from the covariance matrix of %d features" % count)
+    eigenvalues, eigenvectors = __covariance_eigenvectors__(features, chunk_size, mean, count)
+    if isinstance(subspace_dimension, int):
+      eigenvalues, eigenvectors = eigenvalues[:subspace_dimension], eigenvectors[:,:subspace_dimension]
+
+  # make the signs of the eigenvectors reproducible: the largest absolute entry is positive
+  signs = numpy.sign(eigenvectors[numpy.argmax(numpy.abs(eigenvectors), axis = 0), numpy.arange(eigenvectors.shape[1])])
+  eigenvectors *= numpy.where(signs == 0, 1., signs)
+
+  machine = bob.learn.linear.Machine(numpy.ascontiguousarray(eigenvectors))
+  machine.input_subtract = mean
+  return machine, numpy.maximum(eigenvalues, 0.).copy()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+import os
+import tempfile
+import numpy
+
+
+class TrainingFeatures (list):
+  """A list of training features (or a list of lists of features, one for each client), which all share one 2D array.
+  Each 2D feature is a view of consecutive rows of the array, and each 1D feature a view of a single row.
+  The complete array is available as the ``array`` member, and the first row of each feature in the ``offsets`` member."""
+
+  def __init__(self, array, offsets, feature_ndim, client_offsets = None, filename = None):
+    self.array = array
+    self.offsets = offsets
+    self.feature_ndim = feature_ndim
+    self.client_offsets = client_offsets
+    self.m_filename = filename
+
+    if feature_ndim == 1:
+      views = [array[offsets[i]] for i in range(len(offsets)-1)]
+    else:
+      views = [array[offsets[i]:offsets[i+1]] for i in range(len(offsets)-1)]
+
+    if client_offsets is None:
+      list.__init__(self, views)
+    else:
+      list.__init__(self, [views[client_offsets[c]:client_offsets[c+1]] for c in range(len(client_offsets)-1)])
+
+
+  def close(self):
+    """Releases the array; if it was memory-mapped, the underlying file is removed."""
+    del self[:]
+    self.array = None
+    if self.m_filename is not None:
+      os.remove(self.m_filename)
+      self.m_filename = None
+
+
+class StackingError (ValueError):
+  """Raised by :py:func:`stack_training_features` if the features cannot be stored in one array.
+  The features that were read until the error occurred are kept in the ``features`` member, so that they do not need to be read again."""
+
+  def __init__(self, message, features):
+    ValueError.__init__(self, message)
+    self.features = features
+
+
+def __split_features__(array, offsets, feature_ndim):
+  """Returns the features stored in the rows of the given array as a list of arrays"""
+  if feature_ndim == 1:
+    return [array[offsets[i]] for i in range(len(offsets)-1)]
+  return [array[offsets[i]:offsets[i+1]] for i in range(len(offsets)-1)]
+
+
+def stack_training_features(features, directory = None, memory_map = False, client_sizes = None, count = None):
+  """Stores the given features in one 2D array and returns them as :py:class:`TrainingFeatures`.
+
+  The features (which might be given by a generator) need to be 1D or 2D arrays with the same number of columns.
+  If memory_map is disabled, the array is allocated in memory for the given count of features (if given) and filled directly; it grows if more rows are required.
+  If memory_map is enabled, the features are streamed into a temporary file in the given directory, and the array is a :py:class:`numpy.memmap` of this file.
+  In both cases, at no time two copies of the data are held in memory.
+  If client_sizes is given, the features are split into one list per client, each of which contains the given number of features.
+
+  A :py:class:`StackingError` is raised if the features cannot be stored in one array."""
+  offsets = [0]
+  dtype = feature_ndim = columns = None
+  array = filename = None
+  if memory_map:
+    handle, filename = tempfile.mkstemp('.bin', 'frl_', directory)
+    f = os.fdopen(handle, 'wb')
+
+  succeeded = False
+  try:
+    for feature in features:
+      message = None
+      if not isinstance(feature, numpy.ndarray) or feature.ndim not in (1,2):
+        message = "only 1D or 2D numpy arrays can be stacked, but got %s" % type(feature)
+      elif dtype is None:
+        dtype, feature_ndim, columns = feature.dtype, feature.ndim, feature.shape[-1]
+      elif feature.ndim != feature_ndim or feature.shape[-1] != columns:
+        message = "the features have different shapes %s and %s" % (feature.shape, (columns,) if feature_ndim == 1 else (None, columns))
+
+      if message is not None:
+        # hand the features that were read so far to the caller
+        read = []
+        if memory_map and dtype is not None:
+          f.close()
+          read = [numpy.array(stored) for stored in __split_features__(numpy.fromfile(filename, dtype).reshape((offsets[-1], columns)), offsets, feature_ndim)]
+        elif array is not None:
+          read = __split_features__(array, offsets, feature_ndim)
+        raise StackingError(message, read + [feature])
+
+      rows = 1 if feature_ndim == 1 else feature.shape[0]
+      if memory_map:
+        numpy.ascontiguousarray(feature, dtype).tofile(f)
+      else:
+        if array is None:
+          array = numpy.empty(((count or 1) * rows, columns), dtype)
+        elif offsets[-1] + rows > array.shape[0]:
+          # grow the array geometrically
+          grown = numpy.empty((max(2 * array.shape[0], offsets[-1] + rows), columns), dtype)
+          grown[:offsets[-1]] = array[:offsets[-1]]
+          array = grown
+        array[offsets[-1] : offsets[-1] + rows] = feature
+      offsets.append(offsets[-1] + rows)
+
+    if dtype is None:
+      raise StackingError("no features were given", [])
+    shape = (offsets[-1], columns)
+
+    if memory_map:
+      f.close()
+      array = numpy.memmap(filename, dtype, 'r+', shape = shape)
+    elif array.shape[0] != shape[0]:
+      # release the rows that were allocated too much
+      array.resize(shape, refcheck = False)
+    succeeded = True
+  finally:
+    if memory_map and not succeeded:
+      f.close()
+      os.remove(filename)
+
+  client_offsets = None
+  if client_sizes is not None:
+    client_offsets = list(numpy.cumsum([0] + list(client_sizes)))
+
+  return TrainingFeatures(array, offsets, feature_ndim, client_offsets, filename)
+
+
+def vstack_features(features, flatten = False):
+  """Returns all given features, which might be a list of features or a list of lists of features (one for each client), as rows of one 2D array.
+  If flatten is enabled, each feature is flattened into a single row.
+  For :py:class:`TrainingFeatures`, the shared array is returned without copying the data."""
+  if isinstance(features, TrainingFeatures) and (not flatten or features.feature_ndim == 1):
+    return features.array
+  if len(features) and isinstance(features[0], list):
+    features = [feature for client in features for feature in client]
+  return numpy.vstack([feature.flatten() for feature in features] if flatten else features)